@@ -0,0 +1,156 @@
+"""
+Дисковый кэш ответов VK API с обновлением устаревших записей в фоне
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import logger, API_CACHE_FILE, API_CACHE_POLICY, VK_API_VERSION
+
+# Параметры запроса, которые не влияют на ответ
+IGNORED_PARAMS = {"access_token", "v"}
+
+def make_key(method, params, scope):
+    """Ключ ответа: метод, нормализованные параметры (без токена) и владелец кэша"""
+    normalized = {
+        name: str(value) for name, value in params.items()
+        if name not in IGNORED_PARAMS and value is not None
+    }
+    return json.dumps([scope, VK_API_VERSION, method, normalized], sort_keys=True, ensure_ascii=False)
+
+def _digest(data):
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+class ApiCache:
+    """Ответы VK API в SQLite со своим временем жизни для каждого метода.
+
+    Свежий ответ отдается без запроса. Устаревший, но еще допустимый ответ отдается сразу,
+    а в фоне запрашивается новый; если содержимое не изменилось, обновляется только время.
+    """
+    def __init__(self, path=API_CACHE_FILE, policy=API_CACHE_POLICY):
+        self.policy = policy
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="api-cache")
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    stored REAL NOT NULL,
+                    digest TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+        self._prune()
+
+    def fetch(self, method, params, scope, request, policy_method=None):
+        """Получить ответ из кэша или через request(); policy_method - чей срок жизни применять"""
+        policy = self.policy.get(policy_method or method)
+        if policy is None or scope is None:
+            return request()
+
+        ttl, max_stale = policy
+        key = make_key(method, params, scope)
+        entry = self._lookup(key)
+        if entry is not None:
+            age, data = entry
+            if age < ttl:
+                self.hits += 1
+                return data
+            if age < ttl + max_stale:
+                self.stale_hits += 1
+                self._revalidate(key, request)
+                return data
+
+        self.misses += 1
+        data = request()
+        self._store(key, data)
+        return data
+
+    def clear(self):
+        """Удалить все сохраненные ответы"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses")
+
+    def log_stats(self):
+        """Записать статистику попаданий в лог"""
+        logger.info(
+            f"Кэш API: свежих ответов {self.hits}, устаревших с обновлением {self.stale_hits}, "
+            f"запросов в VK {self.misses}"
+        )
+
+    def close(self):
+        """Закрыть базу; фоновые обновления не дожидаемся"""
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            self.conn.close()
+
+    def _lookup(self, key):
+        """Возраст и данные записи или None"""
+        with self._lock:
+            row = self.conn.execute("SELECT stored, data FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        stored, data = row
+        try:
+            return time.time() - stored, json.loads(data)
+        except ValueError:
+            return None
+
+    def _store(self, key, data):
+        """Сохранить удачный ответ; неизменившийся ответ только продлевается"""
+        if not isinstance(data, dict) or "response" not in data:
+            return
+        serialized = json.dumps(data, ensure_ascii=False)
+        digest = _digest(serialized)
+        try:
+            with self._lock, self.conn:
+                updated = self.conn.execute(
+                    "UPDATE responses SET stored = ? WHERE key = ? AND digest = ?", (time.time(), key, digest)
+                ).rowcount
+                if not updated:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, stored, digest, data) VALUES (?, ?, ?, ?)",
+                        (key, time.time(), digest, serialized)
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"Не удалось сохранить ответ API в кэш: {e}")
+
+    def _revalidate(self, key, request):
+        """Запросить свежий ответ в фоне (не больше одного запроса на ключ)"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._store(key, request())
+            except Exception as e:
+                logger.warning(f"Не удалось обновить ответ API в фоне: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        try:
+            self._executor.submit(refresh)
+        except RuntimeError:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _prune(self):
+        """Удалить записи, которые уже нельзя показывать ни для одного метода"""
+        if not self.policy:
+            return
+        longest = max(ttl + max_stale for ttl, max_stale in self.policy.values())
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses WHERE stored < ?", (time.time() - longest,))
@@ -0,0 +1,465 @@
+"""
+Движки воспроизведения: внешний mplayer и встроенный GStreamer
+"""
+
+import time
+import subprocess
+import threading
+from config import (logger, AUDIO_BACKEND, STREAM_CACHE_KB, STREAM_CACHE_MIN_PERCENT, PLAYER_MAX_RESTARTS,
+                    GST_BUFFER_DURATION, GST_DIRECT_HTTP)
+
+# Попытка импорта GStreamer
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    GST_AVAILABLE = True
+except (ImportError, ValueError):
+    GST_AVAILABLE = False
+
+# Элементы GStreamer, без которых треки не сыграть: чтение http, вывод звука и хотя бы один декодер MP3
+GST_REQUIRED_ELEMENTS = ("playbin", "souphttpsrc", "autoaudiosink")
+GST_MP3_DECODERS = ("mpg123audiodec", "avdec_mp3", "mad", "flump3dec")
+
+# Сообщения mplayer о том, что файл не удалось воспроизвести
+ERROR_MARKERS = ("Failed to open", "Cannot open file", "Failed to recognize file format",
+                 "No stream found", "Error while decoding")
+
+class AudioBackend:
+    """Интерфейс движка воспроизведения.
+
+    Источник - путь к файлу или http-ссылка. О событиях движок сообщает через колбэки:
+    on_file_started(источник), on_end_of_stream(), on_position(сек), on_duration(сек),
+    on_error(текст, fatal).
+    """
+    name = None
+    direct_http = False  # умеет ли движок сам читать http с CDN (без локального прокси)
+
+    def __init__(self):
+        self.on_file_started = None
+        self.on_end_of_stream = None
+        self.on_position = None
+        self.on_duration = None
+        self.on_error = None
+
+    def load(self, source):
+        """Начать воспроизведение источника, заменив текущий и очередь"""
+        raise NotImplementedError
+
+    def enqueue(self, source):
+        """Поставить источник в очередь для воспроизведения без паузы"""
+        raise NotImplementedError
+
+    def set_paused(self, paused):
+        raise NotImplementedError
+
+    def seek(self, position):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def set_volume(self, volume):
+        """Громкость 0-100"""
+        raise NotImplementedError
+
+    def request_position(self):
+        """Запросить позицию; ответ придет через on_position"""
+        raise NotImplementedError
+
+    def query_position(self):
+        """Точная позиция без обращения к другому процессу или None, если движок так не умеет"""
+        return None
+
+    def shutdown(self):
+        raise NotImplementedError
+
+    def _emit(self, callback, *args):
+        if callback:
+            callback(*args)
+
+class MplayerBackend(AudioBackend):
+    """Долгоживущий процесс mplayer в slave-режиме, управляемый текстовыми командами"""
+    name = "mplayer"
+
+    def __init__(self, volume, streaming=True, gapless=True):
+        super().__init__()
+        self.volume = volume
+        self.streaming = streaming
+        self.gapless = gapless
+        self.process = None
+        self._source = None  # текущий источник - для продолжения после падения процесса
+        self._queue = []
+        self._paused = False
+        self._position = 0
+        self._restarts = []  # время аварийных перезапусков mplayer
+        self._shutting_down = False
+        self._process_lock = threading.Lock()
+
+    def _mplayer_args(self):
+        """Аргументы долгоживущего процесса mplayer"""
+        # -idle: процесс не завершается после трека и ждет следующий loadfile;
+        # global=6 включает строки "EOF code", по которым виден конец трека
+        args = ['mplayer', '-slave', '-idle', '-quiet', '-identify', '-msglevel', 'global=6',
+                '-softvol', '-volume', str(int(self.volume))]
+        if self.streaming:
+            args += ['-cache', str(STREAM_CACHE_KB), '-cache-min', str(STREAM_CACHE_MIN_PERCENT)]
+        if self.gapless:
+            args.append('-gapless-audio')
+        return args
+
+    def _ensure_process(self):
+        """Вернуть работающий процесс mplayer, при необходимости запустив новый"""
+        with self._process_lock:
+            process = self.process
+            if process and process.poll() is None:
+                return process
+
+            process = subprocess.Popen(
+                self._mplayer_args(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+                bufsize=1
+            )
+            self.process = process
+
+            # Мониторинг вывода: смена файла, конец трека, позиция
+            threading.Thread(target=self._monitor_player, args=(process,), daemon=True).start()
+            logger.info("mplayer запущен")
+            return process
+
+    def _send(self, command):
+        """Отправить команду mplayer; упавший процесс перезапускается"""
+        for attempt in range(2):
+            process = self._ensure_process()
+            try:
+                process.stdin.write(command + "\n")
+                process.stdin.flush()
+                return True
+            except (BrokenPipeError, OSError, ValueError) as e:
+                logger.warning(f"mplayer не принял команду ({e}), перезапускаем")
+                with self._process_lock:
+                    if self.process is process:
+                        self.process = None
+        return False
+
+    def load(self, source):
+        self._source = source
+        self._queue = []
+        self._paused = False
+        self._position = 0
+        return self._send(f'loadfile "{source}" 0')
+
+    def enqueue(self, source):
+        if not self.gapless:
+            return False
+        self._queue.append(source)
+        return self._send(f'loadfile "{source}" 1')
+
+    def set_paused(self, paused):
+        if paused != self._paused:
+            self._paused = paused
+            self._send("pause")
+
+    def seek(self, position):
+        self._position = position
+        self._send(f"seek {position} 2")
+
+    def stop(self):
+        had_source = self._source is not None
+        self._source = None
+        self._queue = []
+        self._paused = False
+        process = self.process
+        if had_source and process and process.poll() is None:
+            self._send("stop")
+
+    def set_volume(self, volume):
+        # Громкость запоминаем: она применяется и к перезапущенному mplayer
+        self.volume = volume
+        process = self.process
+        if process and process.poll() is None:
+            # pausing_keep - не снимать паузу при смене громкости
+            self._send(f"pausing_keep volume {volume} 1")
+
+    def request_position(self):
+        process = self.process
+        if process and process.poll() is None:
+            try:
+                # pausing_keep_force: запрос позиции не должен снимать паузу
+                process.stdin.write("pausing_keep_force get_time_pos\n")
+                process.stdin.flush()
+            except (OSError, ValueError):
+                pass
+
+    def shutdown(self):
+        with self._process_lock:
+            self._shutting_down = True
+            process, self.process = self.process, None
+
+        if process:
+            try:
+                process.stdin.write("quit\n")
+                process.stdin.flush()
+                process.wait(timeout=2)
+            except Exception:
+                process.kill()
+
+    def _monitor_player(self, process):
+        """Мониторинг вывода mplayer"""
+        while process.poll() is None:
+            try:
+                line = process.stdout.readline()
+                if not line:
+                    break
+                if process is not self.process:
+                    continue
+
+                # Парсим позицию воспроизведения
+                if line.startswith('ANS_TIME_POSITION='):
+                    try:
+                        self._position = float(line.split('=')[1].strip())
+                        self._emit(self.on_position, self._position)
+                    except:
+                        pass
+                elif line.startswith('ID_LENGTH='):
+                    try:
+                        length = float(line.split('=')[1].strip())
+                        if length > 0:
+                            self._emit(self.on_duration, length)
+                    except ValueError:
+                        pass
+                elif line.startswith(ERROR_MARKERS):
+                    logger.error(f"mplayer: {line.strip()}")
+                    self._emit(self.on_error, line.strip(), False)
+                elif line.startswith('ID_FILENAME='):
+                    filename = line.split('=', 1)[1].strip()
+                    if filename in self._queue:
+                        self._queue.remove(filename)
+                        self._source = filename
+                        self._position = 0
+                    self._emit(self.on_file_started, filename)
+                elif line.startswith('EOF code: 1'):
+                    # 1 - файл доигран; замена трека и stop дают другие коды
+                    if not self._queue:
+                        self._source = None
+                    self._emit(self.on_end_of_stream)
+
+            except:
+                break
+
+        process.wait()
+        self._on_process_exit(process)
+
+    def _on_process_exit(self, process):
+        """Проверка здоровья: mplayer упал - перезапускаем и продолжаем трек с той же позиции"""
+        with self._process_lock:
+            if process is not self.process or self._shutting_down:
+                return
+            self.process = None
+        logger.warning(f"mplayer неожиданно завершился (код {process.returncode})")
+
+        now = time.monotonic()
+        self._restarts = [t for t in self._restarts if now - t < 60] + [now]
+        if len(self._restarts) > PLAYER_MAX_RESTARTS:
+            # Процесс падает раз за разом - не зацикливаемся, останавливаем воспроизведение
+            logger.error("mplayer падает слишком часто, воспроизведение остановлено")
+            self._source = None
+            self._queue = []
+            self._emit(self.on_error, "mplayer падает слишком часто", True)
+            return
+
+        source, queue, paused, position = self._source, list(self._queue), self._paused, self._position
+        if source:
+            self.load(source)
+            if position > 0:
+                self.seek(position)
+            if paused:
+                self.set_paused(True)
+            for queued in queue:
+                self.enqueue(queued)
+
+class GStreamerBackend(AudioBackend):
+    """Воспроизведение внутри процесса через GStreamer playbin с собственной буферизацией http"""
+    name = "gstreamer"
+    # По умолчанию поток идет через локальный прокси, который сохраняет его в аудиокэш
+    direct_http = GST_DIRECT_HTTP
+
+    # Флаги playbin: только звук, программная громкость, буферизация прогрессивной загрузки
+    PLAY_FLAG_AUDIO = 0x02
+    PLAY_FLAG_SOFT_VOLUME = 0x10
+    PLAY_FLAG_DOWNLOAD = 0x80
+
+    def __init__(self, volume, http_headers=None):
+        super().__init__()
+        Gst.init(None)
+        # Без нужных плагинов каждый трек падал бы с ошибкой - лучше сразу уступить mplayer
+        missing = [name for name in GST_REQUIRED_ELEMENTS if Gst.ElementFactory.find(name) is None]
+        if not any(Gst.ElementFactory.find(name) for name in GST_MP3_DECODERS):
+            missing.append("декодер MP3")
+        if missing:
+            raise RuntimeError(f"нет элементов: {', '.join(missing)}")
+        self.http_headers = dict(http_headers or {})
+        self.playbin = Gst.ElementFactory.make("playbin", "vk-player")
+        if self.playbin is None:
+            raise RuntimeError("элемент playbin недоступен")
+        self.playbin.set_property("flags", self.PLAY_FLAG_AUDIO | self.PLAY_FLAG_SOFT_VOLUME | self.PLAY_FLAG_DOWNLOAD)
+        self.playbin.set_property("buffer-duration", int(GST_BUFFER_DURATION * Gst.SECOND))
+        self.playbin.set_property("volume", volume / 100.0)
+        self.playbin.connect("source-setup", self._on_source_setup)
+        # Следующий трек подставляется до конца текущего - переход без паузы
+        self.playbin.connect("about-to-finish", self._on_about_to_finish)
+
+        self._lock = threading.Lock()
+        self._source = None
+        self._queue = []
+        self._pending_source = None  # подставлен в about-to-finish, начнется со STREAM_START
+        self._paused = False
+        self._buffering = False
+
+        bus = self.playbin.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self._on_message)
+
+    @staticmethod
+    def _to_uri(source):
+        if source.startswith(('http://', 'https://', 'file://')):
+            return source
+        return Gst.filename_to_uri(source)
+
+    def load(self, source):
+        with self._lock:
+            self._source = source
+            self._queue = []
+            self._pending_source = None
+            self._paused = False
+        self.playbin.set_state(Gst.State.READY)
+        self.playbin.set_property("uri", self._to_uri(source))
+        result = self.playbin.set_state(Gst.State.PLAYING)
+        return result != Gst.StateChangeReturn.FAILURE
+
+    def enqueue(self, source):
+        with self._lock:
+            self._queue.append(source)
+        return True
+
+    def set_paused(self, paused):
+        self._paused = paused
+        if not self._buffering:
+            self.playbin.set_state(Gst.State.PAUSED if paused else Gst.State.PLAYING)
+
+    def seek(self, position):
+        self.playbin.seek_simple(
+            Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, int(position * Gst.SECOND)
+        )
+
+    def stop(self):
+        with self._lock:
+            self._source = None
+            self._queue = []
+            self._pending_source = None
+        self.playbin.set_state(Gst.State.READY)
+
+    def set_volume(self, volume):
+        self.playbin.set_property("volume", volume / 100.0)
+
+    def request_position(self):
+        position = self.query_position()
+        if position is not None:
+            self._emit(self.on_position, position)
+
+    def query_position(self):
+        ok, position = self.playbin.query_position(Gst.Format.TIME)
+        return position / Gst.SECOND if ok else None
+
+    def shutdown(self):
+        self.playbin.set_state(Gst.State.NULL)
+        self.playbin.get_bus().remove_signal_watch()
+
+    def _on_source_setup(self, playbin, source):
+        """Заголовки для CDN VK при чтении http напрямую"""
+        if not source.find_property("user-agent"):
+            return
+        if 'User-Agent' in self.http_headers:
+            source.set_property("user-agent", self.http_headers['User-Agent'])
+        extra = {name: value for name, value in self.http_headers.items() if name != 'User-Agent'}
+        if extra and source.find_property("extra-headers"):
+            structure = Gst.Structure.new_empty("extra-headers")
+            for name, value in extra.items():
+                structure.set_value(name, value)
+            source.set_property("extra-headers", structure)
+
+    def _on_about_to_finish(self, playbin):
+        """Вызывается из потока GStreamer незадолго до конца трека"""
+        with self._lock:
+            if not self._queue:
+                return
+            self._pending_source = self._queue.pop(0)
+            uri = self._to_uri(self._pending_source)
+        playbin.set_property("uri", uri)
+
+    def _on_message(self, bus, message):
+        """Сообщения конвейера (в главном цикле)"""
+        if message.type == Gst.MessageType.EOS:
+            with self._lock:
+                # Следующий трек поставили в очередь уже после about-to-finish - запускаем его сами
+                next_source = self._queue.pop(0) if self._queue else None
+                self._source = next_source
+                self._pending_source = None
+            self.playbin.set_state(Gst.State.READY)
+            if next_source:
+                self.playbin.set_property("uri", self._to_uri(next_source))
+                if not self._paused:
+                    self.playbin.set_state(Gst.State.PLAYING)
+                self._emit(self.on_file_started, next_source)
+            else:
+                self._emit(self.on_end_of_stream)
+        elif message.type == Gst.MessageType.ERROR:
+            # После ошибки конвейер уже не играет: трек остановлен, очередь сброшена
+            error, debug = message.parse_error()
+            logger.error(f"GStreamer: {error.message} ({debug})")
+            with self._lock:
+                self._source = None
+                self._queue = []
+                self._pending_source = None
+            self.playbin.set_state(Gst.State.READY)
+            self._emit(self.on_error, error.message, True)
+        elif message.type == Gst.MessageType.STREAM_START:
+            with self._lock:
+                started = self._pending_source
+                self._pending_source = None
+                if started:
+                    self._source = started
+            if started:
+                self._emit(self.on_file_started, started)
+        elif message.type in (Gst.MessageType.DURATION_CHANGED, Gst.MessageType.ASYNC_DONE):
+            ok, duration = self.playbin.query_duration(Gst.Format.TIME)
+            if ok and duration > 0:
+                self._emit(self.on_duration, duration / Gst.SECOND)
+        elif message.type == Gst.MessageType.BUFFERING:
+            # Пока буфер http не заполнен, держим конвейер на паузе
+            percent = message.parse_buffering()
+            if percent < 100 and not self._buffering:
+                self._buffering = True
+                self.playbin.set_state(Gst.State.PAUSED)
+            elif percent >= 100 and self._buffering:
+                self._buffering = False
+                if not self._paused:
+                    self.playbin.set_state(Gst.State.PLAYING)
+
+def create_backend(volume, streaming=True, gapless=True, http_headers=None, name=AUDIO_BACKEND):
+    """Создать движок воспроизведения по настройке: gstreamer, mplayer или auto"""
+    if name in ("auto", "gstreamer") and GST_AVAILABLE:
+        try:
+            backend = GStreamerBackend(volume, http_headers)
+            logger.info("Движок воспроизведения: GStreamer")
+            return backend
+        except Exception as e:
+            logger.warning(f"GStreamer недоступен ({e}), используем mplayer")
+    elif name == "gstreamer":
+        logger.warning("GStreamer не установлен, используем mplayer")
+
+    logger.info("Движок воспроизведения: mplayer")
+    return MplayerBackend(volume, streaming, gapless)
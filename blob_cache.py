@@ -0,0 +1,159 @@
+"""
+Дисковый кэш аудиофайлов по идентификатору трека VK
+"""
+
+import os
+import uuid
+import shutil
+import threading
+from collections import OrderedDict
+from config import logger, AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_MB
+
+class BlobWriter:
+    """Запись нового файла в кэш через временный .part"""
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self.part_path = os.path.join(cache.cache_dir, f"{key}.{uuid.uuid4().hex}.part")
+        self.file = open(self.part_path, 'wb')
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Завершить запись и добавить файл в кэш"""
+        self.file.close()
+        return self.cache._commit(self.key, self.part_path, self.size)
+
+    def abort(self):
+        """Отменить запись"""
+        self.file.close()
+        try:
+            os.unlink(self.part_path)
+        except OSError:
+            pass
+
+class AudioBlobCache:
+    """Кэш треков с ключом owner_id_id (а не URL) и LRU-вытеснением по размеру"""
+    def __init__(self, cache_dir=AUDIO_CACHE_DIR, max_size_mb=AUDIO_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> размер, от давно использованных к недавним
+        self._total_size = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _load_index(self):
+        """Восстановить порядок LRU по времени изменения файлов"""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.part'):
+                # Незавершенные записи прошлой сессии
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+            elif entry.name.endswith('.mp3'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_size += size
+
+    def get(self, key):
+        """Получить путь к файлу трека или None"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path = self._path(key)
+            if not os.path.exists(path):
+                self._total_size -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+        try:
+            # Время изменения хранит порядок LRU между запусками
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def contains(self, key):
+        """Есть ли трек в кэше"""
+        with self._lock:
+            return key in self._entries
+
+    def size_of(self, key):
+        """Размер трека в кэше"""
+        with self._lock:
+            return self._entries.get(key, 0)
+
+    def writer(self, key):
+        """Начать запись трека в кэш"""
+        return BlobWriter(self, key)
+
+    def add_link(self, key, source_path):
+        """Добавить уже скачанный файл в кэш жесткой ссылкой (без копирования)"""
+        if self.contains(key):
+            return True
+        part_path = os.path.join(self.cache_dir, f"{key}.{uuid.uuid4().hex}.part")
+        try:
+            os.link(source_path, part_path)
+        except OSError:
+            return False
+        self._commit(key, part_path, os.path.getsize(part_path))
+        return True
+
+    def export(self, key, dest_path):
+        """Сохранить трек из кэша в указанный файл (жесткая ссылка или копия)"""
+        path = self.get(key)
+        if not path:
+            return False
+        try:
+            os.link(path, dest_path)
+        except OSError:
+            shutil.copyfile(path, dest_path)
+        return True
+
+    def _commit(self, key, part_path, size):
+        """Переместить готовый файл на место и вытеснить старые"""
+        path = self._path(key)
+        with self._lock:
+            os.replace(part_path, path)
+            if key in self._entries:
+                self._total_size -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._total_size += size
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep=None):
+        """Удалять давно не использованные треки, пока кэш больше лимита"""
+        while self._total_size > self.max_size and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._total_size -= self._entries.pop(key)
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+            logger.info(f"Аудиокэш: вытеснен {key}")
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+def get_blob_cache():
+    """Получить общий экземпляр аудиокэша"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = AudioBlobCache()
+        return _shared_cache
@@ -32,10 +32,78 @@ APP_NAME = "VK Music Player для Ubuntu"
 APP_VERSION = "1.0"
 DEFAULT_WINDOW_SIZE = (900, 700)
 DOWNLOAD_FOLDER = os.path.expanduser("~/VK_Music_Downloads")
+CACHE_DIR = os.path.expanduser("~/.cache/vk_moosic_player")
+LIBRARY_FULL_SYNC_INTERVAL = 24 * 3600  # не реже этого библиотека сверяется с VK целиком, сек
 
 # VK API настройки
 VK_API_VERSION = "5.131"
 KATE_USER_AGENT = "KateMobileAndroid/51.1-442 (Android 11; SDK 30; arm64-v8a; Samsung SM-G991B; ru_RU)"
+VK_API_URL = "https://api.vk.com/method/"
+VK_API_RATE_LIMIT = 3  # запросов в секунду на один токен
+VK_API_MIN_RATE = 0.5  # ниже этой частоты при ошибках "слишком много запросов" не опускаемся
+VK_API_RATE_STEP = 0.1  # на сколько запросов в секунду частота растет после каждого успешного ответа
+VK_API_RETRIES = 4  # повторов вызова после ошибок 6, 9 и 10
+VK_API_RETRY_DELAY = 0.5  # первая пауза перед повтором, дальше удваивается
+VK_API_CONCURRENCY = 3  # параллельных запросов при загрузке страниц
+VK_PAGE_SIZE = 200
+VK_EXECUTE_BATCH_SIZE = 25  # максимум вызовов в одном execute
+URL_TTL = 6 * 3600  # сколько считаем действующей ссылку на аудио без срока в самой ссылке, сек
+URL_EXPIRY_MARGIN = 15 * 60  # ссылку, которая скоро истечет, обновляем заранее
+URL_RESOLVE_BATCH = 100  # треков в одном запросе audio.getById
+
+# Настройки HTTP-транспорта
+HTTP_POOL_HOSTS = 10  # сколько хостов держать в пуле одновременно
+HTTP_POOL_SIZE = 10  # соединений на один хост
+HTTP_TIMEOUT = (5, 30)  # (подключение, чтение) в секундах
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+
+# Настройки воспроизведения
+STREAMING_PLAYBACK = True  # играть сразу из сети вместо полной предзагрузки
+STREAM_CHUNK_SIZE = 16 * 1024
+STREAM_CACHE_KB = 512  # размер кэша mplayer для сетевого потока
+STREAM_CACHE_MIN_PERCENT = 4  # заполнение кэша перед стартом, в процентах
+HLS_WORKERS = 4  # сегментов HLS, которые качаются одновременно
+PREFETCH_DEPTH = 2  # сколько следующих треков скачивать заранее
+PREFETCH_BUDGET_MB = 64  # лимит места под предзагруженные треки
+GAPLESS_PLAYBACK = True  # ставить следующий трек в очередь mplayer без паузы
+AUDIO_BACKEND = "auto"  # auto (GStreamer, если установлен), gstreamer или mplayer
+GST_BUFFER_DURATION = 3  # сколько секунд звука GStreamer буферизует из сети
+GST_DIRECT_HTTP = False  # GStreamer читает CDN сам, минуя локальный прокси (прослушанное не попадает в аудиокэш)
+PLAYER_DEFAULT_VOLUME = 80
+PLAYER_MAX_RESTARTS = 3  # аварийных перезапусков mplayer в минуту, после которых сдаемся
+POSITION_POLL_INTERVAL = 1.0  # как часто спрашивать позицию у mplayer во время воспроизведения, сек
+PLAYER_UI_REFRESH_MS = 250  # обновление ползунка и времени, пока трек играет
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "audio")
+AUDIO_CACHE_MAX_MB = 1024  # лимит аудиокэша, старые треки вытесняются
+
+# Настройки интерфейса
+TRACKS_FILL_CHUNK = 500  # строк списка треков за один проход главного цикла
+UI_BUS_FPS = 20  # максимум применений накопленных обновлений интерфейса в секунду
+
+# Потоки фоновых задач интерфейса по типу нагрузки
+TASK_POOL_SIZES = {"api": 4, "media": 2, "disk": 2}
+
+# Настройки поиска
+SEARCH_LOCAL_LIMIT = 200  # максимум локальных совпадений в выдаче
+SEARCH_INDEX_MIN_TYPO_LENGTH = 4  # более короткие слова ищем без учета опечаток
+SEARCH_DEBOUNCE_MS = 400  # пауза в наборе, после которой запрос уходит в VK
+SEARCH_CACHE_SIZE = 128  # запомненных страниц результатов поиска
+SEARCH_CACHE_TTL = 300  # время жизни запомненных результатов, сек
+
+# Кэш ответов VK API: метод -> (сколько ответ свежий, сколько еще его можно показывать, обновляя в фоне), сек
+API_CACHE_FILE = os.path.join(CACHE_DIR, "api_cache.sqlite3")
+API_CACHE_POLICY = {
+    "users.get": (24 * 3600, 30 * 24 * 3600),
+    "audio.getPlaylists": (10 * 60, 7 * 24 * 3600),
+    "audio.getRecommendations": (30 * 60, 12 * 3600),  # ссылки на аудио в ответе со временем истекают
+}
+
+# Настройки менеджера загрузок
+DOWNLOAD_QUEUE_FILE = os.path.join(CACHE_DIR, "download_queue.json")
+DOWNLOADS_INDEX_FILE = os.path.join(CACHE_DIR, "downloads_index.sqlite3")
+DOWNLOAD_WORKERS = 6  # всего одновременных загрузок
+DOWNLOAD_PER_HOST = 3  # одновременных загрузок с одного хоста CDN
 
 def check_dependencies():
     """Проверить зависимости"""
@@ -0,0 +1,250 @@
+"""
+Очередь загрузок с пулом рабочих потоков
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+from urllib.parse import urlparse
+from config import logger, DOWNLOAD_QUEUE_FILE, DOWNLOAD_WORKERS, DOWNLOAD_PER_HOST
+from track import get_track_table
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+JOB_STATE_LABELS = {
+    JOB_QUEUED: "В очереди",
+    JOB_RUNNING: "Скачивается",
+    JOB_DONE: "Готово",
+    JOB_FAILED: "Ошибка"
+}
+
+class DownloadJob:
+    """Задание на скачивание одного трека"""
+    def __init__(self, track, job_id=None, state=JOB_QUEUED, path=None, error=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.track = get_track_table().add(track)
+        self.key = self.track.key
+        self.state = state
+        self.path = path
+        self.error = error
+        self.bytes_done = 0
+
+    @property
+    def host(self):
+        """Хост CDN, с которого качается трек"""
+        return urlparse(self.track.url).netloc
+
+    @property
+    def title(self):
+        return f"{self.track.artist} - {self.track.title}"
+
+    def to_dict(self):
+        return {"id": self.id, "track": self.track.to_dict(), "state": self.state, "path": self.path, "error": self.error}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = data.get("state", JOB_QUEUED)
+        # Прерванные при выходе загрузки начинаем заново
+        if state == JOB_RUNNING:
+            state = JOB_QUEUED
+        return cls(data["track"], data.get("id"), state, data.get("path"), data.get("error"))
+
+class DownloadManager:
+    """Менеджер загрузок: сохраняемая очередь, пул потоков, лимит соединений на хост CDN"""
+    def __init__(self, manager, queue_file=DOWNLOAD_QUEUE_FILE, workers=DOWNLOAD_WORKERS, per_host=DOWNLOAD_PER_HOST):
+        self.manager = manager
+        self.queue_file = queue_file
+        self.workers = workers
+        self.per_host = per_host
+        self.on_job_changed = None  # вызывается из рабочего потока при смене состояния задания
+        self._jobs = OrderedDict()
+        self._running_by_host = {}
+        self._condition = threading.Condition()
+        self._samples = deque()  # (время, байт) для расчета скорости
+        self._threads = []
+        self._last_save = 0
+        self._load_queue()
+
+    def _load_queue(self):
+        """Загрузить незавершенные задания прошлой сессии"""
+        try:
+            with open(self.queue_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        for data in saved:
+            job = DownloadJob.from_dict(data)
+            if job.state != JOB_DONE:
+                self._jobs[job.id] = job
+        if self._jobs:
+            logger.info(f"Восстановлено заданий загрузки: {len(self._jobs)}")
+
+    def _save_queue(self, force=True):
+        """Сохранить очередь на диск (вызывается под блокировкой)"""
+        # При массовой загрузке пишем файл не чаще раза в пару секунд
+        now = time.monotonic()
+        if not force and now - self._last_save < 2:
+            return
+        self._last_save = now
+        try:
+            os.makedirs(os.path.dirname(self.queue_file), exist_ok=True)
+            tmp_path = self.queue_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([job.to_dict() for job in self._jobs.values()], f, ensure_ascii=False)
+            os.replace(tmp_path, self.queue_file)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить очередь загрузок: {e}")
+
+    def start(self):
+        """Запустить рабочие потоки"""
+        with self._condition:
+            if self._threads:
+                return
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, tracks):
+        """Поставить треки в очередь, вернуть созданные задания"""
+        created = []
+        with self._condition:
+            active_keys = {job.key for job in self._jobs.values() if job.state in (JOB_QUEUED, JOB_RUNNING)}
+            for track in tracks:
+                job = DownloadJob(track)
+                if job.key in active_keys:
+                    continue
+                active_keys.add(job.key)
+                self._jobs[job.id] = job
+                created.append(job)
+            self._save_queue()
+            self._condition.notify_all()
+        self.start()
+        for job in created:
+            self._notify(job)
+        return created
+
+    def retry_failed(self):
+        """Повторить упавшие задания"""
+        with self._condition:
+            failed = [job for job in self._jobs.values() if job.state == JOB_FAILED]
+            for job in failed:
+                job.state = JOB_QUEUED
+                job.error = None
+            self._save_queue()
+            self._condition.notify_all()
+        self.start()
+        for job in failed:
+            self._notify(job)
+        return len(failed)
+
+    def clear_finished(self):
+        """Убрать из списка завершенные задания"""
+        with self._condition:
+            for job_id in [job.id for job in self._jobs.values() if job.state == JOB_DONE]:
+                del self._jobs[job_id]
+            self._save_queue()
+
+    def get_jobs(self):
+        """Список всех заданий"""
+        with self._condition:
+            return list(self._jobs.values())
+
+    def is_active(self):
+        """Есть ли задания в очереди или в работе"""
+        with self._condition:
+            return any(job.state in (JOB_QUEUED, JOB_RUNNING) for job in self._jobs.values())
+
+    def get_stats(self):
+        """Сводка по очереди и текущая скорость"""
+        with self._condition:
+            counts = {state: 0 for state in JOB_STATE_LABELS}
+            for job in self._jobs.values():
+                counts[job.state] += 1
+            now = time.monotonic()
+            while self._samples and now - self._samples[0][0] > 5:
+                self._samples.popleft()
+            window_bytes = sum(size for _, size in self._samples)
+            window = now - self._samples[0][0] if self._samples else 0
+        counts["total"] = len(self._jobs)
+        counts["bytes_per_sec"] = window_bytes / max(window, 1.0) if window_bytes else 0.0
+        return counts
+
+    def _notify(self, job):
+        if self.on_job_changed:
+            self.on_job_changed(job)
+
+    def _next_job(self):
+        """Первое задание в очереди, для хоста которого есть свободный слот (под блокировкой)"""
+        for job in self._jobs.values():
+            if job.state == JOB_QUEUED and self._running_by_host.get(job.host, 0) < self.per_host:
+                return job
+        return None
+
+    def _on_bytes(self, job, size):
+        """Учет скачанных байт для расчета скорости"""
+        now = time.monotonic()
+        with self._condition:
+            job.bytes_done += size
+            self._samples.append((now, size))
+            while now - self._samples[0][0] > 5:
+                self._samples.popleft()
+
+    def _worker(self):
+        """Рабочий поток: берет задания из очереди и скачивает их"""
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                job.state = JOB_RUNNING
+                job.bytes_done = 0
+                host = job.host
+                self._running_by_host[host] = self._running_by_host.get(host, 0) + 1
+                # Кандидаты в пакетное обновление ссылок, с запасом на уже скачанные
+                queued = list(islice(
+                    (other.track for other in self._jobs.values() if other.state == JOB_QUEUED),
+                    self.manager.url_resolver.batch_size * 2
+                ))
+            self._notify(job)
+            
+            # Ссылки следующих заданий обновляются тем же запросом, что и ссылка текущего;
+            # уже скачанные и закэшированные треки сеть не трогают
+            try:
+                if self.manager.needs_network(job.track):
+                    ahead = list(islice(
+                        (track for track in queued if self.manager.needs_network(track)),
+                        self.manager.url_resolver.batch_size - 1
+                    ))
+                    self.manager.url_resolver.ensure(job.track, ahead)
+            except Exception as e:
+                logger.warning(f"Не удалось обновить ссылку перед загрузкой: {e}")
+
+            try:
+                success, message = self.manager.download_track(
+                    job.track, progress_callback=lambda size: self._on_bytes(job, size)
+                )
+            except Exception as e:
+                success, message = False, f"Ошибка скачивания: {e}"
+
+            with self._condition:
+                self._running_by_host[host] -= 1
+                if success:
+                    job.state = JOB_DONE
+                    job.path = message
+                else:
+                    job.state = JOB_FAILED
+                    job.error = message
+                drained = not any(j.state in (JOB_QUEUED, JOB_RUNNING) for j in self._jobs.values())
+                self._save_queue(force=drained)
+                self._condition.notify_all()
+            self._notify(job)
@@ -0,0 +1,262 @@
+"""
+Индекс папки загрузок: список файлов без полного перечитывания папки и реестр скачанных треков
+"""
+
+import os
+import sqlite3
+import threading
+from config import logger, DOWNLOADS_INDEX_FILE
+from library_cache import track_key
+
+AUDIO_EXTENSIONS = ('.mp3',)
+
+def track_filenames(track):
+    """Имена файла трека: обычное "Исполнитель - Название.mp3" и с ключом трека для совпадающих имен"""
+    artist = track.get('artist', 'Unknown Artist')
+    title = track.get('title', 'Unknown Title')
+    
+    safe_artist = "".join(c for c in artist if c.isalnum() or c in (' ', '-', '_')).strip()
+    safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
+    
+    return f"{safe_artist} - {safe_title}.mp3", f"{safe_artist} - {safe_title} [{track_key(track)}].mp3"
+
+class DownloadedFile:
+    """Файл в папке загрузок"""
+    __slots__ = ('path', 'size', 'mtime_ns')
+
+    def __init__(self, path, size, mtime_ns):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+class DownloadsIndex:
+    """Хранит (размер, время изменения) каждого файла папки загрузок в SQLite.
+
+    Новые загрузки добавляются по одной, а внешние изменения находятся сравнением
+    os.scandir с индексом; если папка не менялась (ее mtime прежний), сканирование пропускается.
+    Реестр помнит, в какой файл скачан каждый трек VK (owner_id_id), чтобы не качать его повторно.
+    """
+    def __init__(self, folder, path=DOWNLOADS_INDEX_FILE):
+        self.folder = os.path.abspath(folder)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._reserved = {}  # путь -> ключ трека, который сейчас в него качается
+        self._contested = set()  # обычные имена, под которые подходят несколько треков библиотеки
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS registry (
+                    track_key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS registry_path ON registry (path);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+            # adopted = 1: файл приписан треку по совпадению имени, а не скачан им
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(registry)")}
+            if "adopted" not in columns:
+                self.conn.execute("ALTER TABLE registry ADD COLUMN adopted INTEGER NOT NULL DEFAULT 0")
+
+    def entries(self):
+        """Все известные файлы папки"""
+        with self._lock:
+            rows = self.conn.execute("SELECT path, size, mtime_ns FROM files").fetchall()
+        prefix = self.folder + os.sep
+        return [DownloadedFile(*row) for row in rows if row[0].startswith(prefix)]
+
+    def add(self, path):
+        """Добавить или обновить один файл (например, только что скачанный)"""
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.folder or not path.lower().endswith(AUDIO_EXTENSIONS):
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = DownloadedFile(path, stat.st_size, stat.st_mtime_ns)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                (entry.path, entry.size, entry.mtime_ns)
+            )
+        return entry
+
+    def rescan(self, force=False):
+        """Сверить индекс с папкой; возвращает (новые и измененные файлы, пути удаленных)"""
+        try:
+            folder_mtime = str(os.stat(self.folder).st_mtime_ns)
+        except OSError:
+            folder_mtime = None
+        # Добавление, удаление и переименование файла меняют mtime папки
+        if not force and folder_mtime is not None and folder_mtime == self._get_meta(self._folder_meta_key):
+            return [], []
+
+        known = {entry.path: entry for entry in self.entries()}
+        changed = []
+        seen = set()
+        if folder_mtime is not None:
+            try:
+                with os.scandir(self.folder) as it:
+                    for dir_entry in it:
+                        if not dir_entry.name.lower().endswith(AUDIO_EXTENSIONS) or not dir_entry.is_file():
+                            continue
+                        try:
+                            stat = dir_entry.stat()
+                        except OSError:
+                            continue
+                        path = os.path.join(self.folder, dir_entry.name)
+                        seen.add(path)
+                        old = known.get(path)
+                        if old is None or old.size != stat.st_size or old.mtime_ns != stat.st_mtime_ns:
+                            changed.append(DownloadedFile(path, stat.st_size, stat.st_mtime_ns))
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать папку загрузок: {e}")
+                return [], []
+        removed = [path for path in known if path not in seen]
+
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns) VALUES (?, ?, ?)",
+                [(entry.path, entry.size, entry.mtime_ns) for entry in changed]
+            )
+            self.conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+            if folder_mtime is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (self._folder_meta_key, folder_mtime)
+                )
+        return changed, removed
+
+    # Реестр скачанных треков
+    def find_track(self, key):
+        """Файл, в который уже скачан трек, или None"""
+        with self._lock:
+            row = self.conn.execute("SELECT path FROM registry WHERE track_key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if os.path.exists(row[0]):
+            return row[0]
+        # Файл удалили - трек придется скачать заново
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM registry WHERE track_key = ?", (key,))
+        return None
+
+    def register_track(self, key, path):
+        """Запомнить, что трек скачан в файл"""
+        with self._lock, self.conn:
+            self._register_locked(key, os.path.abspath(path))
+
+    def reserve_path(self, key, path, fallback):
+        """Занять имя файла для загрузки трека; возвращает (путь, файл уже содержит этот трек)
+
+        Сначала трек ищется по своему имени с ключом (fallback), затем берется обычное имя path,
+        если его не занимает и не качает другой трек. Файл с именем path без записи в реестре
+        приписывается этому треку (он скачан до появления реестра), если только это имя не подходит
+        нескольким трекам библиотеки. Имя освобождается через release_path.
+        """
+        path, fallback = os.path.abspath(path), os.path.abspath(fallback)
+        with self._lock, self.conn:
+            if self._reserved.get(fallback) in (None, key) and os.path.exists(fallback):
+                self._register_locked(key, fallback)
+                return fallback, True
+
+            owner = self._reserved.get(path)
+            if owner is None and os.path.exists(path):
+                owner = self._path_owner_locked(path)
+                if owner == key:
+                    return path, True
+                if owner is None and path not in self._contested:
+                    self._register_locked(key, path, adopted=True)
+                    return path, True
+                # Файл другого трека или неизвестно чей (имя общее для нескольких треков)
+                self._reserved[fallback] = key
+                return fallback, False
+            if owner is None or owner == key:
+                self._reserved[path] = key
+                return path, False
+            self._reserved[fallback] = key
+            return fallback, False
+
+    def release_path(self, path):
+        """Освободить имя, занятое reserve_path"""
+        with self._lock:
+            self._reserved.pop(os.path.abspath(path), None)
+
+    def missing_tracks(self, tracks):
+        """Треки, которых нет среди файлов папки (индекс должен быть сверен с папкой)
+
+        Файлы без записи в реестре сначала ищутся по имени с ключом трека, затем по обычному имени.
+        Обычное имя приписывается треку, только если оно не занято в реестре и не совпадает
+        у нескольких треков списка; такая находка записывается в реестр как adopted.
+        """
+        with self._lock, self.conn:
+            registered = dict(self.conn.execute("SELECT track_key, path FROM registry").fetchall())
+            files = {path for (path,) in self.conn.execute("SELECT path FROM files").fetchall()}
+            owned = set(registered.values()) | set(self._reserved)
+
+            unregistered = []
+            name_counts = {}
+            for track in tracks:
+                key = track_key(track)
+                if key in registered:
+                    continue
+                filename, keyed_filename = track_filenames(track)
+                path = os.path.join(self.folder, filename)
+                keyed_path = os.path.join(self.folder, keyed_filename)
+                if keyed_path in files and keyed_path not in owned:
+                    registered[key] = keyed_path
+                    owned.add(keyed_path)
+                    self._register_locked(key, keyed_path)
+                    continue
+                unregistered.append((key, path))
+                name_counts[path] = name_counts.get(path, 0) + 1
+
+            adopted = 0
+            for key, path in unregistered:
+                # Одинаково названные разные треки по имени файла не различить
+                if name_counts[path] > 1:
+                    self._contested.add(path)
+                elif path in files and path not in owned:
+                    registered[key] = path
+                    owned.add(path)
+                    self._register_locked(key, path, adopted=True)
+                    adopted += 1
+        if adopted:
+            logger.info(f"В реестр загрузок добавлено файлов, скачанных раньше: {adopted}")
+        present = {key for key, path in registered.items() if path in files}
+        return [track for track in tracks if track_key(track) not in present]
+
+    def _path_owner_locked(self, path):
+        """Трек, за которым файл записан в реестре"""
+        row = self.conn.execute("SELECT track_key FROM registry WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def _register_locked(self, key, path, adopted=False):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO registry (track_key, path, adopted) VALUES (?, ?, ?)",
+            (key, path, int(adopted))
+        )
+
+    @property
+    def _folder_meta_key(self):
+        return f"folder_mtime:{self.folder}"
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,209 @@
+"""
+Загрузка треков в формате HLS (m3u8): параллельные сегменты, AES-128 и извлечение MP3 из MPEG-TS
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+from config import HLS_WORKERS
+
+# Расшифровка AES-128 нужна только для зашифрованных сегментов
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    AES_AVAILABLE = True
+except ImportError:
+    AES_AVAILABLE = False
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+class HlsError(Exception):
+    """Плейлист или сегмент HLS не удалось получить или разобрать"""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class Segment:
+    """Сегмент медиаплейлиста"""
+    __slots__ = ('url', 'sequence', 'key_url', 'iv')
+
+    def __init__(self, url, sequence, key_url=None, iv=None):
+        self.url = url
+        self.sequence = sequence
+        self.key_url = key_url  # None - сегмент не зашифрован
+        self.iv = iv
+
+def is_hls_url(url):
+    """Ссылка на плейлист HLS, а не на файл"""
+    return bool(url) and urlparse(url).path.endswith('.m3u8')
+
+def _parse_attributes(line):
+    """Атрибуты тега: METHOD=AES-128,URI="..." -> словарь"""
+    attributes = {}
+    rest = line.split(':', 1)[1] if ':' in line else ''
+    while rest:
+        name, _, rest = rest.partition('=')
+        if rest.startswith('"'):
+            value, _, rest = rest[1:].partition('"')
+            rest = rest.lstrip(',')
+        else:
+            value, _, rest = rest.partition(',')
+        attributes[name.strip()] = value
+    return attributes
+
+def parse_playlist(text, base_url):
+    """Разобрать m3u8: вернуть ('master', [(полоса, ссылка)]) или ('media', [сегменты])"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != '#EXTM3U':
+        raise HlsError("Ответ не является плейлистом HLS")
+
+    variants = []
+    segments = []
+    sequence = 0
+    key_url = None
+    iv = None
+    bandwidth = None
+    for line in lines[1:]:
+        if line.startswith('#EXT-X-STREAM-INF'):
+            bandwidth = int(_parse_attributes(line).get('BANDWIDTH', 0) or 0)
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-KEY'):
+            attributes = _parse_attributes(line)
+            method = attributes.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key_url, iv = None, None
+            elif method == 'AES-128':
+                key_url = urljoin(base_url, attributes['URI'])
+                iv = bytes.fromhex(attributes['IV'][2:]) if 'IV' in attributes else None
+            else:
+                raise HlsError(f"Шифрование {method} не поддерживается")
+        elif not line.startswith('#'):
+            url = urljoin(base_url, line)
+            if bandwidth is not None:
+                variants.append((bandwidth, url))
+                bandwidth = None
+            else:
+                segments.append(Segment(url, sequence, key_url, iv))
+                sequence += 1
+
+    if variants:
+        return 'master', variants
+    return 'media', segments
+
+def _unpad(data):
+    """Снять дополнение PKCS#7"""
+    if not data or not 1 <= data[-1] <= 16:
+        raise HlsError("Неверное дополнение расшифрованного сегмента")
+    return data[:-data[-1]]
+
+class TsAudioExtractor:
+    """Извлекает аудиопоток (MP3-кадры) из MPEG-TS, отбрасывая заголовки пакетов и PES"""
+    def __init__(self):
+        self.audio_pid = None
+
+    def feed(self, data):
+        """Обработать сегмент; данные не в MPEG-TS возвращаются как есть"""
+        if len(data) < TS_PACKET_SIZE or data[0] != TS_SYNC_BYTE:
+            return data
+
+        out = bytearray()
+        for start in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            packet = data[start:start + TS_PACKET_SIZE]
+            if packet[0] != TS_SYNC_BYTE:
+                continue
+            unit_start = packet[1] & 0x40
+            pid = ((packet[1] & 0x1F) << 8) | packet[2]
+            adaptation = (packet[3] >> 4) & 0x3
+            if adaptation == 2:
+                continue  # только поле адаптации, без данных
+            offset = 4 + (1 + packet[4] if adaptation == 3 else 0)
+            payload = packet[offset:]
+
+            if unit_start and payload[:3] == b'\x00\x00\x01':
+                # Аудиопоток находим по первому PES с stream_id аудио MPEG (0xC0-0xDF)
+                if self.audio_pid is None and 0xC0 <= payload[3] <= 0xDF:
+                    self.audio_pid = pid
+                if pid == self.audio_pid:
+                    out += payload[9 + payload[8]:]
+            elif pid == self.audio_pid and self.audio_pid is not None:
+                out += payload
+        return bytes(out)
+
+class HlsStream:
+    """Трек HLS: сегменты качаются параллельно по общему пулу соединений и отдаются по порядку"""
+    def __init__(self, transport, url, headers=None, workers=HLS_WORKERS):
+        self.http = transport
+        self.url = url
+        self.headers = dict(headers or {})
+        self.workers = workers
+        self._keys = {}  # ссылка на ключ -> ключ
+        self._keys_lock = threading.Lock()
+
+    def _fetch(self, url):
+        """Скачать ресурс целиком"""
+        response = self.http.get(url, headers=self.headers)
+        try:
+            if response.status_code != 200:
+                raise HlsError(f"Ошибка HTTP: {response.status_code}", response.status_code)
+            return response.content
+        finally:
+            response.close()
+
+    def load_segments(self):
+        """Получить сегменты медиаплейлиста (из мастер-плейлиста берется поток лучшего качества)"""
+        url = self.url
+        kind, items = parse_playlist(self._fetch(url).decode('utf-8', 'replace'), url)
+        if kind == 'master':
+            url = max(items)[1]
+            kind, items = parse_playlist(self._fetch(url).decode('utf-8', 'replace'), url)
+            if kind != 'media':
+                raise HlsError("Вложенные мастер-плейлисты не поддерживаются")
+        if not items:
+            raise HlsError("Плейлист HLS пуст")
+        return items
+
+    def _key(self, key_url):
+        with self._keys_lock:
+            key = self._keys.get(key_url)
+        if key is None:
+            key = self._fetch(key_url)
+            if len(key) != 16:
+                raise HlsError("Неверный ключ AES-128")
+            with self._keys_lock:
+                self._keys[key_url] = key
+        return key
+
+    def _load_segment(self, segment):
+        """Скачать и расшифровать сегмент"""
+        data = self._fetch(segment.url)
+        if segment.key_url is None:
+            return data
+        if not AES_AVAILABLE:
+            raise HlsError("Для зашифрованных треков HLS установите python3-cryptography")
+        iv = segment.iv or segment.sequence.to_bytes(16, 'big')
+        decryptor = Cipher(algorithms.AES(self._key(segment.key_url)), modes.CBC(iv)).decryptor()
+        return _unpad(decryptor.update(data) + decryptor.finalize())
+
+    def iter_chunks(self):
+        """Отдавать аудио сегмент за сегментом по порядку, пока следующие качаются параллельно"""
+        segments = self.load_segments()
+        extractor = TsAudioExtractor()
+        # Окно загрузки ограничено, чтобы в памяти было не больше нескольких сегментов
+        window = self.workers * 2
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hls") as executor:
+            pending = [executor.submit(self._load_segment, segment) for segment in segments[:window]]
+            next_index = len(pending)
+            try:
+                while pending:
+                    data = pending.pop(0).result()
+                    if next_index < len(segments):
+                        pending.append(executor.submit(self._load_segment, segments[next_index]))
+                        next_index += 1
+                    chunk = extractor.feed(data)
+                    if chunk:
+                        yield chunk
+            finally:
+                # Прерванная загрузка (перемотка, остановка, ошибка) не должна докачивать хвост
+                for future in pending:
+                    future.cancel()
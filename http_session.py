@@ -0,0 +1,131 @@
+"""
+Общий HTTP-транспорт с пулом соединений
+"""
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from config import (logger, KATE_USER_AGENT, HTTP_POOL_HOSTS, HTTP_POOL_SIZE,
+                    HTTP_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF_FACTOR)
+
+class ConnectionStats:
+    """Счетчики использования соединений"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.new_connections = 0
+
+    def count_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+
+    def count_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self):
+        """Получить текущую статистику"""
+        with self._lock:
+            checkouts = self.checkouts
+            new_connections = self.new_connections
+        reused = max(checkouts - new_connections, 0)
+        return {
+            "requests": checkouts,
+            "new_connections": new_connections,
+            "reused_connections": reused,
+            "reuse_ratio": reused / checkouts if checkouts else 0.0
+        }
+
+def _counting_pool_class(pool_cls, stats):
+    """Создать класс пула, который считает выдачу и создание соединений"""
+    class CountingPool(pool_cls):
+        def _get_conn(self, timeout=None):
+            stats.count_checkout()
+            return super()._get_conn(timeout=timeout)
+
+        def _new_conn(self):
+            stats.count_new_connection()
+            return super()._new_conn()
+
+    return CountingPool
+
+class _StatsAdapter(HTTPAdapter):
+    """HTTP-адаптер со сбором статистики соединений"""
+    def __init__(self, stats, *args, **kwargs):
+        self._stats = stats
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self._stats),
+            'https': _counting_pool_class(HTTPSConnectionPool, self._stats)
+        }
+
+class HttpTransport:
+    """Пул HTTP-соединений, общий для VK API и загрузки аудио"""
+    def __init__(self, pool_size=HTTP_POOL_SIZE, pool_hosts=HTTP_POOL_HOSTS,
+                 timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+        self.timeout = timeout
+        self.stats = ConnectionStats()
+
+        # Повторяем только безопасные запросы при сетевых сбоях и 5xx/429
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False
+        )
+        adapter = _StatsAdapter(
+            self.stats,
+            pool_connections=pool_hosts,
+            pool_maxsize=pool_size,
+            max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'User-Agent': KATE_USER_AGENT})
+
+    def request(self, method, url, **kwargs):
+        """Выполнить запрос через общий пул"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """GET-запрос через общий пул"""
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """HEAD-запрос через общий пул"""
+        return self.request('HEAD', url, **kwargs)
+
+    def get_stats(self):
+        """Статистика переиспользования соединений"""
+        return self.stats.snapshot()
+
+    def log_stats(self):
+        """Записать статистику соединений в лог"""
+        stats = self.get_stats()
+        logger.info(
+            f"HTTP: запросов {stats['requests']}, новых соединений {stats['new_connections']}, "
+            f"переиспользовано {stats['reused_connections']} ({stats['reuse_ratio']:.0%})"
+        )
+
+    def close(self):
+        """Закрыть все соединения пула"""
+        self.session.close()
+
+_shared_transport = None
+_shared_lock = threading.Lock()
+
+def get_transport():
+    """Получить общий экземпляр транспорта"""
+    global _shared_transport
+    with _shared_lock:
+        if _shared_transport is None:
+            _shared_transport = HttpTransport()
+        return _shared_transport
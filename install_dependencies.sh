@@ -5,7 +5,7 @@ echo "Установка зависимостей для VK Music Player..."
 sudo apt update
 
 # Установка системных зависимостей
-sudo apt install -y python3-gi python3-gi-cairo gir1.2-gtk-3.0 python3-requests mplayer
+sudo apt install -y python3-gi python3-gi-cairo gir1.2-gtk-3.0 python3-requests python3-cryptography mplayer
 
 # Установите python-dotenv
 pip3 install --user python-dotenv
@@ -0,0 +1,282 @@
+"""
+Локальный кэш библиотеки пользователя и инкрементальная синхронизация
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from config import logger, CACHE_DIR, VK_PAGE_SIZE, LIBRARY_FULL_SYNC_INTERVAL
+
+def track_key(track):
+    """Ключ трека VK: owner_id_id"""
+    return f"{track.get('owner_id')}_{track.get('id')}"
+
+def load_last_user_id(cache_dir=CACHE_DIR):
+    """Получить ID пользователя из прошлой сессии"""
+    try:
+        with open(os.path.join(cache_dir, 'last_user_id'), 'r', encoding='utf-8') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def save_last_user_id(user_id, cache_dir=CACHE_DIR):
+    """Запомнить ID пользователя для следующего запуска"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, 'last_user_id'), 'w', encoding='utf-8') as f:
+            f.write(str(user_id))
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить ID пользователя: {e}")
+
+class LibraryCache:
+    """Хранилище треков, плейлистов и их состава в SQLite"""
+    def __init__(self, user_id, cache_dir=CACHE_DIR):
+        self.user_id = user_id
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"library_{user_id}.sqlite3")
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        """Создать таблицы если их нет"""
+        with self._lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    key TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS tracks_position ON tracks (position);
+                CREATE TABLE IF NOT EXISTS tracks_staging (
+                    key TEXT PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS playlists (
+                    id INTEGER PRIMARY KEY,
+                    position INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS playlist_tracks (
+                    playlist_id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    track_key TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (playlist_id, position)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+            """)
+
+    # Треки пользователя
+    def load_tracks(self):
+        """Получить все треки в порядке библиотеки"""
+        with self._lock:
+            rows = self.conn.execute("SELECT data FROM tracks ORDER BY position").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def get_track_keys(self):
+        """Получить ключи треков в порядке библиотеки"""
+        with self._lock:
+            rows = self.conn.execute("SELECT key FROM tracks ORDER BY position").fetchall()
+        return [key for (key,) in rows]
+
+    def prepend_tracks(self, tracks):
+        """Добавить новые треки в начало библиотеки"""
+        if not tracks:
+            return
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE tracks SET position = position + ?", (len(tracks),))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tracks (key, position, data) VALUES (?, ?, ?)",
+                [(track_key(track), i, json.dumps(track, ensure_ascii=False)) for i, track in enumerate(tracks)]
+            )
+
+    # Полная замена библиотеки по страницам: новый список копится в tracks_staging,
+    # а в tracks попадает одной транзакцией, так что в памяти не держится вся библиотека
+    def begin_tracks_replace(self):
+        """Начать замену библиотеки"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM tracks_staging")
+
+    def stage_tracks(self, tracks, start):
+        """Добавить страницу нового списка, start - позиция первого трека"""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO tracks_staging (key, position, data) VALUES (?, ?, ?)",
+                [(track_key(track), start + i, json.dumps(track, ensure_ascii=False)) for i, track in enumerate(tracks)]
+            )
+
+    def commit_tracks_replace(self):
+        """Привести библиотеку к накопленному списку, вернуть (добавлено, удалено)"""
+        with self._lock, self.conn:
+            added = self.conn.execute(
+                "SELECT COUNT(*) FROM tracks_staging WHERE key NOT IN (SELECT key FROM tracks)"
+            ).fetchone()[0]
+            removed = self.conn.execute(
+                "DELETE FROM tracks WHERE key NOT IN (SELECT key FROM tracks_staging)"
+            ).rowcount
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tracks (key, position, data) SELECT key, position, data FROM tracks_staging"
+            )
+            self.conn.execute("DELETE FROM tracks_staging")
+        return added, removed
+
+    # Плейлисты
+    def load_playlists(self):
+        """Получить сохраненные плейлисты"""
+        with self._lock:
+            rows = self.conn.execute("SELECT data FROM playlists ORDER BY position").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def save_playlists(self, playlists):
+        """Сохранить список плейлистов"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM playlists")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO playlists (id, position, data) VALUES (?, ?, ?)",
+                [(playlist.get('id'), i, json.dumps(playlist, ensure_ascii=False)) for i, playlist in enumerate(playlists)]
+            )
+            # Состав удаленных плейлистов больше не нужен
+            self.conn.execute("DELETE FROM playlist_tracks WHERE playlist_id NOT IN (SELECT id FROM playlists)")
+
+    def load_playlist_tracks(self, playlist_id):
+        """Получить сохраненный состав плейлиста"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT data FROM playlist_tracks WHERE playlist_id = ? ORDER BY position", (int(playlist_id),)
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def save_playlist_tracks(self, playlist_id, tracks):
+        """Сохранить состав плейлиста"""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM playlist_tracks WHERE playlist_id = ?", (int(playlist_id),))
+            self.conn.executemany(
+                "INSERT INTO playlist_tracks (playlist_id, position, track_key, data) VALUES (?, ?, ?, ?)",
+                [(int(playlist_id), i, track_key(track), json.dumps(track, ensure_ascii=False))
+                 for i, track in enumerate(tracks)]
+            )
+
+    # Служебные данные
+    def get_meta(self, key, default=None):
+        """Получить служебное значение"""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        """Сохранить служебное значение"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False))
+            )
+
+    def close(self):
+        """Закрыть базу"""
+        with self._lock:
+            self.conn.close()
+
+class LibrarySync:
+    """Синхронизация локального кэша с библиотекой VK"""
+    def __init__(self, manager, cache):
+        self.manager = manager
+        self.cache = cache
+
+    def sync_my_audio(self, progress_callback=None):
+        """Загрузить только новые треки из начала списка, при расхождении - полная сверка.
+
+        Быстрый путь видит только начало списка, поэтому, кроме количества, сверяются треки
+        за первым известным и конец списка, а раз в LIBRARY_FULL_SYNC_INTERVAL сверка идет целиком.
+        """
+        cached_keys = self.cache.get_track_keys()
+        if not cached_keys:
+            return self._full_sync(progress_callback)
+        last_full_sync = self.cache.get_meta('my_audio_full_sync', 0)
+        if time.time() - last_full_sync > LIBRARY_FULL_SYNC_INTERVAL:
+            return self._full_sync(progress_callback)
+
+        known = set(cached_keys)
+        head = []
+        anchor = None
+        anchor_page = []  # ключи страницы начиная с первого известного трека
+        offset = 0
+
+        # Новые треки VK добавляет в начало, читаем до первого известного
+        while anchor is None:
+            result = self.manager.get_my_audio_list(offset=offset, count=VK_PAGE_SIZE)
+            if not result["success"]:
+                return result
+
+            total_count = result["total_count"]
+            page = result["audio_list"]
+            loaded_until = offset + len(page)
+            for position, track in enumerate(page):
+                key = track_key(track)
+                if key in known:
+                    anchor = key
+                    anchor_page = [track_key(item) for item in page[position:]]
+                    break
+                head.append(track)
+
+            if len(page) < VK_PAGE_SIZE:
+                break
+            offset += VK_PAGE_SIZE
+
+        # Первый известный трек на своем месте и количество сходится - удалений не было
+        if (anchor == cached_keys[0] and total_count == len(head) + len(cached_keys)
+                and anchor_page == cached_keys[:len(anchor_page)]
+                and self._tail_matches(cached_keys, total_count, loaded_until)):
+            self.cache.prepend_tracks(head)
+            self.cache.set_meta('my_audio_total', total_count)
+            logger.info(f"Синхронизация библиотеки: добавлено {len(head)}")
+            return {"success": True, "added": len(head), "removed": 0, "total_count": total_count}
+
+        return self._full_sync(progress_callback)
+
+    def _tail_matches(self, cached_keys, total_count, loaded_until):
+        """Конец списка в VK совпадает с концом кэша (удаления и перестановки в глубине списка)"""
+        if loaded_until >= total_count:
+            # Конец списка уже прочитан вместе со страницей первого известного трека
+            return True
+        tail_offset = max(total_count - VK_PAGE_SIZE, 0)
+        result = self.manager.get_my_audio_list(offset=tail_offset, count=VK_PAGE_SIZE)
+        if not result["success"]:
+            return False
+        tail = [track_key(track) for track in result["audio_list"]]
+        return bool(tail) and tail == cached_keys[-len(tail):]
+
+    def _full_sync(self, progress_callback=None):
+        """Загрузить библиотеку целиком и применить разницу"""
+        self.cache.begin_tracks_replace()
+        total_count = 0
+        for page in self.manager.iter_my_audio_pages(progress_callback):
+            if not page["success"]:
+                return page
+            self.cache.stage_tracks(page["audio_list"], page["offset"])
+            total_count = page["total_count"]
+
+        added, removed = self.cache.commit_tracks_replace()
+        self.cache.set_meta('my_audio_total', total_count)
+        self.cache.set_meta('my_audio_full_sync', time.time())
+        logger.info(f"Полная синхронизация библиотеки: добавлено {added}, удалено {removed}")
+        return {"success": True, "added": added, "removed": removed, "total_count": total_count}
+
+    def sync_playlists(self, progress_callback=None):
+        """Обновить список плейлистов"""
+        result = self.manager.get_all_playlists(progress_callback)
+        if result["success"]:
+            self.cache.save_playlists(result["playlists"])
+        return result
+
+    def sync_playlist_tracks(self, playlist_id, progress_callback=None):
+        """Обновить состав плейлиста"""
+        result = self.manager.get_all_playlist_tracks(playlist_id, progress_callback)
+        if result["success"]:
+            self.cache.save_playlist_tracks(playlist_id, result["audio_list"])
+        return result
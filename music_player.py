@@ -3,94 +3,288 @@
 """
 
 import os
+import time
 import tempfile
-import subprocess
 import threading
-import requests
-from config import logger
+from config import (logger, KATE_USER_AGENT, STREAMING_PLAYBACK, GAPLESS_PLAYBACK, PLAYER_DEFAULT_VOLUME,
+                    POSITION_POLL_INTERVAL)
+from audio_backends import create_backend
+from http_session import get_transport
+from stream_proxy import StreamProxy
+from prefetch import Prefetcher
+from blob_cache import get_blob_cache
+from library_cache import track_key
+from hls import HlsStream, is_hls_url
+
+# Состояния плеера
+PLAYER_STOPPED = "stopped"
+PLAYER_PLAYING = "playing"
+PLAYER_PAUSED = "paused"
 
 class MusicPlayer:
     """Класс для управления воспроизведением музыки"""
     def __init__(self):
-        self.process = None
         self.current_track = None
-        self.is_playing = False
+        self.state = PLAYER_STOPPED
         self.current_position = 0
+        self._position_time = None  # когда получена позиция (для интерполяции между опросами)
         self.track_duration = 0
         self.playlist = []
         self.current_index = -1
         self.temp_files = []
+        self.http = get_transport()
+        self.blob_cache = get_blob_cache()
+        self.streaming = STREAMING_PLAYBACK
+        self.stream_proxy = StreamProxy(self.http, self.blob_cache)
+        self.stream_urls = []
+        self.gapless = GAPLESS_PLAYBACK
+        self.prefetcher = Prefetcher(self.http, self._request_headers(), self.blob_cache)
+        self.prefetcher.on_ready = lambda track: self._queue_next()
+        self.on_track_changed = None  # вызывается с треком при автоматическом переходе
+        self.on_playback_finished = None  # вызывается, когда очередь доиграна
+        self.on_state_changed = None  # вызывается с новым состоянием: играет, пауза, остановлен
+        self.on_playback_error = None  # вызывается с текстом ошибки движка
+        self._queued = {}  # источник в очереди движка -> (индекс в плейлисте, трек)
+        self._current_source = None
+        self.volume = PLAYER_DEFAULT_VOLUME
+        self._lock = threading.Lock()
+        
+        self.backend = create_backend(self.volume, self.streaming, self.gapless, self._request_headers())
+        self.backend.on_file_started = self._on_file_started
+        self.backend.on_end_of_stream = self._on_track_end
+        self.backend.on_position = self._set_position
+        self.backend.on_duration = self._on_duration
+        self.backend.on_error = self._on_backend_error
+        
+        # Позицию спрашиваем у движка только во время воспроизведения
+        self._state_condition = threading.Condition()
+        self._poller = threading.Thread(target=self._poll_position, daemon=True)
+        self._poller.start()
+
+    @property
+    def is_playing(self):
+        return self.state == PLAYER_PLAYING
+
+    def _set_state(self, state):
+        """Сменить состояние и сообщить о нем интерфейсу"""
+        with self._state_condition:
+            if state == self.state:
+                return
+            self.state = state
+            self._state_condition.notify_all()
+        if self.on_state_changed:
+            self.on_state_changed(state)
+
+    def _set_position(self, position):
+        """Запомнить позицию вместе со временем ее получения"""
+        self.current_position = position
+        self._position_time = time.monotonic() if self.state == PLAYER_PLAYING else None
+
+    def _poll_position(self):
+        """Поток опроса позиции: спит, пока ничего не играет"""
+        while True:
+            with self._state_condition:
+                while self.state != PLAYER_PLAYING:
+                    self._state_condition.wait()
+                self._state_condition.wait(POSITION_POLL_INTERVAL)
+                if self.state != PLAYER_PLAYING:
+                    continue
+            self.backend.request_position()
+        
+    def _request_headers(self):
+        """Заголовки для запросов к CDN VK"""
+        return {
+            'User-Agent': KATE_USER_AGENT,
+            'Referer': 'https://vk.com/',
+            'Origin': 'https://vk.com'
+        }
+
+    def _download_to_temp(self, track_url, cache_key=None):
+        """Скачать трек целиком: в аудиокэш, если известен ключ, иначе во временный файл"""
+        if is_hls_url(track_url):
+            chunks = HlsStream(self.http, track_url, self._request_headers()).iter_chunks()
+        else:
+            response = self.http.get(track_url, stream=True, headers=self._request_headers())
+            if response.status_code != 200:
+                response.close()
+                return None
+            chunks = response.iter_content(chunk_size=8192)
+        
+        if cache_key:
+            writer = self.blob_cache.writer(cache_key)
+            try:
+                for chunk in chunks:
+                    writer.write(chunk)
+            except Exception:
+                writer.abort()
+                raise
+            return writer.commit()
+        
+        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
+            temp_filename = temp_file.name
+        
+        self.temp_files.append(temp_filename)
         
+        with open(temp_filename, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return temp_filename
+
     def play(self, track_url, track_info=None):
         """Воспроизвести трек"""
-        self.stop()
-        
         try:
-            # Скачиваем трек во временный файл
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                temp_filename = temp_file.name
+            source = self._prepare_source(track_url, track_info)
+            if not source:
+                return False, "Ошибка загрузки"
             
-            self.temp_files.append(temp_filename)
-            
-            headers = {
-                'User-Agent': 'KateMobileAndroid/51.1-442 (Android 11; SDK 30; arm64-v8a; Samsung SM-G991B; ru_RU)',
-                'Referer': 'https://vk.com/',
-                'Origin': 'https://vk.com'
-            }
-            
-            response = requests.get(track_url, stream=True, headers=headers)
-            if response.status_code == 200:
-                with open(temp_filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
+            with self._lock:
+                previous_sources = [self._current_source] + list(self._queued)
+                self._queued = {}
+                self._current_source = source
+                self.current_track = track_info
                 # Получаем длительность трека
                 self.track_duration = track_info.get('duration', 0) if track_info else 0
-                
-                # Запускаем mplayer в режиме управления
-                self.process = subprocess.Popen(
-                    ['mplayer', '-slave', '-quiet', '-identify', temp_filename],
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    universal_newlines=True,
-                    bufsize=1
-                )
-                
-                # Запускаем мониторинг вывода для получения позиции
-                self.monitor_thread = threading.Thread(target=self._monitor_player, daemon=True)
-                self.monitor_thread.start()
-                
-                self.is_playing = True
-                self.current_track = track_info
-                return True, temp_filename
-            return False, "Ошибка загрузки"
+                self.current_position = 0
+                self._position_time = None
+            
+            if not self.backend.load(source):
+                return False, f"Движок {self.backend.name} не отвечает"
+            self._set_state(PLAYER_PLAYING)
+            self._set_position(0)
+            
+            for previous in previous_sources:
+                if previous and previous != source:
+                    self._release_source(previous)
+            
+            self._schedule_prefetch()
+            self._queue_next()
+            return True, source
             
         except Exception as e:
             logger.error(f"Ошибка воспроизведения: {e}")
             return False, f"Ошибка воспроизведения: {e}"
     
-    def _monitor_player(self):
-        """Мониторинг вывода mplayer для получения позиции"""
-        while self.process and self.process.poll() is None:
+    def _prepare_source(self, track_url, track_info):
+        """Выбрать источник для движка: файл из аудиокэша, поток или загруженный файл"""
+        cache_key = track_key(track_info) if track_info else None
+        if cache_key:
+            # Предзагруженный или уже прослушанный трек играем без сети
+            cached = self.prefetcher.take(track_info) or self.blob_cache.get(cache_key)
+            if cached:
+                return cached
+        
+        if self.streaming and self.backend.direct_http and not is_hls_url(track_url):
+            # Движок сам читает CDN и буферизует поток (включается настройкой, аудиокэш при этом не пополняется)
+            return track_url
+        
+        if self.streaming:
+            # Движок читает трек через локальный прокси (HLS собирается там же в поток MP3)
+            source = self.stream_proxy.register(track_url, self._request_headers(), cache_key)
+            self.stream_urls.append(source)
+            return source
+        
+        return self._download_to_temp(track_url, cache_key)
+
+    def _schedule_prefetch(self):
+        """Предзагрузить треки, которые идут после текущего"""
+        if self.current_index >= 0:
+            self.prefetcher.schedule(self.playlist[self.current_index + 1:])
+        else:
+            self.prefetcher.schedule([])
+
+    def _queue_next(self):
+        """Поставить следующий предзагруженный трек в очередь движка"""
+        with self._lock:
+            if not self.gapless or not self.is_playing or self._queued:
+                return
+            next_index = self.current_index + 1
+            if self.current_index < 0 or next_index >= len(self.playlist):
+                return
+            
+            track = self.playlist[next_index]
+            path = self.prefetcher.take(track)
+            if not path:
+                return
+            
+            self._queued[path] = (next_index, track)
+        
+        if not self.backend.enqueue(path):
+            with self._lock:
+                self._queued.pop(path, None)
+
+    def _release_source(self, source):
+        """Освободить отыгравший источник"""
+        if source in self.temp_files:
+            self.temp_files.remove(source)
             try:
-                line = self.process.stdout.readline()
-                if not line:
-                    break
-                    
-                # Парсим позицию воспроизведения
-                if line.startswith('ANS_TIME_POSITION='):
-                    try:
-                        self.current_position = float(line.split('=')[1].strip())
-                    except:
-                        pass
-                        
-            except:
-                break
+                os.unlink(source)
+            except OSError:
+                pass
+        elif source in self.stream_urls:
+            self.stream_urls.remove(source)
+            self.stream_proxy.unregister(source)
+
+    def _on_file_started(self, filename):
+        """Движок начал играть файл из очереди - переключаем текущий трек"""
+        with self._lock:
+            entry = self._queued.pop(filename, None)
+            if entry is None:
+                return
+            
+            previous_source = self._current_source
+            self._current_source = filename
+            self.current_index, track = entry
+            self.current_track = track
+            self.track_duration = track.get('duration', 0)
+            self._set_position(0)
+            self._release_source(previous_source)
+        
+        self._schedule_prefetch()
+        if self.on_track_changed:
+            self.on_track_changed(track)
+
+    def _on_track_end(self):
+        """Движок доиграл файл до конца"""
+        with self._lock:
+            if self._queued:
+                # Следующий файл уже в очереди движка - переход придет через on_file_started
+                return
+            source, self._current_source = self._current_source, None
+            self.current_position = 0
+        
+        self._set_state(PLAYER_STOPPED)
+        if source:
+            self._release_source(source)
+        if self.on_playback_finished:
+            self.on_playback_finished()
+
+    def _on_duration(self, duration):
+        """Движок сообщил точную длительность"""
+        self.track_duration = duration
+
+    def _on_backend_error(self, message, fatal):
+        """Ошибка воспроизведения; fatal - движок больше не может играть"""
+        if fatal:
+            with self._lock:
+                source, self._current_source = self._current_source, None
+                self._queued = {}
+            self._set_state(PLAYER_STOPPED)
+            if source:
+                self._release_source(source)
+        if self.on_playback_error:
+            self.on_playback_error(message)
     
     def get_position(self):
-        """Получить текущую позицию воспроизведения"""
-        return self.current_position
+        """Получить текущую позицию воспроизведения (с интерполяцией между ответами движка)"""
+        exact = self.backend.query_position() if self.state != PLAYER_STOPPED else None
+        if exact is not None:
+            return exact
+        position = self.current_position
+        if self.state == PLAYER_PLAYING and self._position_time is not None:
+            position += time.monotonic() - self._position_time
+        if self.track_duration:
+            position = min(position, self.track_duration)
+        return position
     
     def get_duration(self):
         """Получить длительность трека"""
@@ -98,39 +292,32 @@ class MusicPlayer:
     
     def seek(self, position):
         """Переместиться к позиции"""
-        if self.process and self.is_playing:
-            self.process.stdin.write(f"seek {position} 2\n")
-            self.process.stdin.flush()
-            self.current_position = position
+        if self._current_source and self.is_playing:
+            self.backend.seek(position)
+            self._set_position(position)
             return True
         return False
     
     def pause(self):
         """Пауза/продолжение воспроизведения"""
-        if self.process and self.is_playing:
-            self.process.stdin.write("pause\n")
-            self.process.stdin.flush()
-            self.is_playing = False
-            return True
-        elif self.process and not self.is_playing:
-            self.process.stdin.write("pause\n")
-            self.process.stdin.flush()
-            self.is_playing = True
-            return True
-        return False
+        if not self._current_source:
+            return False
+        # Позицию фиксируем на момент паузы, чтобы интерполяция не уходила вперед
+        self.current_position = self.get_position()
+        self.backend.set_paused(self.is_playing)
+        self._set_state(PLAYER_PAUSED if self.is_playing else PLAYER_PLAYING)
+        self._set_position(self.current_position)
+        return True
     
     def stop(self):
-        """Остановить воспроизведение"""
-        if self.process:
-            try:
-                self.process.stdin.write("quit\n")
-                self.process.stdin.flush()
-                self.process.terminate()
-                self.process.wait(timeout=2)
-            except:
-                self.process.kill()
-            finally:
-                self.process = None
+        """Остановить воспроизведение (движок остается готов к следующему треку)"""
+        with self._lock:
+            self._queued = {}
+            has_source = self._current_source is not None
+            self._current_source = None
+        
+        if has_source:
+            self.backend.stop()
         
         # Удаляем временные файлы
         for temp_file in self.temp_files:
@@ -141,17 +328,29 @@ class MusicPlayer:
                 pass
         self.temp_files = []
         
-        self.is_playing = False
+        # Снимаем треки с локального прокси
+        for stream_url in self.stream_urls:
+            self.stream_proxy.unregister(stream_url)
+        self.stream_urls = []
+        
+        self._set_state(PLAYER_STOPPED)
         self.current_track = None
         self.current_position = 0
         self.track_duration = 0
+        self._current_source = None
+    
+    def shutdown(self):
+        """Остановить воспроизведение и освободить ресурсы перед выходом"""
+        self.stop()
+        self.backend.shutdown()
+        self.prefetcher.shutdown()
+        self.stream_proxy.stop()
     
     def set_volume(self, volume):
         """Установить громкость (0-100)"""
-        if self.process and self.is_playing:
-            # mplayer принимает громкость от 0 до 100
-            self.process.stdin.write(f"volume {volume} 1\n")
-            self.process.stdin.flush()
+        # Громкость запоминаем: движок применяет ее и к следующим трекам
+        self.volume = volume
+        self.backend.set_volume(volume)
     
     def next_track(self):
         """Следующий трек"""
@@ -171,6 +370,7 @@ class MusicPlayer:
         """Установить плейлист"""
         self.playlist = playlist
         self.current_index = -1
+        self.prefetcher.schedule([])
     
     def get_current_track_info(self):
         """Получить информацию о текущем треке"""
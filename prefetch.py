@@ -0,0 +1,139 @@
+"""
+Фоновая предзагрузка следующих треков плейлиста
+"""
+
+import threading
+from collections import OrderedDict
+from config import logger, PREFETCH_DEPTH, PREFETCH_BUDGET_MB, STREAM_CHUNK_SIZE
+from library_cache import track_key
+from hls import HlsStream, is_hls_url
+
+class Prefetcher:
+    """Скачивает следующие N треков в аудиокэш, пока играет текущий"""
+    def __init__(self, transport, headers, blob_cache, depth=PREFETCH_DEPTH, budget_mb=PREFETCH_BUDGET_MB):
+        self.http = transport
+        self.headers = headers
+        self.blob_cache = blob_cache
+        self.depth = depth
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.on_ready = None  # вызывается с треком, когда его файл готов
+        self._ready = OrderedDict()  # ключ трека -> размер
+        self._wanted = []
+        self._failed = set()
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def schedule(self, tracks):
+        """Задать треки, которые нужно держать наготове (по порядку воспроизведения)"""
+        with self._condition:
+            self._wanted = [track for track in tracks[:self.depth] if track.get('url')]
+            self._failed.clear()
+            wanted_keys = {track_key(track) for track in self._wanted}
+            # Файлы остаются в аудиокэше, из окна предзагрузки только убираем
+            for key in list(self._ready):
+                if key not in wanted_keys:
+                    del self._ready[key]
+            self._condition.notify()
+
+    def take(self, track):
+        """Забрать готовый трек из окна предзагрузки и получить путь к нему в кэше"""
+        key = track_key(track)
+        with self._condition:
+            if key not in self._ready:
+                return None
+            del self._ready[key]
+            self._wanted = [t for t in self._wanted if track_key(t) != key]
+            self._condition.notify()
+        return self.blob_cache.get(key)
+
+    def is_ready(self, track):
+        """Есть ли готовый файл трека"""
+        with self._condition:
+            return track_key(track) in self._ready
+
+    def clear(self):
+        """Очистить окно предзагрузки"""
+        with self._condition:
+            self._wanted = []
+            self._ready.clear()
+
+    def shutdown(self):
+        """Остановить предзагрузку"""
+        self.clear()
+
+    def _next_job(self):
+        """Выбрать следующий трек для загрузки (вызывается под блокировкой)"""
+        if sum(self._ready.values()) >= self.budget_bytes:
+            return None
+        for track in self._wanted:
+            key = track_key(track)
+            if key not in self._ready and key not in self._failed:
+                return track
+        return None
+
+    def _is_wanted(self, key):
+        with self._condition:
+            return self._is_wanted_locked(key)
+
+    def _is_wanted_locked(self, key):
+        return any(track_key(track) == key for track in self._wanted)
+
+    def _run(self):
+        """Рабочий поток предзагрузки"""
+        while True:
+            with self._condition:
+                track = self._next_job()
+                while track is None:
+                    self._condition.wait()
+                    track = self._next_job()
+
+            key = track_key(track)
+            if self.blob_cache.contains(key):
+                size = self.blob_cache.size_of(key)
+            else:
+                size = self._download(track, key)
+
+            with self._condition:
+                if size is None:
+                    # Не повторяем упавшую загрузку, пока список не изменится
+                    self._failed.add(key)
+                    continue
+                ready = self._is_wanted_locked(key)
+                if ready:
+                    self._ready[key] = size
+            if ready and self.on_ready:
+                self.on_ready(track)
+
+    def _download(self, track, key):
+        """Скачать трек в кэш, прервав загрузку, если он стал не нужен"""
+        writer = None
+        try:
+            if is_hls_url(track['url']):
+                response = None
+                chunks = HlsStream(self.http, track['url'], self.headers).iter_chunks()
+            else:
+                response = self.http.get(track['url'], stream=True, headers=self.headers)
+                if response.status_code != 200:
+                    response.close()
+                    return None
+                chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            try:
+                writer = self.blob_cache.writer(key)
+                for chunk in chunks:
+                    writer.write(chunk)
+                    if writer.size > self.budget_bytes or not self._is_wanted(key):
+                        raise InterruptedError("предзагрузка отменена")
+            finally:
+                if response is not None:
+                    response.close()
+                else:
+                    chunks.close()
+            size = writer.size
+            writer.commit()
+            return size
+        except Exception as e:
+            logger.info(f"Предзагрузка {key} не выполнена: {e}")
+            if writer:
+                writer.abort()
+            return None
@@ -0,0 +1,60 @@
+"""
+Ограничение частоты запросов к VK API
+"""
+
+import time
+import threading
+
+class RateLimiter:
+    """Ограничитель частоты запросов по схеме token bucket.
+
+    Если задан min_rate, частота подстраивается: при ответе "слишком много запросов"
+    она уменьшается вдвое (не ниже min_rate), а после каждого успешного запроса
+    растет на step обратно до исходной.
+    """
+    def __init__(self, rate, burst=None, min_rate=None, step=0.0):
+        self.rate = float(rate)
+        self.max_rate = self.rate
+        self.min_rate = float(min_rate or rate)
+        self.step = float(step)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._backoff_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        """Пополнить корзину за прошедшее время"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Дождаться разрешения на один запрос"""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def on_success(self):
+        """Запрос прошел - понемногу возвращаем частоту"""
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def on_throttled(self):
+        """Сервер ответил, что запросов слишком много - снижаем частоту и опустошаем корзину"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            # Параллельные запросы, отправленные до снижения, не должны снижать частоту повторно
+            if now < self._backoff_until:
+                return
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._backoff_until = now + 1 / self.rate
@@ -0,0 +1,156 @@
+"""
+Локальный поисковый индекс по библиотеке пользователя
+"""
+
+import re
+import bisect
+import threading
+from config import SEARCH_INDEX_MIN_TYPO_LENGTH, SEARCH_LOCAL_LIMIT
+
+# Кириллица приводится к латинице, чтобы "kino" находило "Кино" и наоборот
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'і': 'i', 'ї': 'i', 'є': 'e', 'ґ': 'g'
+}
+# Разные варианты латинской записи одного звука
+LATIN_FOLDS = (('kh', 'h'), ('iy', 'y'), ('yy', 'y'), ('j', 'y'), ('w', 'v'))
+
+_TRANSLIT_TABLE = str.maketrans(TRANSLIT)
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def normalize(text):
+    """Привести текст к списку латинских токенов"""
+    text = text.lower().translate(_TRANSLIT_TABLE)
+    for source, target in LATIN_FOLDS:
+        text = text.replace(source, target)
+    return _TOKEN_RE.findall(text)
+
+def _deletions(token):
+    """Варианты токена с одной удаленной буквой (для поиска с опечаткой)"""
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+class _IndexState:
+    """Снимок индекса; после построения не меняется, поэтому поиск читает его без блокировки"""
+    __slots__ = ('tracks', 'tokens', 'postings', 'deletes', 'vocabulary')
+
+    def __init__(self, tracks=None, tokens=None, postings=None, deletes=None):
+        self.tracks = tracks or {}  # индекс трека -> трек
+        self.tokens = tokens or {}  # индекс трека -> его токены
+        self.postings = postings or {}  # токен -> множество индексов треков
+        self.deletes = deletes or {}  # токен без одной буквы -> исходные токены
+        self.vocabulary = sorted(self.postings)  # отсортированные токены для поиска по префиксу
+
+class LibrarySearchIndex:
+    """Инвертированный индекс по исполнителю и названию с поиском по префиксу и с опечатками.
+
+    Индекс перестраивается в фоне целиком и подменяется одним присваиванием,
+    так что поиск при вводе не ждет синхронизации библиотеки.
+    """
+    def __init__(self, min_typo_length=SEARCH_INDEX_MIN_TYPO_LENGTH):
+        self.min_typo_length = min_typo_length
+        self._state = _IndexState()
+        self._sources = {}  # источник (библиотека, плейлист) -> его треки
+        self._lock = threading.Lock()  # защищает подмену снимка и источников
+        self._build_lock = threading.Lock()  # перестройки идут по одной
+
+    def set_tracks(self, source, tracks):
+        """Задать треки источника: библиотеки или отдельного плейлиста"""
+        with self._build_lock:
+            with self._lock:
+                sources = dict(self._sources)
+                previous = self._state
+            sources[source] = list(tracks)
+            state = self._build(sources, previous)
+            with self._lock:
+                self._sources = sources
+                self._state = state
+
+    def clear(self):
+        """Очистить индекс (смена пользователя)"""
+        with self._build_lock, self._lock:
+            self._sources = {}
+            self._state = _IndexState()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._state.tracks)
+
+    def _build(self, sources, previous):
+        """Построить снимок по трекам всех источников; в нем остаются только треки живых источников"""
+        tracks = {}
+        for source_tracks in sources.values():
+            for track in source_tracks:
+                tracks[track.index] = track
+
+        tokens = {}
+        postings = {}
+        for index, track in tracks.items():
+            # Токены уже проиндексированного трека берем из прошлого снимка
+            if previous.tracks.get(index) is track:
+                track_tokens = previous.tokens[index]
+            else:
+                track_tokens = frozenset(normalize(f"{track.artist} {track.title}"))
+            tokens[index] = track_tokens
+            for token in track_tokens:
+                postings.setdefault(token, set()).add(index)
+
+        deletes = {}
+        for token in postings:
+            if len(token) >= self.min_typo_length:
+                for variant in _deletions(token):
+                    deletes.setdefault(variant, set()).add(token)
+        return _IndexState(tracks, tokens, postings, deletes)
+
+    @staticmethod
+    def _prefix_tokens(state, prefix):
+        """Токены словаря, начинающиеся с prefix"""
+        start = bisect.bisect_left(state.vocabulary, prefix)
+        end = bisect.bisect_left(state.vocabulary, prefix + '\uffff')
+        return state.vocabulary[start:end]
+
+    def _typo_tokens(self, state, token):
+        """Токены словаря на расстоянии одной правки (вставка, удаление, замена)"""
+        if len(token) < self.min_typo_length:
+            return set()
+        candidates = set(state.deletes.get(token, ()))
+        for variant in _deletions(token):
+            if variant in state.postings:
+                candidates.add(variant)
+            candidates |= state.deletes.get(variant, set())
+        return candidates
+
+    def search(self, query, limit=SEARCH_LOCAL_LIMIT):
+        """Найти треки: все слова запроса должны совпасть точно, по префиксу или с опечаткой"""
+        tokens = normalize(query)
+        if not tokens:
+            return []
+
+        with self._lock:
+            state = self._state
+
+        scores = None
+        for token in tokens:
+            # Точное совпадение весит больше префикса, префикс - больше опечатки
+            token_scores = {}
+            for candidate in self._typo_tokens(state, token):
+                for index in state.postings[candidate]:
+                    token_scores[index] = 1
+            for candidate in self._prefix_tokens(state, token):
+                weight = 3 if candidate == token else 2
+                for index in state.postings[candidate]:
+                    if token_scores.get(index, 0) < weight:
+                        token_scores[index] = weight
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {index: score + token_scores[index] for index, score in scores.items()
+                          if index in token_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores, key=lambda index: (-scores[index], index))
+        return [state.tracks[index] for index in ranked[:limit]]
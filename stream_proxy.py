@@ -0,0 +1,193 @@
+"""
+Локальный HTTP-прокси для потокового воспроизведения
+"""
+
+import uuid
+import threading
+from itertools import chain
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import logger, STREAM_CHUNK_SIZE
+from http_session import get_transport
+from hls import HlsStream, HlsError, is_hls_url
+
+# Заголовки ответа CDN, которые передаем плееру
+PASSTHROUGH_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'Last-Modified', 'ETag')
+
+class _StreamHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов плеера к прокси"""
+    server_version = "VKMusicStream/1.0"
+
+    def do_GET(self):
+        self._proxy(send_body=True)
+
+    def do_HEAD(self):
+        self._proxy(send_body=False)
+
+    def _proxy(self, send_body):
+        """Переслать запрос (включая Range) на CDN и отдать ответ плееру"""
+        stream = self.server.proxy.get_stream(self.path)
+        if stream is None:
+            self.send_error(404)
+            return
+
+        url, headers, cache_key = stream
+        if is_hls_url(url):
+            self._serve_hls(url, headers, cache_key, send_body)
+            return
+
+        request_headers = dict(headers)
+        # Байты отдаем как есть, чтобы Content-Length и Range совпадали с телом
+        request_headers['Accept-Encoding'] = 'identity'
+        if self.headers.get('Range'):
+            request_headers['Range'] = self.headers['Range']
+
+        try:
+            method = 'GET' if send_body else 'HEAD'
+            upstream = self.server.proxy.http.request(method, url, headers=request_headers, stream=True)
+        except Exception as e:
+            logger.error(f"Прокси: ошибка запроса к CDN: {e}")
+            self.send_error(502)
+            return
+
+        writer = None
+        try:
+            if upstream.status_code >= 400:
+                self.send_error(502, f"CDN HTTP {upstream.status_code}")
+                return
+
+            self.send_response(upstream.status_code)
+            for name in PASSTHROUGH_HEADERS:
+                if name in upstream.headers:
+                    self.send_header(name, upstream.headers[name])
+            if 'Accept-Ranges' not in upstream.headers:
+                self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+
+            # Файл целиком идет через прокси - параллельно сохраняем его в аудиокэш
+            blob_cache = self.server.proxy.blob_cache
+            if (send_body and cache_key and blob_cache and upstream.status_code == 200
+                    and not blob_cache.contains(cache_key)):
+                writer = blob_cache.writer(cache_key)
+
+            if send_body:
+                for chunk in upstream.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if chunk:
+                        self.wfile.write(chunk)
+                        if writer:
+                            writer.write(chunk)
+
+            if writer:
+                expected = upstream.headers.get('Content-Length')
+                if expected is None or int(expected) == writer.size:
+                    writer.commit()
+                else:
+                    writer.abort()
+                writer = None
+        except (BrokenPipeError, ConnectionResetError):
+            # Плеер закрыл соединение (перемотка или остановка)
+            pass
+        except Exception as e:
+            logger.error(f"Прокси: ошибка передачи потока: {e}")
+        finally:
+            if writer:
+                writer.abort()
+            upstream.close()
+
+    def _serve_hls(self, url, headers, cache_key, send_body):
+        """Отдать трек HLS плееру одним потоком MP3, собирая его из сегментов по мере загрузки"""
+        if not send_body:
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.end_headers()
+            return
+
+        chunks = HlsStream(self.server.proxy.http, url, headers).iter_chunks()
+        writer = None
+        try:
+            # Плейлист разбираем до ответа, чтобы ошибка дошла до плеера кодом HTTP
+            try:
+                first = next(chunks, b'')
+            except HlsError as e:
+                logger.error(f"Прокси: ошибка HLS: {e}")
+                self.send_error(502, "HLS playlist unavailable")
+                return
+
+            # Длина заранее неизвестна и перемотка по байтам невозможна - отдаем поток целиком
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/mpeg')
+            self.end_headers()
+
+            blob_cache = self.server.proxy.blob_cache
+            if cache_key and blob_cache and not blob_cache.contains(cache_key):
+                writer = blob_cache.writer(cache_key)
+
+            for chunk in chain([first], chunks):
+                self.wfile.write(chunk)
+                if writer:
+                    writer.write(chunk)
+
+            if writer:
+                writer.commit()
+                writer = None
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            logger.error(f"Прокси: ошибка передачи потока HLS: {e}")
+        finally:
+            if writer:
+                writer.abort()
+            chunks.close()
+
+    def log_message(self, format, *args):
+        """Не засорять вывод логом каждого запроса"""
+        pass
+
+class StreamProxy:
+    """Локальный HTTP-сервер, отдающий плееру треки с CDN VK без предварительной загрузки"""
+    def __init__(self, transport=None, blob_cache=None):
+        self.http = transport or get_transport()
+        self.blob_cache = blob_cache
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        """Запустить сервер на свободном порту loopback-интерфейса"""
+        with self._lock:
+            if self._server:
+                return
+            self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StreamHandler)
+            self._server.daemon_threads = True
+            self._server.proxy = self
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            logger.info(f"Прокси потокового воспроизведения запущен на порту {self._server.server_port}")
+
+    def register(self, url, headers=None, cache_key=None):
+        """Зарегистрировать трек и получить локальную ссылку для плеера"""
+        self.start()
+        stream_id = uuid.uuid4().hex
+        with self._lock:
+            self._streams[stream_id] = (url, headers or {}, cache_key)
+            port = self._server.server_port
+        return f"http://127.0.0.1:{port}/stream/{stream_id}.mp3"
+
+    def get_stream(self, path):
+        """Найти трек по пути запроса"""
+        stream_id = path.rsplit('/', 1)[-1].split('.', 1)[0]
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def unregister(self, local_url):
+        """Удалить трек из прокси"""
+        stream_id = local_url.rsplit('/', 1)[-1].split('.', 1)[0]
+        with self._lock:
+            self._streams.pop(stream_id, None)
+
+    def stop(self):
+        """Остановить сервер"""
+        with self._lock:
+            server, self._server = self._server, None
+            self._streams.clear()
+        if server:
+            server.shutdown()
+            server.server_close()
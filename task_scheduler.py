@@ -0,0 +1,116 @@
+"""
+Планировщик фоновых задач интерфейса
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import logger, TASK_POOL_SIZES
+
+# Пулы по типу нагрузки: запросы к VK, воспроизведение и загрузка аудио, локальные файлы и индексы
+POOL_API = "api"
+POOL_MEDIA = "media"
+POOL_DISK = "disk"
+
+class CancellationToken:
+    """Флаг отмены задачи; задача может проверять его в долгих циклах"""
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+class Task:
+    """Запущенная задача"""
+    def __init__(self, key, on_done, on_error):
+        self.key = key
+        self.token = CancellationToken()
+        self.on_done = on_done
+        self.on_error = on_error
+        self.future = None
+
+    def cancel(self):
+        """Отменить задачу: если она еще в очереди, не запустится, ее результат будет отброшен"""
+        self.token.cancel()
+        if self.future:
+            self.future.cancel()
+
+class TaskScheduler:
+    """Ограниченные пулы потоков, дедупликация по ключу и единая доставка результатов в главный цикл"""
+    def __init__(self, dispatch, pool_sizes=TASK_POOL_SIZES):
+        self.dispatch = dispatch  # функция передачи вызова в главный цикл (GLib.idle_add)
+        self._pools = {
+            name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"tasks-{name}")
+            for name, size in pool_sizes.items()
+        }
+        self._inflight = {}  # ключ -> задача
+        self._lock = threading.Lock()
+
+    def submit(self, pool, func, on_done=None, key=None, replace=False, on_error=None):
+        """Запустить func(token) в пуле; on_done(результат) вызывается в главном цикле.
+
+        Если задача с тем же ключом еще выполняется, возвращается она (replace=False)
+        или она отменяется и запускается новая (replace=True).
+        """
+        with self._lock:
+            current = self._inflight.get(key) if key is not None else None
+            if current is not None:
+                if not replace:
+                    return current
+                current.cancel()
+
+            task = Task(key, on_done, on_error)
+            if key is not None:
+                self._inflight[key] = task
+            task.future = self._pools[pool].submit(self._run, task, func)
+        return task
+
+    def cancel(self, key):
+        """Отменить задачу по ключу"""
+        with self._lock:
+            task = self._inflight.pop(key, None)
+        if task:
+            task.cancel()
+
+    def is_running(self, key):
+        """Выполняется ли задача с ключом"""
+        with self._lock:
+            return key in self._inflight
+
+    def shutdown(self):
+        """Отменить все задачи и остановить пулы"""
+        with self._lock:
+            tasks = list(self._inflight.values())
+            self._inflight.clear()
+        for task in tasks:
+            task.cancel()
+        for executor in self._pools.values():
+            executor.shutdown(wait=False)
+
+    def _run(self, task, func):
+        """Выполнить задачу в рабочем потоке"""
+        if task.token.cancelled:
+            self._forget(task)
+            return
+        try:
+            result = func(task.token)
+        except Exception as e:
+            logger.error(f"Фоновая задача {task.key or func.__name__} завершилась с ошибкой: {e}")
+            self.dispatch(self._complete, task, task.on_error, e)
+            return
+        self.dispatch(self._complete, task, task.on_done, result)
+
+    def _complete(self, task, callback, value):
+        """Доставить результат в главном цикле, если задачу не отменили"""
+        self._forget(task)
+        if callback and not task.token.cancelled:
+            callback(value)
+        return False
+
+    def _forget(self, task):
+        with self._lock:
+            if task.key is not None and self._inflight.get(task.key) is task:
+                del self._inflight[task.key]
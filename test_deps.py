@@ -7,6 +7,20 @@ try:
 except ImportError as e:
     print(f"❌ Ошибка GTK: {e}")
 
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    print("✅ GStreamer доступен")
+except (ImportError, ValueError) as e:
+    print(f"❌ Ошибка GStreamer: {e}")
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher
+    print("✅ cryptography доступен (зашифрованные треки HLS)")
+except ImportError as e:
+    print(f"❌ Ошибка cryptography: {e}")
+
 try:
     import requests
     print("✅ Requests доступен")
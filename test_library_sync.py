@@ -0,0 +1,82 @@
+"""
+Проверка быстрой синхронизации библиотеки: новые треки, удаления и перестановки в глубине списка
+"""
+
+import tempfile
+import time
+import unittest
+from config import VK_PAGE_SIZE
+from library_cache import LibraryCache, LibrarySync, track_key
+
+def make_tracks(ids):
+    return [{"owner_id": 1, "id": i, "artist": "a", "title": str(i)} for i in ids]
+
+class FakeManager:
+    """Менеджер без сети: отдает список аудиозаписей постранично"""
+
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.full_syncs = 0
+
+    def get_my_audio_list(self, offset=0, count=VK_PAGE_SIZE):
+        return {"success": True, "audio_list": self.tracks[offset:offset + count],
+                "total_count": len(self.tracks)}
+
+    def iter_my_audio_pages(self, progress_callback=None):
+        self.full_syncs += 1
+        for offset in range(0, len(self.tracks), VK_PAGE_SIZE):
+            page = self.get_my_audio_list(offset=offset, count=VK_PAGE_SIZE)
+            page["offset"] = offset
+            yield page
+
+class LibrarySyncTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = LibraryCache(1, cache_dir=self.tmp.name)
+        self.manager = FakeManager(make_tracks(range(1000)))
+        self.sync = LibrarySync(self.manager, self.cache)
+        self.sync.sync_my_audio()
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def assert_cache_matches_server(self):
+        self.assertEqual(self.cache.get_track_keys(), [track_key(t) for t in self.manager.tracks])
+
+    def test_new_tracks_use_fast_path(self):
+        self.manager.tracks = make_tracks(range(2000, 2005)) + self.manager.tracks
+        result = self.sync.sync_my_audio()
+        self.assertEqual(result["added"], 5)
+        self.assertEqual(self.manager.full_syncs, 1)
+        self.assert_cache_matches_server()
+
+    def test_swap_below_anchor_triggers_full_sync(self):
+        tracks = self.manager.tracks
+        tracks[500], tracks[900] = tracks[900], tracks[500]
+        # Новый трек и удаленный в глубине: количество не меняется
+        self.manager.tracks = make_tracks([2000]) + tracks[:700] + tracks[701:]
+        self.sync.sync_my_audio()
+        self.assertEqual(self.manager.full_syncs, 2)
+        self.assert_cache_matches_server()
+
+    def test_reorder_near_anchor_triggers_full_sync(self):
+        tracks = self.manager.tracks
+        tracks[1], tracks[2] = tracks[2], tracks[1]
+        self.sync.sync_my_audio()
+        self.assertEqual(self.manager.full_syncs, 2)
+        self.assert_cache_matches_server()
+
+    def test_tail_deletion_triggers_full_sync(self):
+        self.manager.tracks = make_tracks([2000]) + self.manager.tracks[:-1]
+        self.sync.sync_my_audio()
+        self.assertEqual(self.manager.full_syncs, 2)
+        self.assert_cache_matches_server()
+
+    def test_stale_full_sync_forces_full_sync(self):
+        self.cache.set_meta('my_audio_full_sync', time.time() - 7 * 24 * 3600)
+        self.sync.sync_my_audio()
+        self.assertEqual(self.manager.full_syncs, 2)
+
+if __name__ == '__main__':
+    unittest.main()
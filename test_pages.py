@@ -0,0 +1,52 @@
+"""
+Проверка постраничной загрузки: отказ execute посреди загрузки пачками
+"""
+
+import re
+import time
+import unittest
+from vk_manager import VKMusicManager
+
+TOTAL = 20000
+PAGE_SIZE = 200
+
+def make_manager(refuse_from):
+    """Менеджер без сети: execute отвечает отказом для пачек начиная со смещения refuse_from"""
+    manager = VKMusicManager.__new__(VKMusicManager)
+    manager.api_concurrency = 4
+    manager.execute_batch_size = 25
+    manager.execute_available = True
+
+    def fetch_page(offset, count):
+        items = [{"owner_id": 1, "id": i} for i in range(offset, min(offset + count, TOTAL))]
+        return {"success": True, "items": items, "total_count": TOTAL}
+
+    def execute(calls):
+        offsets = [params["offset"] for _, params in calls]
+        # Ранние пачки отвечают дольше поздних, чтобы страницы приходили не по порядку
+        time.sleep(max(0.0, 0.05 - offsets[0] / TOTAL * 0.05))
+        if offsets[0] >= refuse_from:
+            return {"error": {"error_code": 13, "error_msg": "execute отключен"}}
+        return {"response": [fetch_page(offset, PAGE_SIZE) for offset in offsets]}
+
+    manager._execute = execute
+    return manager, fetch_page
+
+class PagesTest(unittest.TestCase):
+    def test_execute_refused_midway_keeps_every_offset(self):
+        for refuse_from in (0, 5000, 15000):
+            manager, fetch_page = make_manager(refuse_from)
+            pages = list(manager._iter_all_pages("audio.get", {}, fetch_page, "items", TOTAL))
+
+            self.assertTrue(all(page["success"] for page in pages))
+            ids = [item["id"] for page in pages for item in page["items"]]
+            self.assertEqual(ids, list(range(TOTAL)), f"отказ с {refuse_from}")
+
+    def test_execute_refused_after_first_page(self):
+        manager, fetch_page = make_manager(5000)
+        pages = list(manager._iter_all_pages("audio.get", {}, fetch_page, "items", TOTAL, start=PAGE_SIZE))
+        ids = [item["id"] for page in pages for item in page["items"]]
+        self.assertEqual(ids, list(range(PAGE_SIZE, TOTAL)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Компактное представление трека и общая таблица треков
+"""
+
+import sys
+import weakref
+import threading
+from collections import deque
+
+class Track:
+    """Трек VK: только нужные приложению поля вместо полного словаря из ответа API"""
+    __slots__ = ('index', 'owner_id', 'id', 'artist', 'title', 'duration', 'url', 'access_key', '__weakref__')
+
+    FIELDS = ('owner_id', 'id', 'artist', 'title', 'duration', 'url', 'access_key')
+
+    def __init__(self, owner_id, id, artist, title, duration=0, url='', access_key=None):
+        self.index = -1
+        self.owner_id = owner_id
+        self.id = id
+        # Исполнители повторяются от трека к треку - храним одну копию строки
+        self.artist = sys.intern(artist)
+        self.title = title
+        self.duration = duration
+        self.url = url
+        self.access_key = access_key
+
+    @classmethod
+    def from_dict(cls, data):
+        """Создать трек из ответа VK API"""
+        return cls(
+            data.get('owner_id'),
+            data.get('id'),
+            data.get('artist') or 'Unknown',
+            data.get('title') or 'Unknown',
+            data.get('duration') or 0,
+            data.get('url') or '',
+            data.get('access_key')
+        )
+
+    def to_dict(self):
+        """Словарь для сохранения на диск"""
+        return {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+
+    @property
+    def key(self):
+        """Ключ трека VK: owner_id_id"""
+        return f"{self.owner_id}_{self.id}"
+
+    # Доступ как к словарю, чтобы код, работающий с ответами API, принимал и Track
+    def get(self, name, default=None):
+        value = getattr(self, name, None) if name in self.FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, name):
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self.FIELDS and getattr(self, name) is not None
+
+    def __repr__(self):
+        return f"Track({self.key}, {self.artist!r} - {self.title!r})"
+
+class TrackTable:
+    """Общая таблица треков: один объект на трек, списки интерфейса хранят только индексы.
+
+    Таблица держит треки по слабым ссылкам: строка освобождается, когда трек больше не нужен
+    ни списку интерфейса, ни заданию загрузки, ни очереди плеера, и ее индекс получает новый трек.
+    """
+    def __init__(self):
+        self._tracks = []  # индекс -> слабая ссылка на трек или None для свободной строки
+        self._by_key = weakref.WeakValueDictionary()
+        self._free = []
+        # Индексы удаленных треков; колбэк слабой ссылки может сработать в любом потоке,
+        # поэтому он только дописывает сюда индекс, а строки освобождаются под блокировкой
+        self._released = deque()
+        self._lock = threading.Lock()
+
+    def add(self, data):
+        """Добавить трек (словарь VK или Track) и вернуть общий объект"""
+        with self._lock:
+            self._reclaim_locked()
+            return self._add_locked(data)
+
+    def add_all(self, items):
+        """Добавить список треков, сохранив порядок"""
+        with self._lock:
+            self._reclaim_locked()
+            return [self._add_locked(data) for data in items]
+
+    def _add_locked(self, data):
+        track = data if isinstance(data, Track) else Track.from_dict(data)
+        existing = self._by_key.get(track.key)
+        if existing is not None:
+            # Ссылки VK со временем истекают - берем более свежую
+            if track.url and track is not existing:
+                existing.url = track.url
+            return existing
+
+        track.index = self._free.pop() if self._free else len(self._tracks)
+        released = self._released
+        ref = weakref.ref(track, lambda _, index=track.index: released.append(index))
+        if track.index == len(self._tracks):
+            self._tracks.append(ref)
+        else:
+            self._tracks[track.index] = ref
+        self._by_key[track.key] = track
+        return track
+
+    def _reclaim_locked(self):
+        """Освободить строки треков, на которые больше никто не ссылается"""
+        while self._released:
+            index = self._released.popleft()
+            ref = self._tracks[index]
+            if ref is not None and ref() is None:
+                self._tracks[index] = None
+                self._free.append(index)
+
+    def get_by_key(self, key):
+        """Найти трек по ключу owner_id_id"""
+        with self._lock:
+            return self._by_key.get(key)
+
+    def __getitem__(self, index):
+        ref = self._tracks[index]
+        track = ref() if ref is not None else None
+        if track is None:
+            raise IndexError(index)
+        return track
+
+    def __len__(self):
+        with self._lock:
+            self._reclaim_locked()
+            return len(self._tracks) - len(self._free)
+
+_shared_table = None
+_shared_lock = threading.Lock()
+
+def get_track_table():
+    """Получить общую таблицу треков"""
+    global _shared_table
+    with _shared_lock:
+        if _shared_table is None:
+            _shared_table = TrackTable()
+        return _shared_table
@@ -0,0 +1,45 @@
+"""
+LRU-кэш с ограниченным временем жизни записей
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+class TTLCache:
+    """Хранит не более maxsize записей, каждая живет не дольше ttl секунд"""
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ключ -> (время истечения, значение)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Получить значение, если запись есть и не устарела"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Сохранить значение, вытеснив самую давнюю запись при переполнении"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Удалить все записи"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -2,13 +2,20 @@
 Главный класс GUI приложения
 """
 
-import os
-import threading
 import subprocess
-from config import GTK_AVAILABLE, APP_NAME, DEFAULT_WINDOW_SIZE, logger
-from music_player import MusicPlayer
+from config import (GTK_AVAILABLE, APP_NAME, DEFAULT_WINDOW_SIZE, SEARCH_DEBOUNCE_MS, PLAYER_UI_REFRESH_MS,
+                    TRACKS_FILL_CHUNK, logger)
+from music_player import MusicPlayer, PLAYER_PLAYING, PLAYER_PAUSED
+from audio_backends import GST_AVAILABLE
 from vk_manager import VKMusicManager
-from widgets import create_tracks_treeview, create_playlists_treeview, create_downloads_treeview
+from library_cache import LibraryCache, LibrarySync, load_last_user_id, save_last_user_id
+from download_manager import DownloadManager, JOB_DONE, JOB_FAILED, JOB_STATE_LABELS
+from widgets import (create_tracks_treeview, create_playlists_treeview, create_downloads_treeview,
+                     create_download_jobs_treeview, populate_tracks_liststore, track_at, format_size)
+from track import get_track_table
+from search_index import LibrarySearchIndex
+from task_scheduler import TaskScheduler, POOL_API, POOL_MEDIA, POOL_DISK
+from ui_bus import UIUpdateBus
 
 if GTK_AVAILABLE:
     import gi
@@ -19,10 +26,42 @@ class VKMusicApp:
     def __init__(self):
         self.manager = VKMusicManager()
         self.player = MusicPlayer()
+        self.track_table = get_track_table()
+        # Обновления виджетов из фоновых потоков сливаются и применяются с ограниченной частотой
+        self.ui_bus = UIUpdateBus()
+        # Все фоновые задачи интерфейса идут через планировщик, результаты - в главный цикл GTK
+        self.tasks = TaskScheduler(self.ui_bus.dispatch)
+        self.search_index = LibrarySearchIndex()
+        self.local_search_hits = []
+        self.search_tracks = []  # треки в списке результатов поиска (очередь плеера при запуске из поиска)
+        self.search_debounce_id = None
         self.current_tracks = []
         self.current_playlist = None
+        self.playlist_tracks = []
+        self.recommendation_tracks = []
         self.current_track_index = -1
         self.loading_more = False
+        self.library_cache = None
+        self.library_sync = None
+        
+        # События плеера приходят из фонового потока
+        self.player.on_track_changed = lambda track: self.ui_bus.dispatch(self.on_player_track_changed, track)
+        self.player.on_playback_finished = lambda: self.ui_bus.dispatch(self.on_playback_finished)
+        self.player.on_state_changed = lambda state: self.ui_bus.dispatch(self.on_player_state_changed, state)
+        self.player.on_playback_error = lambda message: self.ui_bus.dispatch(self.update_status, f"Ошибка: {message}")
+        self.player_status_timer = None
+        
+        # Менеджер загрузок сообщает о смене состояния заданий из рабочих потоков
+        self.download_manager = DownloadManager(self.manager)
+        self.download_manager.on_job_changed = lambda job: self.ui_bus.post(
+            self.on_download_job_changed, job, key=("download_job", job.id)
+        )
+        self.download_job_rows = {}
+        self.download_stats_timer = None
+        # Список загруженных файлов обновляется по индексу папки: путь -> (строка, размер)
+        self.downloads_index = self.manager.downloads_index
+        self.download_file_rows = {}
+        self.downloads_total_size = 0
         
         # Создание главного окна
         self.window = Gtk.Window(title=APP_NAME)
@@ -71,8 +110,7 @@ class VKMusicApp:
         # Вкладка о программе
         self.create_about_tab(notebook)
         
-        # Запуск обновления статуса плеера
-        GLib.timeout_add(1000, self.update_player_status)
+        self.on_player_state_changed(self.player.state)
 
     def create_player_controls(self, parent):
         """Панель управления плеером"""
@@ -140,7 +178,7 @@ class VKMusicApp:
         volume_box.pack_start(volume_label, False, False, 0)
         
         self.volume_scale = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, 0, 100, 5)
-        self.volume_scale.set_value(80)
+        self.volume_scale.set_value(self.player.volume)
         self.volume_scale.set_size_request(100, -1)
         self.volume_scale.connect("value-changed", self.on_volume_changed)
         volume_box.pack_start(self.volume_scale, False, False, 0)
@@ -247,6 +285,10 @@ class VKMusicApp:
         self.download_all_btn = Gtk.Button(label="💾 Скачать все")
         self.download_all_btn.connect("clicked", self.on_download_all_music)
         action_box.pack_start(self.download_all_btn, False, False, 0)
+        
+        self.sync_folder_btn = Gtk.Button(label="🔄 Синхронизировать с папкой")
+        self.sync_folder_btn.connect("clicked", self.on_sync_music_folder)
+        action_box.pack_start(self.sync_folder_btn, False, False, 0)
 
     def create_playlists_tab(self, notebook):
         """Создать вкладку плейлистов"""
@@ -322,6 +364,7 @@ class VKMusicApp:
         self.search_entry = Gtk.Entry()
         self.search_entry.set_placeholder_text("Введите запрос для поиска...")
         self.search_entry.connect("activate", self.on_search)
+        self.search_entry.connect("changed", self.on_search_changed)
         search_box.pack_start(self.search_entry, True, True, 0)
         
         search_btn = Gtk.Button(label="Искать")
@@ -433,7 +476,40 @@ class VKMusicApp:
         self.downloads_info_label = Gtk.Label()
         box.pack_start(self.downloads_info_label, False, False, 0)
         
-        self.update_downloads_list()
+        # Очередь загрузок
+        queue_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        box.pack_start(queue_box, False, False, 0)
+        
+        queue_label = Gtk.Label()
+        queue_label.set_markup("<b>Очередь загрузок</b>")
+        queue_box.pack_start(queue_label, False, False, 0)
+        
+        retry_btn = Gtk.Button(label="🔁 Повторить ошибки")
+        retry_btn.connect("clicked", self.on_retry_failed_downloads)
+        queue_box.pack_start(retry_btn, False, False, 0)
+        
+        clear_btn = Gtk.Button(label="🧹 Убрать завершенные")
+        clear_btn.connect("clicked", self.on_clear_finished_downloads)
+        queue_box.pack_start(clear_btn, False, False, 0)
+        
+        jobs_scrolled = Gtk.ScrolledWindow()
+        jobs_scrolled.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        jobs_scrolled.set_size_request(-1, 150)
+        box.pack_start(jobs_scrolled, False, True, 0)
+        
+        self.download_jobs_treeview, self.download_jobs_liststore = create_download_jobs_treeview()
+        jobs_scrolled.add(self.download_jobs_treeview)
+        
+        self.download_stats_label = Gtk.Label()
+        box.pack_start(self.download_stats_label, False, False, 0)
+        
+        self.load_downloads_list()
+        
+        # Незавершенные загрузки прошлой сессии продолжаются сразу
+        for job in self.download_manager.get_jobs():
+            self.on_download_job_changed(job)
+        if self.download_manager.is_active():
+            self.download_manager.start()
 
     def create_about_tab(self, notebook):
         """Вкладка о программе"""
@@ -500,15 +576,20 @@ class VKMusicApp:
 
     def on_check_dependencies(self, widget):
         """Проверить зависимости"""
-        def check_deps():
+        def check_deps(token):
             missing_deps = []
             
-            # Проверка mplayer
+            # Проверка движков воспроизведения: достаточно одного из них
             try:
                 subprocess.run(['which', 'mplayer'], check=True, capture_output=True)
                 mplayer_status = "✅ mplayer установлен"
+                mplayer_found = True
             except subprocess.CalledProcessError:
                 mplayer_status = "❌ mplayer не установлен"
+                mplayer_found = False
+            
+            gst_status = "✅ GStreamer доступен" if GST_AVAILABLE else "❌ GStreamer не доступен"
+            if not mplayer_found and not GST_AVAILABLE:
                 missing_deps.append("mplayer")
             
             # Проверка Python модулей
@@ -534,7 +615,7 @@ class VKMusicApp:
                 dotenv_status = "❌ python-dotenv не доступен"
                 missing_deps.append("python-dotenv")
             
-            status_text = f"{mplayer_status}\n{gtk_status}\n{requests_status}\n{dotenv_status}"
+            status_text = f"{mplayer_status}\n{gst_status}\n{gtk_status}\n{requests_status}\n{dotenv_status}"
             
             if missing_deps:
                 status_text += f"\n\n❌ Отсутствуют зависимости: {', '.join(missing_deps)}"
@@ -544,9 +625,9 @@ class VKMusicApp:
             else:
                 status_text += "\n\n✅ Все зависимости установлены!"
             
-            GLib.idle_add(self.deps_status_label.set_text, status_text)
+            return status_text
         
-        threading.Thread(target=check_deps, daemon=True).start()
+        self.tasks.submit(POOL_DISK, check_deps, self.deps_status_label.set_text, key="check_deps")
 
     # Обработчики управления плеером
     def on_seek(self, widget, event):
@@ -558,12 +639,27 @@ class VKMusicApp:
             seek_position = (position / 100.0) * duration
             self.player.seek(seek_position)
 
+    def on_player_state_changed(self, state):
+        """Плеер сменил состояние: таймер прогресса работает, только пока трек играет"""
+        if state == PLAYER_PLAYING:
+            self.player_status_label.set_text("▶️ Играет")
+            if self.player_status_timer is None:
+                self.player_status_timer = GLib.timeout_add(PLAYER_UI_REFRESH_MS, self.update_player_status)
+            self.update_player_status()
+            return
+        
+        if self.player_status_timer is not None:
+            GLib.source_remove(self.player_status_timer)
+            self.player_status_timer = None
+        if state == PLAYER_PAUSED:
+            self.player_status_label.set_text("⏸️ Пауза")
+        else:
+            self.player_status_label.set_text("⏹️ Остановлено")
+
     def update_player_status(self):
         """Статус плеера"""
         if self.player.is_playing:
-            self.player_status_label.set_text("▶️ Играет")
-            
-            # Обновляем прогресс
+            # Обновляем прогресс (позиция интерполируется плеером, без запроса к mplayer)
             position = self.player.get_position()
             duration = self.player.get_duration()
             
@@ -580,10 +676,10 @@ class VKMusicApp:
                 # Обновляем ползунок
                 progress = (position / duration) * 100
                 self.progress_scale.set_value(progress)
-        else:
-            self.player_status_label.set_text("⏸️ Остановлено")
-            
-        return True
+            return True
+        
+        self.player_status_timer = None
+        return False
 
     def on_play_pause(self, widget):
         """Обработчик плей/паузы"""
@@ -631,36 +727,64 @@ class VKMusicApp:
 
     def play_track(self, track_data):
         """Воспроизвести трек"""
-        def play_thread():
+        def play_thread(token):
+            # Ссылки текущего и следующих треков обновляются одним запросом, пока они не понадобились
+            # Трек из аудиокэша играет без сети - его ссылку не обновляем
             url = track_data.get('url')
-            artist = track_data.get('artist', 'Unknown')
-            title = track_data.get('title', 'Unknown')
-            
-            success, message = self.player.play(url, track_data)
-            
-            GLib.idle_add(lambda: self.update_status(
-                f"Воспроизводится: {artist} - {title}" if success else f"Ошибка: {message}"
-            ))
-            
+            if self.manager.needs_network(track_data, downloads=False):
+                resolver = self.manager.url_resolver
+                start = self.player.current_index + 1
+                upcoming = self.player.playlist[start:start + resolver.batch_size] if start > 0 else []
+                ahead = [track for track in upcoming if self.manager.needs_network(track, downloads=False)]
+                url = resolver.ensure(track_data, ahead) or url
+            # Пока обновляли ссылку, пользователь мог выбрать другой трек
+            if token.cancelled:
+                return None
+            return self.player.play(url, track_data)
+        
+        def on_started(result):
+            if result is None:
+                return
+            success, message = result
             if success:
-                GLib.idle_add(lambda: self.current_track_label.set_markup(
-                    f"<b>Сейчас играет:</b> {artist} - {title}"
-                ))
-                GLib.idle_add(lambda: self.play_btn.set_image(
-                    Gtk.Image.new_from_icon_name("media-playback-pause", Gtk.IconSize.BUTTON)
-                ))
-                
-                # Сбрасываем прогресс
-                GLib.idle_add(lambda: self.progress_scale.set_value(0))
-                GLib.idle_add(lambda: self.position_label.set_text("0:00"))
-                
-                duration = track_data.get('duration', 0)
-                if duration > 0:
-                    dur_min = int(duration // 60)
-                    dur_sec = int(duration % 60)
-                    GLib.idle_add(lambda: self.duration_label.set_text(f"{dur_min}:{dur_sec:02d}"))
+                self.show_now_playing(track_data)
+            else:
+                self.update_status(f"Ошибка: {message}")
+        
+        # Последний выбранный трек отменяет еще не начатое воспроизведение предыдущего
+        self.tasks.submit(POOL_MEDIA, play_thread, on_started, key="play", replace=True)
+
+    def show_now_playing(self, track_data):
+        """Показать текущий трек в панели плеера"""
+        artist = track_data.get('artist', 'Unknown')
+        title = track_data.get('title', 'Unknown')
+        
+        self.update_status(f"Воспроизводится: {artist} - {title}")
+        self.current_track_label.set_markup(f"<b>Сейчас играет:</b> {artist} - {title}")
+        self.play_btn.set_image(Gtk.Image.new_from_icon_name("media-playback-pause", Gtk.IconSize.BUTTON))
         
-        threading.Thread(target=play_thread, daemon=True).start()
+        # Сбрасываем прогресс
+        self.progress_scale.set_value(0)
+        self.position_label.set_text("0:00")
+        
+        duration = track_data.get('duration', 0)
+        if duration > 0:
+            dur_min = int(duration // 60)
+            dur_sec = int(duration % 60)
+            self.duration_label.set_text(f"{dur_min}:{dur_sec:02d}")
+
+    def on_player_track_changed(self, track_data):
+        """Плеер сам перешел к следующему треку"""
+        self.show_now_playing(track_data)
+
+    def on_playback_finished(self):
+        """Трек доигран - переходим к следующему"""
+        track = self.player.next_track()
+        if track:
+            self.play_track(track)
+        else:
+            self.play_btn.set_image(Gtk.Image.new_from_icon_name("media-playback-start", Gtk.IconSize.BUTTON))
+            self.update_status("Воспроизведение завершено")
 
     # Методы для работы с рекомендациями
     def on_load_recommendations(self, widget):
@@ -669,12 +793,12 @@ class VKMusicApp:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def load_recommendations():
-            GLib.idle_add(self.update_status, "Загружаем рекомендации...")
-            result = self.manager.get_recommendations(offset=0, count=100)
-            GLib.idle_add(self.on_recommendations_loaded, result)
+        def load_recommendations(token):
+            self.ui_bus.post(self.update_status, "Загружаем рекомендации...")
+            return self.manager.get_recommendations(offset=0, count=100)
         
-        threading.Thread(target=load_recommendations, daemon=True).start()
+        self.tasks.submit(POOL_API, load_recommendations, self.on_recommendations_loaded,
+                          key="recommendations", replace=True)
 
     def on_load_popular(self, widget):
         """Загрузить популярную музыку"""
@@ -682,33 +806,20 @@ class VKMusicApp:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def load_popular():
-            GLib.idle_add(self.update_status, "Загружаем популярную музыку...")
-            result = self.manager.get_popular_music(offset=0, count=100)
-            GLib.idle_add(self.on_recommendations_loaded, result)
+        def load_popular(token):
+            self.ui_bus.post(self.update_status, "Загружаем популярную музыку...")
+            return self.manager.get_popular_music(offset=0, count=100)
         
-        threading.Thread(target=load_popular, daemon=True).start()
+        self.tasks.submit(POOL_API, load_popular, self.on_recommendations_loaded,
+                          key="recommendations", replace=True)
 
     def on_recommendations_loaded(self, result):
         """Обработчик загрузки рекомендаций"""
         if result["success"]:
-            self.recommendations_liststore.clear()
-            recommendations = result["audio_list"]
-            
-            # Создаем плейлист для плеера
-            playlist = []
-            for track in recommendations:
-                artist = track.get('artist', 'Unknown')
-                title = track.get('title', 'Unknown')
-                duration = track.get('duration', 0)
-                minutes = duration // 60
-                seconds = duration % 60
-                duration_str = f"{minutes}:{seconds:02d}"
-                
-                self.recommendations_liststore.append([artist, title, duration_str, track.get('url', ''), track])
-                playlist.append(track)
+            recommendations = self.track_table.add_all(result["audio_list"])
             
-            self.player.set_playlist(playlist)
+            self.recommendation_tracks = recommendations
+            populate_tracks_liststore(self.recommendations_liststore, recommendations)
             
             total_count = result.get("total_count", len(recommendations))
             loaded_count = len(recommendations)
@@ -731,7 +842,8 @@ class VKMusicApp:
         model = treeview.get_model()
         treeiter = model.get_iter(path)
         if treeiter is not None:
-            track_data = model[treeiter][4]
+            track_data = track_at(model, treeiter)
+            self.player.set_playlist(list(self.recommendation_tracks))
             self.player.current_index = path[0]
             self.play_track(track_data)
 
@@ -740,19 +852,12 @@ class VKMusicApp:
         selection = self.recommendations_treeview.get_selection()
         model, treeiter = selection.get_selected()
         if treeiter is not None:
-            track_data = model[treeiter][4]
+            track_data = track_at(model, treeiter)
             artist = track_data.get('artist', 'Unknown Artist')
             title = track_data.get('title', 'Unknown Title')
             
-            def download():
-                GLib.idle_add(self.update_status, f"Скачиваем: {artist} - {title}")
-                success, message = self.manager.download_track(track_data)
-                GLib.idle_add(lambda: self.update_status(
-                    f"Скачан: {artist} - {title}" if success else f"Ошибка: {message}"
-                ))
-                GLib.idle_add(self.update_downloads_list)
-            
-            threading.Thread(target=download, daemon=True).start()
+            self.download_manager.enqueue([track_data])
+            self.update_status(f"Добавлен в очередь загрузок: {artist} - {title}")
 
     def on_load_more_recommendations(self, widget):
         """Загрузить еще рекомендаций"""
@@ -760,40 +865,81 @@ class VKMusicApp:
 
     # Методы для работы с музыкой
     def on_load_my_music(self, widget):
-        """Загрузить мою музыку (первые 200 треков)"""
+        """Показать мою музыку: сразу из кэша, затем синхронизация с VK"""
         if not self.manager.token:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def load_music():
-            GLib.idle_add(self.update_status, "Загружаем вашу музыку...")
-            result = self.manager.get_my_audio_list(offset=0, count=200)
-            GLib.idle_add(self.on_music_loaded, result)
+        if self.library_sync:
+            self.show_cached_music()
+            self.sync_library()
+            return
+        
+        def load_music(token):
+            self.ui_bus.post(self.update_status, "Загружаем вашу музыку...")
+            return self.manager.get_my_audio_list(offset=0, count=200)
         
-        threading.Thread(target=load_music, daemon=True).start()
+        self.tasks.submit(POOL_API, load_music, self.on_music_loaded, key="my_music")
+
+    def show_cached_music(self):
+        """Показать библиотеку из локального кэша (чтение и разбор идут в фоне)"""
+        library_cache = self.library_cache
+        
+        def on_loaded(tracks):
+            if tracks:
+                self.on_music_loaded({"success": True, "audio_list": tracks, "total_count": len(tracks)})
+        
+        self.tasks.submit(POOL_DISK, lambda token: self.track_table.add_all(library_cache.load_tracks()),
+                          on_loaded, key="cached_music", replace=True)
+
+    def sync_library(self):
+        """Фоновая синхронизация библиотеки с VK"""
+        def sync_music(token):
+            def progress_callback(offset, total):
+                progress = offset / total if total > 0 else 0
+                self.ui_bus.post(self.music_progress.set_visible, True)
+                self.ui_bus.post(self.music_progress.set_fraction, progress)
+                self.ui_bus.post(self.music_progress.set_text, f"Загружено: {offset}/{total}")
+            
+            self.ui_bus.post(self.update_status, "Синхронизируем вашу музыку...")
+            result = self.library_sync.sync_my_audio(progress_callback)
+            
+            if result["success"] and (result["added"] or result["removed"] or not self.current_tracks):
+                result["audio_list"] = self.track_table.add_all(self.library_cache.load_tracks())
+            return result
+        
+        def on_synced(result):
+            # Библиотека из кэша, если еще не показана, уже устарела
+            if "audio_list" in result:
+                self.tasks.cancel("cached_music")
+            if not result["success"]:
+                if self.current_tracks or self.tasks.is_running("cached_music"):
+                    self.music_progress.set_visible(False)
+                    self.update_status(f"Ошибка синхронизации: {result.get('error')}")
+                else:
+                    self.on_music_loaded(result)
+                return
+            
+            if "audio_list" in result:
+                tracks = result["audio_list"]
+                self.on_music_loaded({"success": True, "audio_list": tracks, "total_count": len(tracks)})
+            else:
+                self.music_progress.set_visible(False)
+            self.update_status(
+                f"Библиотека синхронизирована: добавлено {result['added']}, удалено {result['removed']}"
+            )
+        
+        self.tasks.submit(POOL_API, sync_music, on_synced, key="my_music")
 
     def on_music_loaded(self, result):
         """Обработчик загрузки музыки"""
         self.music_progress.set_visible(False)
         
         if result["success"]:
-            self.current_tracks = result["audio_list"]
-            self.tracks_liststore.clear()
+            self.current_tracks = self.track_table.add_all(result["audio_list"])
+            self.index_tracks("library", self.current_tracks)
             
-            # Создаем плейлист для плеера
-            playlist = []
-            for track in self.current_tracks:
-                artist = track.get('artist', 'Unknown')
-                title = track.get('title', 'Unknown')
-                duration = track.get('duration', 0)
-                minutes = duration // 60
-                seconds = duration % 60
-                duration_str = f"{minutes}:{seconds:02d}"
-                
-                self.tracks_liststore.append([artist, title, duration_str, track.get('url', ''), track])
-                playlist.append(track)
-            
-            self.player.set_playlist(playlist)
+            populate_tracks_liststore(self.tracks_liststore, self.current_tracks)
             
             total_count = result.get("total_count", len(self.current_tracks))
             loaded_count = len(self.current_tracks)
@@ -811,12 +957,37 @@ class VKMusicApp:
         else:
             self.show_error_dialog(f"Ошибка загрузки: {result.get('error')}")
 
+    def on_music_page_loaded(self, page):
+        """Показать очередную страницу музыки, не дожидаясь остальных"""
+        tracks = self.track_table.add_all(page["audio_list"])
+        if page["offset"] == 0:
+            self.current_tracks = tracks
+            populate_tracks_liststore(self.tracks_liststore, tracks)
+        else:
+            self.current_tracks.extend(tracks)
+            populate_tracks_liststore(self.tracks_liststore, tracks, append=True)
+
+    def on_all_music_loaded(self, result):
+        """Обработчик окончания постраничной загрузки музыки"""
+        self.music_progress.set_visible(False)
+        
+        if not result["success"]:
+            self.show_error_dialog(f"Ошибка загрузки: {result.get('error')}")
+            return
+        
+        self.index_tracks("library", self.current_tracks)
+        self.load_more_btn.set_sensitive(False)
+        self.music_info_label.set_text(f"Загружено {len(self.current_tracks)} из {result['total_count']} треков")
+        self.update_status(f"Загружено {len(self.current_tracks)} треков (всего {result['total_count']})")
+
     def on_track_activated(self, treeview, path, column):
         """Обработчик активации трека (двойной клик)"""
         model = treeview.get_model()
         treeiter = model.get_iter(path)
         if treeiter is not None:
-            track_data = model[treeiter][4]
+            track_data = track_at(model, treeiter)
+            # Очередь плеера - этот же список, поэтому догружаемые страницы сразу попадают в нее
+            self.player.set_playlist(self.current_tracks)
             self.player.current_index = path[0]  # Устанавливаем текущий индекс
             self.play_track(track_data)
 
@@ -825,19 +996,12 @@ class VKMusicApp:
         selection = self.tracks_treeview.get_selection()
         model, treeiter = selection.get_selected()
         if treeiter is not None:
-            track_data = model[treeiter][4]
+            track_data = track_at(model, treeiter)
             artist = track_data.get('artist', 'Unknown Artist')
             title = track_data.get('title', 'Unknown Title')
             
-            def download():
-                GLib.idle_add(self.update_status, f"Скачиваем: {artist} - {title}")
-                success, message = self.manager.download_track(track_data)
-                GLib.idle_add(lambda: self.update_status(
-                    f"Скачан: {artist} - {title}" if success else f"Ошибка: {message}"
-                ))
-                GLib.idle_add(self.update_downloads_list)
-            
-            threading.Thread(target=download, daemon=True).start()
+            self.download_manager.enqueue([track_data])
+            self.update_status(f"Добавлен в очередь загрузок: {artist} - {title}")
 
     def on_download_all_music(self, widget):
         """Скачать всю музыку"""
@@ -845,32 +1009,36 @@ class VKMusicApp:
             self.show_error_dialog("Нет треков для скачивания")
             return
         
-        def download_all():
-            successful = 0
-            total = len(self.current_tracks)
-            
-            for i, track in enumerate(self.current_tracks):
-                artist = track.get('artist', 'Unknown Artist')
-                title = track.get('title', 'Unknown Title')
-                
-                GLib.idle_add(self.update_status, f"Скачиваем {i+1}/{total}: {artist} - {title}")
-                
-                success, message = self.manager.download_track(track)
-                if success:
-                    successful += 1
-                
-                # Обновляем прогресс
-                progress = (i + 1) / total
-                GLib.idle_add(self.music_progress.set_fraction, progress)
-                GLib.idle_add(self.music_progress.set_text, f"Скачано: {i+1}/{total}")
-            
-            GLib.idle_add(self.update_status, f"Скачано {successful} из {total} треков")
-            GLib.idle_add(self.music_progress.set_visible, False)
-            GLib.idle_add(self.update_downloads_list)
+        jobs = self.download_manager.enqueue(self.current_tracks)
+        self.update_status(f"Добавлено в очередь загрузок: {len(jobs)} треков")
         
         self.music_progress.set_visible(True)
         self.music_progress.set_fraction(0)
-        threading.Thread(target=download_all, daemon=True).start()
+
+    def on_sync_music_folder(self, widget):
+        """Докачать в папку загрузок только те треки библиотеки, которых там еще нет"""
+        if not self.current_tracks:
+            self.show_error_dialog("Нет треков для синхронизации")
+            return
+        
+        tracks = list(self.current_tracks)
+        
+        def find_missing(token):
+            changes = self.downloads_index.rescan()
+            return changes, self.downloads_index.missing_tracks(tracks)
+        
+        self.update_status("Сверяем библиотеку с папкой загрузок...")
+        self.tasks.submit(POOL_DISK, find_missing,
+                          lambda result: self.on_sync_folder_planned(result, len(tracks)), key="sync_folder")
+
+    def on_sync_folder_planned(self, result, total):
+        """Поставить в очередь недостающие треки"""
+        changes, missing = result
+        self.apply_downloads_changes(*changes)
+        jobs = self.download_manager.enqueue(missing)
+        self.update_status(
+            f"В папке уже есть {total - len(missing)} из {total} треков, добавлено в очередь: {len(jobs)}"
+        )
 
     # Методы для работы с плейлистами
     def on_load_playlists(self, widget):
@@ -879,12 +1047,20 @@ class VKMusicApp:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def load_playlists():
-            GLib.idle_add(self.update_status, "Загружаем плейлисты...")
-            result = self.manager.get_playlists(offset=0, count=200)
-            GLib.idle_add(self.on_playlists_loaded, result)
+        if self.library_sync:
+            cached_playlists = self.library_cache.load_playlists()
+            if cached_playlists:
+                self.on_playlists_loaded({
+                    "success": True, "playlists": cached_playlists, "total_count": len(cached_playlists)
+                })
+        
+        def load_playlists(token):
+            self.ui_bus.post(self.update_status, "Загружаем плейлисты...")
+            if self.library_sync:
+                return self.library_sync.sync_playlists()
+            return self.manager.get_playlists(offset=0, count=200)
         
-        threading.Thread(target=load_playlists, daemon=True).start()
+        self.tasks.submit(POOL_API, load_playlists, self.on_playlists_loaded, key="playlists")
 
     def on_playlists_loaded(self, result):
         """Обработчик загрузки плейлистов"""
@@ -919,33 +1095,49 @@ class VKMusicApp:
         if treeiter is not None:
             playlist_id = model[treeiter][1]
             
-            def load_playlist_tracks():
-                GLib.idle_add(self.update_status, "Загружаем треки плейлиста...")
-                result = self.manager.get_playlist_tracks(playlist_id, offset=0, count=200)
-                GLib.idle_add(self.on_playlist_tracks_loaded, result)
+            if self.library_sync:
+                library_cache = self.library_cache
+                
+                def on_cached_loaded(tracks):
+                    if tracks:
+                        self.on_playlist_tracks_loaded({
+                            "success": True, "audio_list": tracks, "total_count": len(tracks)
+                        }, playlist_id)
+                
+                self.tasks.submit(
+                    POOL_DISK,
+                    lambda token: self.track_table.add_all(library_cache.load_playlist_tracks(playlist_id)),
+                    on_cached_loaded, key="cached_playlist_tracks", replace=True
+                )
+            
+            def on_loaded(result):
+                # Свежий состав пришел раньше кэша - кэш уже не показываем
+                self.tasks.cancel("cached_playlist_tracks")
+                self.on_playlist_tracks_loaded(result, playlist_id)
             
-            threading.Thread(target=load_playlist_tracks, daemon=True).start()
+            def load_playlist_tracks(token):
+                self.ui_bus.post(self.update_status, "Загружаем треки плейлиста...")
+                if self.library_sync:
+                    result = self.library_sync.sync_playlist_tracks(playlist_id)
+                else:
+                    result = self.manager.get_playlist_tracks(playlist_id, offset=0, count=200)
+                # Треки разбираем здесь, чтобы не занимать главный цикл
+                if result["success"]:
+                    result["audio_list"] = self.track_table.add_all(result["audio_list"])
+                return result
+            
+            # Ответ для ранее выбранного плейлиста уже не нужен
+            self.tasks.submit(POOL_API, load_playlist_tracks, on_loaded, key="playlist_tracks", replace=True)
 
-    def on_playlist_tracks_loaded(self, result):
+    def on_playlist_tracks_loaded(self, result, playlist_id=None):
         """Обработчик загрузки треков плейлиста"""
         if result["success"]:
-            self.playlist_tracks_liststore.clear()
-            playlist_tracks = result["audio_list"]
+            playlist_tracks = self.track_table.add_all(result["audio_list"])
+            if playlist_id is not None:
+                self.index_tracks(f"playlist_{playlist_id}", playlist_tracks)
             
-            # Создаем плейлист для плеера
-            playlist = []
-            for track in playlist_tracks:
-                artist = track.get('artist', 'Unknown')
-                title = track.get('title', 'Unknown')
-                duration = track.get('duration', 0)
-                minutes = duration // 60
-                seconds = duration % 60
-                duration_str = f"{minutes}:{seconds:02d}"
-                
-                self.playlist_tracks_liststore.append([artist, title, duration_str, track.get('url', ''), track])
-                playlist.append(track)
-            
-            self.player.set_playlist(playlist)
+            self.playlist_tracks = playlist_tracks
+            populate_tracks_liststore(self.playlist_tracks_liststore, playlist_tracks)
             
             total_count = result.get("total_count", len(playlist_tracks))
             loaded_count = len(playlist_tracks)
@@ -961,12 +1153,35 @@ class VKMusicApp:
         else:
             self.show_error_dialog(f"Ошибка загрузки треков: {result.get('error')}")
 
+    def on_playlist_tracks_page_loaded(self, page):
+        """Показать очередную страницу треков плейлиста"""
+        tracks = self.track_table.add_all(page["audio_list"])
+        if page["offset"] == 0:
+            self.playlist_tracks = tracks
+            populate_tracks_liststore(self.playlist_tracks_liststore, tracks)
+        else:
+            self.playlist_tracks.extend(tracks)
+            populate_tracks_liststore(self.playlist_tracks_liststore, tracks, append=True)
+
+    def on_all_playlist_tracks_loaded(self, result, playlist_id):
+        """Обработчик окончания постраничной загрузки треков плейлиста"""
+        if not result["success"]:
+            self.show_error_dialog(f"Ошибка загрузки треков: {result.get('error')}")
+            return
+        
+        self.index_tracks(f"playlist_{playlist_id}", self.playlist_tracks)
+        self.load_more_playlist_tracks_btn.set_sensitive(False)
+        self.update_status(
+            f"Загружено {len(self.playlist_tracks)} треков из плейлиста (всего {result['total_count']})"
+        )
+
     def on_playlist_track_activated(self, treeview, path, column):
         """Обработчик активации трека в плейлисте"""
         model = treeview.get_model()
         treeiter = model.get_iter(path)
         if treeiter is not None:
-            track_data = model[treeiter][4]
+            track_data = track_at(model, treeiter)
+            self.player.set_playlist(self.playlist_tracks)
             self.player.current_index = path[0]
             self.play_track(track_data)
 
@@ -978,35 +1193,70 @@ class VKMusicApp:
             self.show_error_dialog("Введите поисковый запрос")
             return
         
-        def perform_search():
-            GLib.idle_add(self.update_status, f"Ищем: {query}")
-            result = self.manager.search_audio(query, offset=0, count=200)
-            GLib.idle_add(self.on_search_completed, result, query)
+        self.cancel_search_debounce()
+        self.start_remote_search(query)
+
+    def start_remote_search(self, query):
+        """Запустить поиск в VK; предыдущий незавершенный поиск отменяется"""
+        def perform_search(token):
+            self.ui_bus.post(self.update_status, f"Ищем: {query}")
+            return self.manager.search_audio(query, offset=0, count=200)
+        
+        self.tasks.submit(POOL_API, perform_search, lambda result: self.on_search_completed(result, query),
+                          key="search", replace=True)
+
+    def cancel_search_debounce(self):
+        """Отменить отложенный поиск"""
+        if self.search_debounce_id:
+            GLib.source_remove(self.search_debounce_id)
+            self.search_debounce_id = None
+
+    def on_search_debounced(self):
+        """Пользователь перестал печатать - ищем в VK"""
+        self.search_debounce_id = None
+        query = self.search_entry.get_text().strip()
+        if query:
+            self.start_remote_search(query)
+        return False
+
+    def index_tracks(self, source, tracks):
+        """Обновить локальный поисковый индекс в фоне"""
+        self.tasks.submit(POOL_DISK, lambda token: self.search_index.set_tracks(source, tracks))
+
+    def on_search_changed(self, entry):
+        """Мгновенный поиск по своей библиотеке при вводе запроса"""
+        query = entry.get_text().strip()
+        # Ответы на предыдущий текст запроса больше не нужны
+        self.tasks.cancel("search")
+        self.search_progress.set_visible(False)
+        self.cancel_search_debounce()
+        if len(query) < 2:
+            self.local_search_hits = []
+            return
+        
+        if self.manager.token:
+            self.search_debounce_id = GLib.timeout_add(SEARCH_DEBOUNCE_MS, self.on_search_debounced)
         
-        threading.Thread(target=perform_search, daemon=True).start()
+        self.local_search_hits = self.search_index.search(query)
+        self.search_tracks = list(self.local_search_hits)
+        populate_tracks_liststore(self.search_results_liststore, self.search_tracks)
+        self.load_more_search_btn.set_sensitive(False)
+        self.update_status(f"В вашей библиотеке: {len(self.local_search_hits)} совпадений")
 
     def on_search_completed(self, result, query):
         """Обработчик завершения поиска"""
         self.search_progress.set_visible(False)
         
         if result["success"]:
-            self.search_results_liststore.clear()
-            search_tracks = result["results"]
+            search_tracks = self.track_table.add_all(result["results"])
             
-            # Создаем плейлист для плеера
-            playlist = []
-            for track in search_tracks:
-                artist = track.get('artist', 'Unknown')
-                title = track.get('title', 'Unknown')
-                duration = track.get('duration', 0)
-                minutes = duration // 60
-                seconds = duration % 60
-                duration_str = f"{minutes}:{seconds:02d}"
-                
-                self.search_results_liststore.append([artist, title, duration_str, track.get('url', ''), track])
-                playlist.append(track)
+            # Сначала совпадения из библиотеки, затем новые результаты VK
+            local_hits = self.local_search_hits if query == self.search_entry.get_text().strip() else []
+            local_keys = {track.key for track in local_hits}
+            merged_tracks = local_hits + [track for track in search_tracks if track.key not in local_keys]
             
-            self.player.set_playlist(playlist)
+            self.search_tracks = merged_tracks
+            populate_tracks_liststore(self.search_results_liststore, merged_tracks)
             
             total_count = result.get("total_count", len(search_tracks))
             loaded_count = len(search_tracks)
@@ -1027,7 +1277,9 @@ class VKMusicApp:
         model = treeview.get_model()
         treeiter = model.get_iter(path)
         if treeiter is not None:
-            track_data = model[treeiter][4]
+            track_data = track_at(model, treeiter)
+            # Очередь плеера заменяем только при запуске трека из поиска, а не при каждом вводе
+            self.player.set_playlist(list(self.search_tracks))
             self.player.current_index = path[0]
             self.play_track(track_data)
 
@@ -1042,7 +1294,7 @@ class VKMusicApp:
 
     def on_refresh_downloads(self, widget):
         """Обновить список загрузок"""
-        self.update_downloads_list()
+        self.update_downloads_list(force=True)
 
     def on_play_downloaded_file(self, treeview, path, column):
         """Воспроизвести загруженный файл"""
@@ -1058,45 +1310,119 @@ class VKMusicApp:
             except Exception as e:
                 self.show_error_dialog(f"Не удалось воспроизвести файл: {e}")
 
-    def update_downloads_list(self):
-        """Обновить список загруженных файлов"""
-        self.downloads_liststore.clear()
-        
-        if not os.path.exists(self.manager.download_folder):
+    def load_downloads_list(self):
+        """Показать файлы из индекса загрузок, затем сверить индекс с папкой"""
+        self.tasks.submit(POOL_DISK, lambda token: self.downloads_index.entries(),
+                          self.on_downloads_loaded, key="downloads_load")
+
+    def on_downloads_loaded(self, entries):
+        """Обработчик чтения индекса загрузок"""
+        self.apply_downloads_changes(entries, [])
+        self.update_downloads_list()
+
+    def update_downloads_list(self, force=False):
+        """Найти в фоне файлы, добавленные или удаленные из папки загрузок"""
+        self.tasks.submit(POOL_DISK, lambda token: self.downloads_index.rescan(force),
+                          lambda changes: self.apply_downloads_changes(*changes), key="downloads_rescan")
+
+    def on_download_indexed(self, entry):
+        """Добавить только что скачанный файл в список"""
+        if entry:
+            self.apply_downloads_changes([entry], [])
+
+    def apply_downloads_changes(self, changed, removed):
+        """Обновить только изменившиеся строки списка загрузок"""
+        if not changed and not removed:
             return
         
-        total_size = 0
-        mp3_files = []
-        
-        for filename in os.listdir(self.manager.download_folder):
-            if filename.lower().endswith('.mp3'):
-                filepath = os.path.join(self.manager.download_folder, filename)
-                size = os.path.getsize(filepath)
-                total_size += size
-                
-                # Форматируем размер
-                if size < 1024 * 1024:
-                    size_str = f"{size/1024:.1f} KB"
-                else:
-                    size_str = f"{size/1024/1024:.1f} MB"
-                
-                mp3_files.append((filename, filepath, size_str))
-        
-        # Сортируем по имени файла
-        mp3_files.sort(key=lambda x: x[0])
+        # Большую пачку вставляем в отсоединенную модель, чтобы список не перерисовывался на каждой строке
+        detach = len(changed) + len(removed) > TRACKS_FILL_CHUNK
+        if detach:
+            self.downloads_treeview.set_model(None)
+        
+        for path in removed:
+            row = self.download_file_rows.pop(path, None)
+            if row:
+                treeiter, size = row
+                self.downloads_liststore.remove(treeiter)
+                self.downloads_total_size -= size
+        
+        for entry in changed:
+            row = self.download_file_rows.get(entry.path)
+            if row:
+                treeiter, size = row
+                self.downloads_liststore.set_value(treeiter, 2, format_size(entry.size))
+                self.downloads_total_size -= size
+            else:
+                treeiter = self.downloads_liststore.append([entry.name, entry.path, format_size(entry.size)])
+            self.download_file_rows[entry.path] = (treeiter, entry.size)
+            self.downloads_total_size += entry.size
         
-        for filename, filepath, size_str in mp3_files:
-            self.downloads_liststore.append([filename, filepath, size_str])
+        if detach:
+            self.downloads_treeview.set_model(self.downloads_liststore)
         
         # Обновляем информацию о папке
-        if total_size < 1024 * 1024:
-            total_size_str = f"{total_size/1024:.1f} KB"
+        self.downloads_info_label.set_text(
+            f"Файлов: {len(self.download_file_rows)}, Общий размер: {format_size(self.downloads_total_size)}"
+        )
+
+    def on_download_job_changed(self, job):
+        """Обновить строку задания в очереди загрузок"""
+        state_text = JOB_STATE_LABELS[job.state]
+        if job.state == JOB_FAILED and job.error:
+            state_text = f"{state_text}: {job.error}"
+        
+        treeiter = self.download_job_rows.get(job.id)
+        if treeiter is None:
+            self.download_job_rows[job.id] = self.download_jobs_liststore.append([job.title, state_text, job.id])
         else:
-            total_size_str = f"{total_size/1024/1024:.1f} MB"
+            self.download_jobs_liststore.set_value(treeiter, 1, state_text)
         
-        self.downloads_info_label.set_text(
-            f"Файлов: {len(mp3_files)}, Общий размер: {total_size_str}"
+        if job.state == JOB_DONE:
+            self.update_status(f"Скачан: {job.title}")
+            path = job.path
+            self.tasks.submit(POOL_DISK, lambda token: self.downloads_index.add(path), self.on_download_indexed)
+        elif job.state == JOB_FAILED:
+            self.update_status(f"Ошибка: {job.error}")
+        
+        if self.download_stats_timer is None:
+            self.download_stats_timer = GLib.timeout_add(1000, self.update_download_stats)
+
+    def update_download_stats(self):
+        """Сводка по очереди загрузок и текущая скорость"""
+        stats = self.download_manager.get_stats()
+        speed = stats["bytes_per_sec"]
+        speed_str = f"{speed/1024:.0f} KB/s" if speed < 1024 * 1024 else f"{speed/1024/1024:.1f} MB/s"
+        
+        self.download_stats_label.set_text(
+            f"В очереди: {stats['queued']}, скачивается: {stats['running']}, "
+            f"готово: {stats['done']}, ошибок: {stats['failed']}, скорость: {speed_str}"
         )
+        
+        finished = stats["done"] + stats["failed"]
+        if stats["total"]:
+            self.music_progress.set_fraction(finished / stats["total"])
+            self.music_progress.set_text(f"Скачано: {finished}/{stats['total']}")
+        
+        if self.download_manager.is_active():
+            return True
+        
+        self.music_progress.set_visible(False)
+        self.download_stats_timer = None
+        return False
+
+    def on_retry_failed_downloads(self, widget):
+        """Повторить упавшие загрузки"""
+        count = self.download_manager.retry_failed()
+        self.update_status(f"Повторно поставлено в очередь: {count}")
+
+    def on_clear_finished_downloads(self, widget):
+        """Убрать завершенные задания из списка"""
+        self.download_manager.clear_finished()
+        self.download_jobs_liststore.clear()
+        self.download_job_rows = {}
+        for job in self.download_manager.get_jobs():
+            self.on_download_job_changed(job)
 
     # Методы пагинации
     def on_load_more_music(self, widget):
@@ -1127,21 +1453,23 @@ class VKMusicApp:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def load_music():
+        def load_music(token):
             def progress_callback(offset, total):
+                if token.cancelled:
+                    return
                 progress = offset / total if total > 0 else 0
-                GLib.idle_add(self.music_progress.set_fraction, progress)
-                GLib.idle_add(self.music_progress.set_text, f"Загружено: {offset}/{total}")
-                GLib.idle_add(self.music_info_label.set_text, f"Загружено {offset} из {total} треков")
+                self.ui_bus.post(self.music_progress.set_fraction, progress)
+                self.ui_bus.post(self.music_progress.set_text, f"Загружено: {offset}/{total}")
+                self.ui_bus.post(self.music_info_label.set_text, f"Загружено {offset} из {total} треков")
             
-            GLib.idle_add(self.music_progress.set_visible, True)
-            GLib.idle_add(self.music_progress.set_fraction, 0)
-            GLib.idle_add(self.update_status, "Загружаем всю вашу музыку...")
+            self.ui_bus.post(self.music_progress.set_visible, True)
+            self.ui_bus.post(self.music_progress.set_fraction, 0)
+            self.ui_bus.post(self.update_status, "Загружаем всю вашу музыку...")
             
-            result = self.manager.get_all_my_audio(progress_callback)
-            GLib.idle_add(self.on_music_loaded, result)
+            return self.stream_pages(token, self.manager.iter_my_audio_pages(progress_callback),
+                                     self.on_music_page_loaded)
         
-        threading.Thread(target=load_music, daemon=True).start()
+        self.tasks.submit(POOL_API, load_music, self.on_all_music_loaded, key="my_music", replace=True)
 
     def load_all_playlists(self):
         """Загрузить все плейлисты с пагинацией"""
@@ -1149,20 +1477,21 @@ class VKMusicApp:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def load_playlists():
+        def load_playlists(token):
             def progress_callback(offset, total):
+                if token.cancelled:
+                    return
                 progress = offset / total if total > 0 else 0
-                GLib.idle_add(self.playlists_progress.set_fraction, progress)
-                GLib.idle_add(self.playlists_progress.set_text, f"Загружено: {offset}/{total}")
+                self.ui_bus.post(self.playlists_progress.set_fraction, progress)
+                self.ui_bus.post(self.playlists_progress.set_text, f"Загружено: {offset}/{total}")
             
-            GLib.idle_add(self.playlists_progress.set_visible, True)
-            GLib.idle_add(self.playlists_progress.set_fraction, 0)
-            GLib.idle_add(self.update_status, "Загружаем все плейлисты...")
+            self.ui_bus.post(self.playlists_progress.set_visible, True)
+            self.ui_bus.post(self.playlists_progress.set_fraction, 0)
+            self.ui_bus.post(self.update_status, "Загружаем все плейлисты...")
             
-            result = self.manager.get_all_playlists(progress_callback)
-            GLib.idle_add(self.on_playlists_loaded, result)
+            return self.manager.get_all_playlists(progress_callback)
         
-        threading.Thread(target=load_playlists, daemon=True).start()
+        self.tasks.submit(POOL_API, load_playlists, self.on_playlists_loaded, key="playlists", replace=True)
 
     def load_all_playlist_tracks(self, playlist_id):
         """Загрузить все треки из плейлиста с пагинацией"""
@@ -1170,13 +1499,31 @@ class VKMusicApp:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def load_playlist_tracks():
-            GLib.idle_add(self.update_status, "Загружаем все треки из плейлиста...")
-            
-            result = self.manager.get_all_playlist_tracks(playlist_id)
-            GLib.idle_add(self.on_playlist_tracks_loaded, result)
+        def load_playlist_tracks(token):
+            self.ui_bus.post(self.update_status, "Загружаем все треки из плейлиста...")
+            return self.stream_pages(token, self.manager.iter_playlist_tracks_pages(playlist_id),
+                                     self.on_playlist_tracks_page_loaded)
         
-        threading.Thread(target=load_playlist_tracks, daemon=True).start()
+        self.tasks.submit(POOL_API, load_playlist_tracks,
+                          lambda result: self.on_all_playlist_tracks_loaded(result, playlist_id),
+                          key="playlist_tracks", replace=True)
+
+    def stream_pages(self, token, pages, on_page):
+        """Передавать страницы в главный цикл по мере загрузки; итог возвращается без самих треков"""
+        total_count = 0
+        for page in pages:
+            if token.cancelled:
+                return None
+            if not page["success"]:
+                return page
+            total_count = page["total_count"]
+            self.ui_bus.dispatch(self._deliver_page, token, on_page, page)
+        return {"success": True, "total_count": total_count}
+
+    def _deliver_page(self, token, on_page, page):
+        # Страницы отмененной загрузки, уже стоящие в очереди главного цикла, не показываем
+        if not token.cancelled:
+            on_page(page)
 
     def load_all_search_results(self, query):
         """Загрузить все результаты поиска с пагинацией"""
@@ -1184,20 +1531,24 @@ class VKMusicApp:
             self.show_error_dialog("Сначала загрузите токен!")
             return
         
-        def perform_search():
+        self.cancel_search_debounce()
+        
+        def perform_search(token):
             def progress_callback(offset, total):
+                if token.cancelled:
+                    return
                 progress = offset / total if total > 0 else 0
-                GLib.idle_add(self.search_progress.set_fraction, progress)
-                GLib.idle_add(self.search_progress.set_text, f"Загружено: {offset}/{total}")
+                self.ui_bus.post(self.search_progress.set_fraction, progress)
+                self.ui_bus.post(self.search_progress.set_text, f"Загружено: {offset}/{total}")
             
-            GLib.idle_add(self.search_progress.set_visible, True)
-            GLib.idle_add(self.search_progress.set_fraction, 0)
-            GLib.idle_add(self.update_status, f"Ищем все результаты по запросу: {query}")
+            self.ui_bus.post(self.search_progress.set_visible, True)
+            self.ui_bus.post(self.search_progress.set_fraction, 0)
+            self.ui_bus.post(self.update_status, f"Ищем все результаты по запросу: {query}")
             
-            result = self.manager.search_all_audio(query, progress_callback=progress_callback)
-            GLib.idle_add(self.on_search_completed, result, query)
+            return self.manager.search_all_audio(query, progress_callback=progress_callback)
         
-        threading.Thread(target=perform_search, daemon=True).start()
+        self.tasks.submit(POOL_API, perform_search, lambda result: self.on_search_completed(result, query),
+                          key="search", replace=True)
 
     # Вспомогательные методы
     def update_status(self, message):
@@ -1231,17 +1582,30 @@ class VKMusicApp:
 
     def on_destroy(self, widget):
         """Обработчик закрытия приложения"""
-        self.player.stop()
+        self.tasks.shutdown()
+        self.player.shutdown()
+        self.manager.http.log_stats()
+        self.manager.api_cache.log_stats()
+        self.manager.api_cache.close()
+        self.downloads_index.close()
+        if self.library_cache:
+            self.library_cache.close()
         Gtk.main_quit()
 
     def on_load_token_from_file(self, widget):
         """Обработчик загрузки токена из файла"""
         success, message = self.manager.load_token_from_file()
-        if success:
+        if not success:
+            self.show_error_dialog(message)
+            return
+        
+        # Токен проверяем в VK, а не по кэшу: отозванный токен не должен выглядеть рабочим
+        validity = self.manager.check_token_validity(use_cache=False)
+        if validity["valid"]:
             self.update_user_info()
             self.show_info_dialog("Токен успешно загружен!")
         else:
-            self.show_error_dialog(message)
+            self.show_error_dialog(f"Токен невалиден: {validity.get('error_msg')}")
 
     def on_save_token(self, widget):
         """Обработчик сохранения токена"""
@@ -1251,7 +1615,7 @@ class VKMusicApp:
             return
         
         self.manager.set_token(token)
-        validity = self.manager.check_token_validity()
+        validity = self.manager.check_token_validity(use_cache=False)
         
         if validity["valid"]:
             success, message = self.manager.save_token_to_file()
@@ -1288,17 +1652,73 @@ class VKMusicApp:
             user = self.manager.user_info
             name = f"{user.get('first_name', '')} {user.get('last_name', '')}"
             self.user_info_label.set_markup(f"<b>👤 Пользователь:</b> {name}")
+            self.open_library_cache(self.manager.user_id)
         else:
-            validity = self.manager.check_token_validity()
+            validity = self.manager.check_token_validity(use_cache=False)
             if validity["valid"]:
                 user = validity["user_info"]
                 name = f"{user.get('first_name', '')} {user.get('last_name', '')}"
                 self.user_info_label.set_markup(f"<b>👤 Пользователь:</b> {name}")
+                self.open_library_cache(self.manager.user_id)
             else:
                 self.user_info_label.set_markup("<i>Токен не загружен</i>")
 
+    def open_library_cache(self, user_id):
+        """Открыть локальный кэш библиотеки пользователя"""
+        if not user_id:
+            return
+        if self.library_cache and self.library_cache.user_id == user_id:
+            if self.manager.user_info:
+                self.library_cache.set_meta('user_info', self.manager.user_info)
+            return
+        
+        if self.library_cache:
+            self.library_cache.close()
+        try:
+            self.library_cache = LibraryCache(user_id)
+            self.library_sync = LibrarySync(self.manager, self.library_cache)
+            self.search_index.clear()
+            save_last_user_id(user_id)
+            if self.manager.user_info:
+                self.library_cache.set_meta('user_info', self.manager.user_info)
+        except Exception as e:
+            logger.error(f"Не удалось открыть кэш библиотеки: {e}")
+            self.library_cache = None
+            self.library_sync = None
+
+    def restore_session(self):
+        """Загрузить сохраненный токен и сразу показать библиотеку из кэша"""
+        success, message = self.manager.load_token_from_file()
+        if not success:
+            return
+        
+        user_id = self.manager.user_id or load_last_user_id()
+        if user_id:
+            self.open_library_cache(user_id)
+        if self.library_cache:
+            user = self.library_cache.get_meta('user_info')
+            if user:
+                name = f"{user.get('first_name', '')} {user.get('last_name', '')}"
+                self.user_info_label.set_markup(f"<b>👤 Пользователь:</b> {name}")
+            self.show_cached_music()
+        
+        self.tasks.submit(POOL_API, lambda token: self.manager.check_token_validity(use_cache=False),
+                          self.on_session_validated, key="validate_token")
+
+    def on_session_validated(self, validity):
+        """Обработчик проверки сохраненного токена"""
+        if not validity["valid"]:
+            self.user_info_label.set_markup("<i>Токен не загружен</i>")
+            self.update_status(f"Сохраненный токен невалиден: {validity.get('error_msg')}")
+            return
+        
+        self.update_user_info()
+        if self.library_sync:
+            self.sync_library()
+
     def run(self):
         """Запустить приложение"""
         self.window.show_all()
         self.update_status("Готов к работе")
+        self.restore_session()
         Gtk.main()
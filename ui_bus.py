@@ -0,0 +1,62 @@
+"""
+Шина обновлений интерфейса из фоновых потоков
+"""
+
+import threading
+from collections import OrderedDict
+from config import GTK_AVAILABLE, UI_BUS_FPS, logger
+if GTK_AVAILABLE:
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import GLib
+
+class UIUpdateBus:
+    """Собирает обновления виджетов и применяет их одним вызовом не чаще fps раз в секунду.
+
+    Для каждого ключа (по умолчанию - сам метод виджета) хранится только последнее значение,
+    поэтому поток прогресса из сотен событий превращается в одно обновление за кадр.
+    """
+    def __init__(self, fps=UI_BUS_FPS):
+        self.interval_ms = max(1, int(1000 / fps))
+        self._pending = OrderedDict()  # ключ -> (функция, аргументы)
+        self._timer_scheduled = False
+        self._lock = threading.Lock()
+
+    def post(self, func, *args, key=None):
+        """Запланировать обновление; более раннее с тем же ключом отбрасывается"""
+        if key is None:
+            key = func
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending[key] = (func, args)
+            if self._timer_scheduled:
+                return
+            self._timer_scheduled = True
+        GLib.timeout_add(self.interval_ms, self._on_timer)
+
+    def dispatch(self, func, *args):
+        """Вызвать func в главном цикле после уже накопленных обновлений (без слияния)"""
+        GLib.idle_add(self._call_after_flush, func, args)
+
+    def flush(self):
+        """Применить накопленные обновления (в главном цикле)"""
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for func, args in pending:
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Ошибка обновления интерфейса: {e}")
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer_scheduled = False
+        self.flush()
+        return False
+
+    def _call_after_flush(self, func, args):
+        # Завершение задачи не должно быть перезаписано ее же запоздалым прогрессом
+        self.flush()
+        func(*args)
+        return False
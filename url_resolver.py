@@ -0,0 +1,118 @@
+"""
+Свежие ссылки на аудио: учет возраста и пакетное обновление через audio.getById
+"""
+
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+from config import logger, URL_TTL, URL_EXPIRY_MARGIN, URL_RESOLVE_BATCH
+from library_cache import track_key
+
+def url_expiry(url):
+    """Время истечения из параметра ссылки (expires/expire), если он есть"""
+    query = parse_qs(urlparse(url).query)
+    for name in ('expires', 'expire'):
+        value = query.get(name, [''])[0]
+        if value.isdigit():
+            return int(value)
+    return None
+
+def audio_items(response):
+    """Аудиозаписи в ответе API: списки items, audio.getById и ответы execute"""
+    if isinstance(response, dict):
+        if 'url' in response and 'owner_id' in response:
+            yield response
+        elif isinstance(response.get('items'), list):
+            for item in response['items']:
+                if isinstance(item, dict) and 'owner_id' in item:
+                    yield item
+    elif isinstance(response, list):
+        for item in response:
+            yield from audio_items(item)
+
+class UrlResolver:
+    """Помнит, когда получена каждая ссылка, и заранее обновляет устаревшие пачками.
+
+    Ссылки, которые этот процесс не видел в ответах VK (например, из кэша библиотеки),
+    считаются устаревшими: их возраст неизвестен.
+    """
+    def __init__(self, manager, ttl=URL_TTL, margin=URL_EXPIRY_MARGIN, batch_size=URL_RESOLVE_BATCH):
+        self.manager = manager
+        self.ttl = ttl
+        self.margin = margin
+        self.batch_size = batch_size
+        self._urls = {}  # ключ трека -> (ссылка, когда истекает)
+        self._lock = threading.Lock()
+        self._resolve_lock = threading.Lock()  # одновременно идет одно обновление
+        self.resolved = 0
+        self.requests = 0
+
+    def observe(self, response):
+        """Запомнить ссылки из только что полученного ответа VK"""
+        now = time.time()
+        with self._lock:
+            for item in audio_items(response):
+                url = item.get('url')
+                if url:
+                    self._urls[track_key(item)] = (url, url_expiry(url) or now + self.ttl)
+
+    def clear(self):
+        """Забыть все ссылки (они привязаны к токену)"""
+        with self._lock:
+            self._urls.clear()
+
+    def fresh_url(self, track):
+        """Действующая ссылка трека без запроса к VK или None; найденная ссылка записывается в трек"""
+        key = track_key(track)
+        with self._lock:
+            entry = self._urls.get(key)
+        if entry is None:
+            return None
+        url, expires = entry
+        if expires - self.margin < time.time():
+            return None
+        if track.get('url') != url:
+            track['url'] = url
+        return url
+
+    def resolve(self, tracks, force=False):
+        """Обновить ссылки устаревших треков запросами по batch_size штук, вернуть число обновленных"""
+        with self._resolve_lock:
+            # Пока ждали блокировку, эти треки мог обновить другой поток
+            stale = {}
+            for track in tracks:
+                if force or self.fresh_url(track) is None:
+                    stale.setdefault(track_key(track), track)
+            if not stale:
+                return 0
+
+            resolved = 0
+            keys = list(stale)
+            for start in range(0, len(keys), self.batch_size):
+                batch = [stale[key] for key in keys[start:start + self.batch_size]]
+                ids = [self._audio_id(track) for track in batch]
+                self.requests += 1
+                result = self.manager.get_audio_by_ids(ids)
+                if not result["success"]:
+                    logger.warning(f"Не удалось обновить ссылки на треки: {result.get('error')}")
+                    continue
+                # Ответ уже учтен в observe, осталось переписать ссылки в сами треки
+                for track in batch:
+                    if self.fresh_url(track):
+                        resolved += 1
+            self.resolved += resolved
+            return resolved
+
+    def ensure(self, track, ahead=()):
+        """Действующая ссылка трека; следующие треки из ahead обновляются тем же запросом"""
+        url = self.fresh_url(track)
+        if url:
+            return url
+        self.resolve([track] + list(ahead)[:self.batch_size - 1])
+        return self.fresh_url(track)
+
+    def _audio_id(self, track):
+        """Идентификатор для audio.getById: owner_id_id или owner_id_id_access_key"""
+        key = track_key(track)
+        access_key = track.get('access_key')
+        return f"{key}_{access_key}" if access_key else key
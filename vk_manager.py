@@ -3,8 +3,36 @@
 """
 
 import os
-import requests
-from config import logger, DOWNLOAD_FOLDER, VK_API_VERSION, KATE_USER_AGENT
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import (logger, DOWNLOAD_FOLDER, VK_API_VERSION, KATE_USER_AGENT, VK_API_URL,
+                    VK_API_RATE_LIMIT, VK_API_MIN_RATE, VK_API_RATE_STEP, VK_API_RETRIES, VK_API_RETRY_DELAY,
+                    VK_API_CONCURRENCY, VK_PAGE_SIZE, VK_EXECUTE_BATCH_SIZE,
+                    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+from http_session import get_transport
+from rate_limiter import RateLimiter
+from blob_cache import get_blob_cache
+from library_cache import track_key
+from ttl_cache import TTLCache
+from api_cache import ApiCache
+from downloads_index import DownloadsIndex, track_filenames
+from url_resolver import UrlResolver
+from hls import HlsStream, HlsError, is_hls_url
+
+# Коды ошибок, после которых execute для этого токена больше не пробуем
+EXECUTE_UNSUPPORTED_ERRORS = {3, 12, 13, 15}
+# Временные ошибки, после которых вызов повторяем: слишком много запросов, flood control, внутренняя ошибка
+RETRY_ERRORS = {6, 9, 10}
+# Ошибки, означающие, что мы превысили допустимую частоту
+THROTTLE_ERRORS = {6, 9}
+
+def _content_range_total(content_range):
+    """Полный размер файла из заголовка Content-Range (bytes 0-99/1000)"""
+    if not content_range or '/' not in content_range:
+        return None
+    total = content_range.rsplit('/', 1)[1].strip()
+    return int(total) if total.isdigit() else None
 
 class VKMusicManager:
     def __init__(self):
@@ -18,8 +46,18 @@ class VKMusicManager:
             'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
             'Connection': 'keep-alive'
         }
+        self.http = get_transport()
+        self.rate_limiter = RateLimiter(VK_API_RATE_LIMIT, min_rate=VK_API_MIN_RATE, step=VK_API_RATE_STEP)
+        self.api_concurrency = VK_API_CONCURRENCY
+        self.execute_batch_size = VK_EXECUTE_BATCH_SIZE
+        self.execute_available = True
+        self.blob_cache = get_blob_cache()
+        self.search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+        self.api_cache = ApiCache()
+        self.url_resolver = UrlResolver(self)
         self.download_folder = DOWNLOAD_FOLDER
         self.create_download_folder()
+        self.downloads_index = DownloadsIndex(self.download_folder)
 
     def create_download_folder(self):
         """Создать папку для загрузок если её нет"""
@@ -29,6 +67,9 @@ class VKMusicManager:
     def set_token(self, token):
         """Установить токен"""
         self.token = token
+        # Ссылки в результатах поиска привязаны к токену
+        self.search_cache.clear()
+        self.url_resolver.clear()
         if token and '.' in token:
             parts = token.split('.')
             if len(parts) > 0:
@@ -61,21 +102,232 @@ class VKMusicManager:
         except Exception as e:
             return False, f"Ошибка при сохранении токена: {e}"
 
-    def check_token_validity(self):
-        """Проверить валидность токена"""
+    def _call_api(self, method, params):
+        """Вызвать метод VK API с учетом ограничения частоты запросов и повтором временных ошибок"""
+        request_params = dict(params)
+        request_params["access_token"] = self.token
+        request_params["v"] = VK_API_VERSION
+        
+        for attempt in range(VK_API_RETRIES + 1):
+            self.rate_limiter.acquire()
+            response = self.http.get(VK_API_URL + method, params=request_params, headers=self.headers)
+            data = response.json()
+            
+            error_code = data.get("error", {}).get("error_code") if isinstance(data, dict) else None
+            if error_code not in RETRY_ERRORS:
+                self.rate_limiter.on_success()
+                if "response" in data:
+                    # Запоминаем, когда получены ссылки на аудио
+                    self.url_resolver.observe(data["response"])
+                return data
+            
+            if error_code in THROTTLE_ERRORS:
+                self.rate_limiter.on_throttled()
+            if attempt < VK_API_RETRIES:
+                delay = VK_API_RETRY_DELAY * 2 ** attempt
+                logger.warning(f"{method}: ошибка VK {error_code}, повтор через {delay:.1f} с "
+                               f"(частота {self.rate_limiter.rate:.1f} запросов в секунду)")
+                time.sleep(delay)
+        return data
+
+    def _call_api_cached(self, method, params, policy_method=None):
+        """Вызвать метод VK API через кэш ответов (ответы привязаны к пользователю, а не к токену)"""
+        return self.api_cache.fetch(method, params, self.user_id,
+                                    lambda: self._call_api(method, params), policy_method)
+
+    def _iter_pages_parallel(self, fetch_page, items_key, total_count, progress_callback=None,
+                             page_size=VK_PAGE_SIZE, start=0):
+        """Загружать страницы параллельно и отдавать их по порядку, как только готово начало списка.
+
+        В памяти держатся только страницы, пришедшие раньше предыдущих (не больше api_concurrency).
+        Ошибка отдается последней страницей с success=False.
+        """
+        offsets = list(range(start, total_count, page_size))
+        pages = {}
+        next_yield = 0  # индекс в offsets следующей страницы для выдачи
+        # Все страницы начиная с этого смещения не нужны (получена неполная страница)
+        stop_offset = total_count
+        
+        if progress_callback:
+            progress_callback(min(start, total_count), total_count)
+        
+        with ThreadPoolExecutor(max_workers=self.api_concurrency) as executor:
+            pending = {}
+            next_index = 0
+            
+            while True:
+                while (next_index < len(offsets) and len(pending) < self.api_concurrency
+                       and offsets[next_index] < stop_offset):
+                    offset = offsets[next_index]
+                    pending[executor.submit(fetch_page, offset, page_size)] = offset
+                    next_index += 1
+                
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    offset = pending.pop(future)
+                    result = future.result()
+                    if not result["success"]:
+                        for other in pending:
+                            other.cancel()
+                        yield dict(result, offset=offset)
+                        return
+                    
+                    if offset >= stop_offset:
+                        continue
+                    
+                    items = result[items_key]
+                    pages[offset] = items
+                    
+                    # Если страница неполная, дальше данных нет
+                    if len(items) < page_size:
+                        stop_offset = offset + page_size
+                
+                while next_yield < len(offsets) and offsets[next_yield] in pages and offsets[next_yield] < stop_offset:
+                    offset = offsets[next_yield]
+                    items = pages.pop(offset)
+                    next_yield += 1
+                    if progress_callback:
+                        progress_callback(min(offset + len(items), total_count), total_count)
+                    yield {"success": True, items_key: items, "total_count": total_count, "offset": offset}
+
+    def _collect_pages(self, pages, items_key):
+        """Собрать все страницы генератора в один результат"""
+        all_items = []
+        total_count = 0
+        for page in pages:
+            if not page["success"]:
+                return page
+            all_items.extend(page[items_key])
+            total_count = page["total_count"]
+        
+        return {
+            "success": True,
+            items_key: all_items,
+            "total_count": total_count
+        }
+
+    def _execute(self, calls):
+        """Выполнить несколько вызовов API одним запросом execute"""
+        code = "return [" + ",".join(
+            f"API.{method}({json.dumps(params, ensure_ascii=False)})" for method, params in calls
+        ) + "];"
+        # Пачку страниц одного метода кэшируем по правилам этого метода
+        methods = {method for method, _ in calls}
+        policy_method = methods.pop() if len(methods) == 1 else None
+        return self._call_api_cached("execute", {"code": code}, policy_method)
+
+    def _execute_pages(self, calls, items_key):
+        """Загрузить пачку страниц через execute и склеить их элементы"""
+        try:
+            data = self._execute(calls)
+            
+            if "response" not in data:
+                error = data.get("error", {})
+                return {
+                    "success": False,
+                    "error": error.get("error_msg", "Неизвестная ошибка"),
+                    "execute_refused": True,
+                    "error_code": error.get("error_code")
+                }
+            
+            items = []
+            for (method, params), page in zip(calls, data["response"]):
+                # Неудачный вызов внутри execute возвращает false, повторяем его отдельно
+                if not page:
+                    single = self._call_api(method, params)
+                    if "response" not in single:
+                        error_msg = single.get("error", {}).get("error_msg", "Неизвестная ошибка")
+                        return {"success": False, "error": error_msg}
+                    page = single["response"]
+                
+                page_items = page["items"]
+                items.extend(page_items)
+                if len(page_items) < params["count"]:
+                    break
+            
+            return {"success": True, items_key: items}
+            
+        except Exception as e:
+            return {"success": False, "error": f"Ошибка запроса: {e}"}
+
+    def _iter_pages_batched(self, method, params, items_key, total_count, progress_callback=None,
+                            page_size=VK_PAGE_SIZE, start=0):
+        """Загружать страницы пачками по execute_batch_size вызовов"""
+        batch_span = page_size * self.execute_batch_size
+        
+        def fetch_batch(offset, count):
+            calls = []
+            for page_offset in range(offset, min(offset + count, total_count), page_size):
+                page_params = dict(params)
+                page_params.update({"offset": page_offset, "count": page_size})
+                calls.append((method, page_params))
+            return self._execute_pages(calls, items_key)
+        
+        return self._iter_pages_parallel(fetch_batch, items_key, total_count, progress_callback,
+                                         page_size=batch_span, start=start)
+
+    def _iter_all_pages(self, method, params, fetch_page, items_key, total_count, progress_callback=None, start=0):
+        """Загружать страницы пачками через execute, а если он недоступен - по одной"""
+        if self.execute_available:
+            for page in self._iter_pages_batched(method, params, items_key, total_count, progress_callback,
+                                                 start=start):
+                if not page.get("execute_refused"):
+                    yield page
+                    if not page["success"]:
+                        return
+                    # Страницы отдаются по порядку - следующая начинается сразу за этой
+                    start = page["offset"] + len(page[items_key])
+                    continue
+                
+                logger.warning(f"execute недоступен ({page.get('error')}), загружаем страницы по одной")
+                if page.get("error_code") in EXECUTE_UNSUPPORTED_ERRORS:
+                    self.execute_available = False
+                # Продолжаем с первой еще не отданной страницы: пачки перед отказавшей могли
+                # не успеть загрузиться или ждали своей очереди и были отброшены
+                break
+            else:
+                return
+        
+        yield from self._iter_pages_parallel(fetch_page, items_key, total_count, progress_callback, start=start)
+
+    def _iter_paged(self, method, params, fetch_page, items_key, progress_callback=None, max_count=None):
+        """Первая страница сразу, остальные - по мере загрузки; страницы идут по порядку"""
+        first = fetch_page(0, VK_PAGE_SIZE)
+        if not first["success"]:
+            yield first
+            return
+        
+        total_count = first["total_count"]
+        if max_count is not None:
+            total_count = min(total_count, max_count)
+        first_items = first[items_key][:total_count]
+        
+        if progress_callback:
+            progress_callback(len(first_items), total_count)
+        yield {"success": True, items_key: first_items, "total_count": total_count, "offset": 0}
+        
+        if len(first[items_key]) < VK_PAGE_SIZE or total_count <= VK_PAGE_SIZE:
+            return
+        yield from self._iter_all_pages(method, params, fetch_page, items_key, total_count, progress_callback,
+                                        start=VK_PAGE_SIZE)
+
+    def check_token_validity(self, use_cache=True):
+        """Проверить валидность токена (use_cache=False - обязательно спросить VK)"""
         if not self.token:
             return {"valid": False, "error_msg": "Токен не установлен"}
         
-        url = "https://api.vk.com/method/users.get"
         params = {
-            "access_token": self.token,
-            "v": VK_API_VERSION,
             "fields": "first_name,last_name"
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            data = response.json()
+            if use_cache:
+                data = self._call_api_cached("users.get", params)
+            else:
+                data = self._call_api("users.get", params)
             
             if "response" in data:
                 self.user_info = data["response"][0]
@@ -93,18 +345,14 @@ class VKMusicManager:
         if not self.token or not self.user_id:
             return {"success": False, "error": "Токен не установлен"}
         
-        url = "https://api.vk.com/method/audio.get"
         params = {
-            "access_token": self.token,
-            "v": VK_API_VERSION,
             "count": count,
             "offset": offset,
             "owner_id": self.user_id
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            data = response.json()
+            data = self._call_api("audio.get", params)
             
             if "response" in data:
                 return {
@@ -120,43 +368,21 @@ class VKMusicManager:
         except Exception as e:
             return {"success": False, "error": f"Ошибка запроса: {e}"}
 
+    def iter_my_audio_pages(self, progress_callback=None):
+        """Загружать аудиозаписи пользователя постранично (генератор результатов со страницами)"""
+        if not self.token or not self.user_id:
+            yield {"success": False, "error": "Токен не установлен"}
+            return
+        
+        yield from self._iter_paged(
+            "audio.get", {"owner_id": self.user_id},
+            lambda offset, count: self.get_my_audio_list(offset=offset, count=count),
+            "audio_list", progress_callback
+        )
+
     def get_all_my_audio(self, progress_callback=None):
         """Получить все аудиозаписи пользователя с пагинацией"""
-        if not self.token or not self.user_id:
-            return {"success": False, "error": "Токен не установлен"}
-        
-        all_audio = []
-        offset = 0
-        count = 200
-        
-        # Сначала получаем первую страницу чтобы узнать общее количество
-        first_result = self.get_my_audio_list(offset=0, count=1)
-        if not first_result["success"]:
-            return first_result
-        
-        total_count = first_result["total_count"]
-        
-        while offset < total_count:
-            if progress_callback:
-                progress_callback(offset, total_count)
-                
-            result = self.get_my_audio_list(offset=offset, count=count)
-            if not result["success"]:
-                return result
-            
-            audio_list = result["audio_list"]
-            all_audio.extend(audio_list)
-            offset += count
-            
-            # Если загрузили все треки, выходим
-            if len(audio_list) < count:
-                break
-        
-        return {
-            "success": True, 
-            "audio_list": all_audio,
-            "total_count": total_count
-        }
+        return self._collect_pages(self.iter_my_audio_pages(progress_callback), "audio_list")
 
     def get_recommendations(self, offset=0, count=100):
         """Получить рекомендации"""
@@ -164,18 +390,14 @@ class VKMusicManager:
             return {"success": False, "error": "Токен не установлен"}
         
         # Пробуем метод audio.getRecommendations
-        url = "https://api.vk.com/method/audio.getRecommendations"
         params = {
-            "access_token": self.token,
-            "v": VK_API_VERSION,
             "count": count,
             "offset": offset,
             "shuffle": 1
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            data = response.json()
+            data = self._call_api_cached("audio.getRecommendations", params)
             
             if "response" in data:
                 return {
@@ -202,10 +424,7 @@ class VKMusicManager:
         import random
         query = random.choice(popular_queries)
         
-        url = "https://api.vk.com/method/audio.search"
         params = {
-            "access_token": self.token,
-            "v": VK_API_VERSION,
             "q": query,
             "count": count,
             "offset": offset,
@@ -214,8 +433,7 @@ class VKMusicManager:
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            data = response.json()
+            data = self._call_api("audio.search", params)
             
             if "response" in data:
                 return {
@@ -236,18 +454,14 @@ class VKMusicManager:
         if not self.token or not self.user_id:
             return {"success": False, "error": "Токен не установлен"}
         
-        url = "https://api.vk.com/method/audio.getPlaylists"
         params = {
-            "access_token": self.token,
-            "v": VK_API_VERSION,
             "owner_id": self.user_id,
             "count": count,
             "offset": offset
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            data = response.json()
+            data = self._call_api_cached("audio.getPlaylists", params)
             
             if "response" in data:
                 return {
@@ -263,51 +477,28 @@ class VKMusicManager:
         except Exception as e:
             return {"success": False, "error": f"Ошибка запроса: {e}"}
 
+    def iter_playlists_pages(self, progress_callback=None):
+        """Загружать плейлисты постранично (генератор результатов со страницами)"""
+        if not self.token or not self.user_id:
+            yield {"success": False, "error": "Токен не установлен"}
+            return
+        
+        yield from self._iter_paged(
+            "audio.getPlaylists", {"owner_id": self.user_id},
+            lambda offset, count: self.get_playlists(offset=offset, count=count),
+            "playlists", progress_callback
+        )
+
     def get_all_playlists(self, progress_callback=None):
         """Получить все плейлисты с пагинацией"""
-        if not self.token or not self.user_id:
-            return {"success": False, "error": "Токен не установлен"}
-        
-        all_playlists = []
-        offset = 0
-        count = 200
-        
-        first_result = self.get_playlists(offset=0, count=1)
-        if not first_result["success"]:
-            return first_result
-        
-        total_count = first_result["total_count"]
-        
-        while offset < total_count:
-            if progress_callback:
-                progress_callback(offset, total_count)
-                
-            result = self.get_playlists(offset=offset, count=count)
-            if not result["success"]:
-                return result
-            
-            playlists = result["playlists"]
-            all_playlists.extend(playlists)
-            offset += count
-            
-            if len(playlists) < count:
-                break
-        
-        return {
-            "success": True, 
-            "playlists": all_playlists,
-            "total_count": total_count
-        }
+        return self._collect_pages(self.iter_playlists_pages(progress_callback), "playlists")
 
     def get_playlist_tracks(self, playlist_id, offset=0, count=200):
         """Получить треки из плейлиста с пагинацией"""
         if not self.token or not self.user_id:
             return {"success": False, "error": "Токен не установлен"}
         
-        url = "https://api.vk.com/method/audio.get"
         params = {
-            "access_token": self.token,
-            "v": VK_API_VERSION,
             "album_id": playlist_id,
             "owner_id": self.user_id,
             "count": count,
@@ -315,8 +506,7 @@ class VKMusicManager:
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            data = response.json()
+            data = self._call_api("audio.get", params)
             
             if "response" in data:
                 return {
@@ -332,51 +522,34 @@ class VKMusicManager:
         except Exception as e:
             return {"success": False, "error": f"Ошибка запроса: {e}"}
 
+    def iter_playlist_tracks_pages(self, playlist_id, progress_callback=None):
+        """Загружать треки плейлиста постранично (генератор результатов со страницами)"""
+        if not self.token or not self.user_id:
+            yield {"success": False, "error": "Токен не установлен"}
+            return
+        
+        yield from self._iter_paged(
+            "audio.get", {"album_id": playlist_id, "owner_id": self.user_id},
+            lambda offset, count: self.get_playlist_tracks(playlist_id, offset=offset, count=count),
+            "audio_list", progress_callback
+        )
+
     def get_all_playlist_tracks(self, playlist_id, progress_callback=None):
         """Получить все треки из плейлиста с пагинацией"""
-        if not self.token or not self.user_id:
-            return {"success": False, "error": "Токен не установлен"}
-        
-        all_audio = []
-        offset = 0
-        count = 200
-        
-        first_result = self.get_playlist_tracks(playlist_id, offset=0, count=1)
-        if not first_result["success"]:
-            return first_result
-        
-        total_count = first_result["total_count"]
-        
-        while offset < total_count:
-            if progress_callback:
-                progress_callback(offset, total_count)
-                
-            result = self.get_playlist_tracks(playlist_id, offset=offset, count=count)
-            if not result["success"]:
-                return result
-            
-            audio_list = result["audio_list"]
-            all_audio.extend(audio_list)
-            offset += count
-            
-            if len(audio_list) < count:
-                break
-        
-        return {
-            "success": True, 
-            "audio_list": all_audio,
-            "total_count": total_count
-        }
+        return self._collect_pages(self.iter_playlist_tracks_pages(playlist_id, progress_callback), "audio_list")
 
     def search_audio(self, query, offset=0, count=200):
         """Поиск музыки с пагинацией"""
         if not self.token:
             return {"success": False, "error": "Токен не установлен"}
         
-        url = "https://api.vk.com/method/audio.search"
+        # Повторный запрос той же страницы (листание, повторный ввод) не идет в сеть
+        cache_key = (query, offset, count)
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         params = {
-            "access_token": self.token,
-            "v": VK_API_VERSION,
             "q": query,
             "count": count,
             "offset": offset,
@@ -384,16 +557,17 @@ class VKMusicManager:
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers)
-            data = response.json()
+            data = self._call_api("audio.search", params)
             
             if "response" in data:
-                return {
+                result = {
                     "success": True, 
                     "results": data["response"]["items"],
                     "total_count": data["response"]["count"],
                     "offset": offset
                 }
+                self.search_cache.set(cache_key, result)
+                return result
             else:
                 error_msg = data.get("error", {}).get("error_msg", "Неизвестная ошибка")
                 return {"success": False, "error": error_msg}
@@ -401,84 +575,207 @@ class VKMusicManager:
         except Exception as e:
             return {"success": False, "error": f"Ошибка запроса: {e}"}
 
+    def iter_search_pages(self, query, max_results=1000, progress_callback=None):
+        """Искать музыку постранично (генератор результатов со страницами)"""
+        if not self.token:
+            yield {"success": False, "error": "Токен не установлен"}
+            return
+        
+        yield from self._iter_paged(
+            "audio.search", {"q": query, "auto_complete": 1},
+            lambda offset, count: self.search_audio(query, offset=offset, count=count),
+            "results", progress_callback, max_count=max_results
+        )
+
     def search_all_audio(self, query, max_results=1000, progress_callback=None):
         """Поиск музыки с пагинацией (все результаты)"""
+        return self._collect_pages(self.iter_search_pages(query, max_results, progress_callback), "results")
+
+    def get_audio_by_ids(self, keys):
+        """Получить треки по списку ключей owner_id_id"""
         if not self.token:
             return {"success": False, "error": "Токен не установлен"}
         
-        all_results = []
-        offset = 0
-        count = 200
-        
-        first_result = self.search_audio(query, offset=0, count=1)
-        if not first_result["success"]:
-            return first_result
-        
-        total_count = min(first_result["total_count"], max_results)
+        params = {
+            "audios": ",".join(keys)
+        }
         
-        while offset < total_count:
-            if progress_callback:
-                progress_callback(offset, total_count)
-                
-            result = self.search_audio(query, offset=offset, count=count)
-            if not result["success"]:
-                return result
-            
-            results_page = result["results"]
-            all_results.extend(results_page)
-            offset += count
+        try:
+            data = self._call_api("audio.getById", params)
             
-            if len(results_page) < count:
-                break
-        
-        return {
-            "success": True, 
-            "results": all_results,
-            "total_count": total_count
-        }
+            if "response" in data:
+                return {"success": True, "audio_list": data["response"]}
+            else:
+                error_msg = data.get("error", {}).get("error_msg", "Неизвестная ошибка")
+                return {"success": False, "error": error_msg}
+                
+        except Exception as e:
+            return {"success": False, "error": f"Ошибка запроса: {e}"}
+
+    def refresh_track_url(self, track):
+        """Получить свежую ссылку на трек и обновить ее в данных трека"""
+        self.url_resolver.resolve([track], force=True)
+        return self.url_resolver.fresh_url(track)
 
-    def download_track(self, track, folder=None):
-        """Скачать трек"""
+    def needs_network(self, track, downloads=True):
+        """Придется ли качать трек из сети: его нет в аудиокэше (и в папке загрузок, если downloads)"""
+        key = track_key(track)
+        if self.blob_cache.contains(key):
+            return False
+        return not (downloads and self.downloads_index.find_track(key))
+
+    def download_track(self, track, folder=None, progress_callback=None):
+        """Скачать трек (progress_callback получает размер каждого записанного блока)"""
         if not folder:
             folder = self.download_folder
         
-        artist = track.get('artist', 'Unknown Artist')
-        title = track.get('title', 'Unknown Title')
-        
-        safe_artist = "".join(c for c in artist if c.isalnum() or c in (' ', '-', '_')).strip()
-        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-        
-        filename = f"{safe_artist} - {safe_title}.mp3"
-        filepath = os.path.join(folder, filename)
-        
-        counter = 1
-        original_filepath = filepath
-        while os.path.exists(filepath):
-            name, ext = os.path.splitext(original_filepath)
-            filepath = f"{name} ({counter}){ext}"
-            counter += 1
+        # Этот трек уже скачан - повторно не качаем
+        cache_key = track_key(track)
+        existing = self.downloads_index.find_track(cache_key)
+        if existing:
+            return True, existing
+        
+        # Имя занято другим треком (в том числе качающимся прямо сейчас) - различаем по идентификатору VK
+        filename, keyed_filename = track_filenames(track)
+        filepath, downloaded = self.downloads_index.reserve_path(
+            cache_key, os.path.join(folder, filename), os.path.join(folder, keyed_filename)
+        )
+        if downloaded:
+            return True, filepath
+        try:
+            return self._download_to(track, cache_key, filepath, progress_callback)
+        finally:
+            self.downloads_index.release_path(filepath)
+
+    def _download_to(self, track, cache_key, filepath, progress_callback=None):
+        """Скачать трек в файл, имя которого уже занято за ним"""
+        # Трек уже есть в аудиокэше (слушали или предзагрузили) - сохраняем без сети
+        try:
+            if self.blob_cache.export(cache_key, filepath):
+                self.downloads_index.register_track(cache_key, filepath)
+                return True, filepath
+        except OSError as e:
+            logger.warning(f"Не удалось взять трек из аудиокэша: {e}")
         
-        track_url = track.get('url')
+        # Устаревшую или пустую ссылку обновляем до запроса к CDN
+        track_url = self.url_resolver.ensure(track) or track.get('url')
         if not track_url:
             return False, "Нет ссылки для скачивания"
         
+        # Недокачанные данные лежат рядом в .part и докачиваются с места обрыва
+        part_path = f"{filepath}.{cache_key}.part"
+        headers = self.headers.copy()
+        headers.update({
+            'Referer': 'https://vk.com/',
+            'Origin': 'https://vk.com',
+            'Accept-Encoding': 'identity'
+        })
+        
         try:
-            headers = self.headers.copy()
-            headers.update({
-                'Referer': 'https://vk.com/',
-                'Origin': 'https://vk.com'
-            })
-            
-            response = requests.get(track_url, stream=True, headers=headers)
-            if response.status_code == 200:
-                with open(filepath, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                
-                return True, filepath
-            else:
-                return False, f"Ошибка HTTP: {response.status_code}"
-                
+            if is_hls_url(track_url):
+                return self._download_hls(track, track_url, headers, filepath, part_path, progress_callback)
+            return self._download_file(track, track_url, headers, filepath, part_path, progress_callback)
         except Exception as e:
             return False, f"Ошибка скачивания: {e}"
+
+    def _download_file(self, track, track_url, headers, filepath, part_path, progress_callback=None,
+                       url_refreshed=False):
+        """Скачать трек одним файлом с докачкой .part по Range"""
+        cache_key = track_key(track)
+        while True:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            request_headers = dict(headers)
+            if offset:
+                request_headers['Range'] = f"bytes={offset}-"
+            
+            response = self.http.get(track_url, stream=True, headers=request_headers)
+            
+            # Ссылка VK устарела - запрашиваем свежую и пробуем еще раз
+            if response.status_code in (403, 404, 410) and not url_refreshed:
+                response.close()
+                url_refreshed = True
+                track_url = self.refresh_track_url(track)
+                if track_url and is_hls_url(track_url):
+                    # Вместо файла VK теперь отдает плейлист HLS
+                    return self._download_hls(track, track_url, headers, filepath, part_path,
+                                              progress_callback, url_refreshed=True)
+                if track_url:
+                    continue
+                return False, f"Ошибка HTTP: {response.status_code}"
+            break
+        
+        if response.status_code == 416:
+            # В прошлый раз файл скачался целиком, но не был переименован
+            response.close()
+            if _content_range_total(response.headers.get('Content-Range')) != offset:
+                os.unlink(part_path)
+                return False, "Не удалось продолжить загрузку, начнем заново"
+            expected = offset
+            mode = 'ab'
+        elif response.status_code == 206:
+            expected = _content_range_total(response.headers.get('Content-Range'))
+            mode = 'ab'
+        elif response.status_code == 200:
+            # Сервер не поддержал Range - качаем с начала
+            offset = 0
+            content_length = response.headers.get('Content-Length')
+            expected = int(content_length) if content_length else None
+            mode = 'wb'
+        else:
+            response.close()
+            return False, f"Ошибка HTTP: {response.status_code}"
+        
+        written = offset
+        if response.status_code != 416:
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if chunk:
+                        f.write(chunk)
+                        written += len(chunk)
+                        if progress_callback:
+                            progress_callback(len(chunk))
+        
+        if expected is not None and written != expected:
+            return False, f"Загрузка прервана: получено {written} из {expected} байт"
+        
+        os.replace(part_path, filepath)
+        self.downloads_index.register_track(cache_key, filepath)
+        
+        # Повторное прослушивание пойдет с диска
+        self.blob_cache.add_link(cache_key, filepath)
+        return True, filepath
+
+    def _download_hls(self, track, track_url, headers, filepath, part_path, progress_callback=None,
+                      url_refreshed=False):
+        """Скачать трек HLS: сегменты качаются параллельно и складываются в один MP3-файл"""
+        cache_key = track_key(track)
+        while True:
+            try:
+                with open(part_path, 'wb') as f:
+                    for chunk in HlsStream(self.http, track_url, headers).iter_chunks():
+                        f.write(chunk)
+                        if progress_callback:
+                            progress_callback(len(chunk))
+                break
+            except Exception as e:
+                # HLS не докачивается с места обрыва - недописанный .part не должен достаться докачке файла
+                if os.path.exists(part_path):
+                    os.unlink(part_path)
+                if not isinstance(e, HlsError):
+                    raise
+                # Ссылка на плейлист устарела - запрашиваем свежую и пробуем еще раз
+                if e.status_code in (403, 404, 410) and not url_refreshed:
+                    url_refreshed = True
+                    track_url = self.refresh_track_url(track)
+                    if track_url and not is_hls_url(track_url):
+                        # Вместо плейлиста VK теперь отдает обычный файл
+                        return self._download_file(track, track_url, headers, filepath, part_path,
+                                                   progress_callback, url_refreshed=True)
+                    if track_url:
+                        continue
+                return False, f"Ошибка HLS: {e}"
+        
+        os.replace(part_path, filepath)
+        self.downloads_index.register_track(cache_key, filepath)
+        self.blob_cache.add_link(cache_key, filepath)
+        return True, filepath
@@ -2,33 +2,131 @@
 Вспомогательные виджеты и компоненты UI
 """
 
-from config import GTK_AVAILABLE
+from collections import deque
+from config import GTK_AVAILABLE, TRACKS_FILL_CHUNK
+from track import get_track_table
 if GTK_AVAILABLE:
     import gi
     gi.require_version('Gtk', '3.0')
-    from gi.repository import Gtk, Pango
+    from gi.repository import Gtk, GLib, Pango
+
+# Незавершенные заполнения списков: id(liststore) -> источник GLib и очередь треков
+_pending_fills = {}
+# Треки каждого списка: пока трек показан, его строка в общей таблице не освобождается
+_shown_tracks = {}
+
+def format_duration(duration):
+    """Длительность в секундах -> м:сс"""
+    minutes = duration // 60
+    seconds = duration % 60
+    return f"{minutes}:{seconds:02d}"
+
+def format_size(size):
+    """Размер в байтах -> KB/MB"""
+    if size < 1024 * 1024:
+        return f"{size/1024:.1f} KB"
+    return f"{size/1024/1024:.1f} MB"
+
+def _set_track_cell(column, renderer, model, treeiter, field):
+    """Отрисовать поле трека из общей таблицы по индексу строки"""
+    track = get_track_table()[model.get_value(treeiter, 0)]
+    if field == 'duration':
+        renderer.set_property("text", format_duration(track.duration))
+    else:
+        renderer.set_property("text", getattr(track, field))
+
+def track_at(model, treeiter):
+    """Трек, на который ссылается строка списка"""
+    return get_track_table()[model.get_value(treeiter, 0)]
 
 def create_tracks_treeview():
     """Создать TreeView для списка треков"""
-    liststore = Gtk.ListStore(str, str, str, str, object)  # artist, title, duration, url, track_data
+    # Строка хранит только индекс трека в общей таблице, текст берется при отрисовке
+    liststore = Gtk.ListStore(int)
     treeview = Gtk.TreeView(model=liststore)
     
     # Настройка колонок
     renderer = Gtk.CellRendererText()
+    renderer.set_property("ellipsize", Pango.EllipsizeMode.END)
     
-    column = Gtk.TreeViewColumn("Исполнитель", renderer, text=0)
+    # Колонки фиксированной ширины: высоту строк не нужно перемерять при каждой вставке
+    column = Gtk.TreeViewColumn("Исполнитель", renderer)
+    column.set_cell_data_func(renderer, _set_track_cell, 'artist')
+    column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+    column.set_fixed_width(250)
     column.set_expand(True)
     treeview.append_column(column)
     
-    column = Gtk.TreeViewColumn("Название", renderer, text=1)
+    column = Gtk.TreeViewColumn("Название", renderer)
+    column.set_cell_data_func(renderer, _set_track_cell, 'title')
+    column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+    column.set_fixed_width(250)
     column.set_expand(True)
     treeview.append_column(column)
     
-    column = Gtk.TreeViewColumn("Длительность", renderer, text=2)
+    column = Gtk.TreeViewColumn("Длительность", renderer)
+    column.set_cell_data_func(renderer, _set_track_cell, 'duration')
+    column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+    column.set_fixed_width(100)
     treeview.append_column(column)
     
+    treeview.set_fixed_height_mode(True)
+    
     return treeview, liststore
 
+def populate_tracks_liststore(liststore, tracks, on_done=None, chunk_size=TRACKS_FILL_CHUNK, append=False):
+    """Заполнить список треков (объектов Track) порциями в свободное время главного цикла.
+
+    append=True дописывает треки в конец, после уже начатого заполнения, не очищая список.
+    """
+    if append:
+        _shown_tracks.setdefault(id(liststore), []).extend(tracks)
+    else:
+        _shown_tracks[id(liststore)] = list(tracks)
+    
+    fill = _pending_fills.get(id(liststore))
+    if fill and append:
+        fill["queue"].append((tracks, on_done))
+        return
+    
+    # Новое заполнение отменяет незаконченное предыдущее
+    if fill:
+        GLib.source_remove(fill["source"])
+        del _pending_fills[id(liststore)]
+    if not append:
+        liststore.clear()
+    
+    queue = deque([(tracks, on_done)])
+    position = 0
+    
+    def fill_chunk():
+        nonlocal position
+        budget = chunk_size
+        while queue and budget:
+            part, part_done = queue[0]
+            for track in part[position:position + budget]:
+                liststore.append([track.index])
+            step = min(budget, len(part) - position)
+            position += step
+            budget -= step
+            if position >= len(part):
+                queue.popleft()
+                position = 0
+                if part_done:
+                    part_done()
+        
+        if queue:
+            return True
+        _pending_fills.pop(id(liststore), None)
+        return False
+    
+    # Первая порция видна сразу, остальные добавляются без блокировки интерфейса
+    if fill_chunk():
+        _pending_fills[id(liststore)] = {
+            "source": GLib.idle_add(fill_chunk, priority=GLib.PRIORITY_LOW),
+            "queue": queue,
+        }
+
 def create_playlists_treeview():
     """Создать TreeView для списка плейлистов"""
     liststore = Gtk.ListStore(str, str, int)  # название, ID, количество треков
@@ -46,14 +144,41 @@ def create_playlists_treeview():
 def create_downloads_treeview():
     """Создать TreeView для списка загрузок"""
     liststore = Gtk.ListStore(str, str, str)  # имя, путь, размер
+    # Строки вставляются сразу на свое место по имени, без пересортировки всего списка
+    liststore.set_sort_column_id(0, Gtk.SortType.ASCENDING)
     treeview = Gtk.TreeView(model=liststore)
     
     renderer = Gtk.CellRendererText()
+    renderer.set_property("ellipsize", Pango.EllipsizeMode.END)
     
     column = Gtk.TreeViewColumn("Файл", renderer, text=0)
+    column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+    column.set_fixed_width(500)
+    column.set_expand(True)
     treeview.append_column(column)
     
     column = Gtk.TreeViewColumn("Размер", renderer, text=2)
+    column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+    column.set_fixed_width(100)
+    treeview.append_column(column)
+    
+    treeview.set_fixed_height_mode(True)
+    
+    return treeview, liststore
+
+def create_download_jobs_treeview():
+    """Создать TreeView для очереди загрузок"""
+    liststore = Gtk.ListStore(str, str, str)  # трек, состояние, ID задания
+    treeview = Gtk.TreeView(model=liststore)
+    
+    renderer = Gtk.CellRendererText()
+    renderer.set_property("ellipsize", Pango.EllipsizeMode.END)
+    
+    column = Gtk.TreeViewColumn("Трек", renderer, text=0)
+    column.set_expand(True)
+    treeview.append_column(column)
+    
+    column = Gtk.TreeViewColumn("Состояние", Gtk.CellRendererText(), text=1)
     treeview.append_column(column)
     
     return treeview, liststore